@@ -0,0 +1,53 @@
+"""
+Backfill dello storico Google Fit a blocchi mensili, con checkpoint e ripresa automatica.
+
+Esempi:
+    python backfill.py --start 2021-01-01                    # fino a ieri
+    python backfill.py --start 2021-01-01 --end 2024-12-31 --no-wait
+
+Rilanciando lo stesso range si riparte dal primo blocco non completato (cache/backfill.sqlite);
+dentro un blocco si rielaborano solo i giorni che il ledger di sync non ha ancora completi.
+A quota esaurita il job si mette in pausa fino al ripristino (mezzanotte del Pacifico),
+oppure si ferma con --no-wait (utile da cron). Backend, DB, report e client seguono
+la configurazione di main.py.
+"""
+import argparse
+from datetime import datetime, timedelta
+
+import main as app_main
+from modules.metrics import RunMetrics, StartupProfiler
+from modules.backfill import BackfillCheckpoints, BackfillScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill Google Fit a blocchi mensili con checkpoint")
+    parser.add_argument("--start", required=True, help="Primo giorno (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Ultimo giorno (YYYY-MM-DD, default: ieri)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Tentativi per blocco prima di passare oltre")
+    parser.add_argument("--no-wait", dest="wait", action="store_false", help="A quota esaurita esce invece di attendere")
+    args = parser.parse_args()
+
+    print("--- 🚀 MY LIFE TRACKER: BACKFILL ---")
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time())
+
+    startup = StartupProfiler(app_main.PROFILE_STARTUP, started_at=app_main._PROCESS_T0)
+    run_metrics = RunMetrics()
+    rt = app_main.build_runtime(startup, run_metrics)
+    startup.report(run_metrics)
+
+    cache_prefix = "fake_" if app_main.FIT_BACKEND == "fake" else ""
+    scheduler = BackfillScheduler(
+        rt.ledger, BackfillCheckpoints(path=f"cache/{cache_prefix}backfill.sqlite"),
+        run_chunk=lambda days: app_main.run_days(rt, rt.ledger.contiguous_ranges(days), run_metrics),
+        breaker=rt.breaker, retry=rt.retry, max_attempts=args.max_attempts,
+        wait_for_quota=args.wait, metrics=run_metrics
+    )
+    try:
+        scheduler.run(start, end)
+    finally:
+        app_main.finish_run(rt, run_metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark della pipeline giornaliera (fetch + calcoli + report) contro FakeFitService.
+
+Esempi:
+    python benchmarks/bench_pipeline.py                      # 1, 30 e 365 giorni
+    python benchmarks/bench_pipeline.py --days 30 --latency-ms 80 --workers 4
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/<run precedente>.json
+
+Ogni scenario gira in un processo separato (picco RSS non contaminato dagli altri).
+I risultati vengono salvati in JSON (benchmarks/results/) per confrontare i commit.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.fit_service import GoogleFitService
+from modules.fit.fake_service import FakeFitService
+from modules.fit.step_source import StepSourceCache
+from modules.fit.cache import ResponseCache
+
+
+class TimedFitService(GoogleFitService):
+    """GoogleFitService che registra la durata di ogni get_full_day_metrics (anche nei worker)."""
+    durations = []
+
+    def get_full_day_metrics(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().get_full_day_metrics(*args, **kwargs)
+        finally:
+            TimedFitService.durations.append(time.perf_counter() - t0)
+
+
+def percentile(values, p):
+    if not values: return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run_scenario(config):
+    """Esegue un singolo range e ritorna le metriche (gira in un processo dedicato)."""
+    from main import generate_daily_report
+
+    tmp = tempfile.mkdtemp(prefix="bench_fit_")
+    fake = FakeFitService(seed=config["seed"], latency_s=config["latency_ms"] / 1000.0)
+    cache = ResponseCache(path=os.path.join(tmp, "responses.sqlite")) if config["cache"] else None
+    app = TimedFitService(
+        fake, batch=config["batch"], cache=cache, service_factory=lambda: fake,
+        step_source=StepSourceCache(path=os.path.join(tmp, "step_source.json"))
+    )
+
+    start = datetime.strptime(config["start"], "%Y-%m-%d")
+    end = start + timedelta(days=config["days"] - 1)
+
+    if config["cache"]:
+        # Primo passaggio a vuoto: misuriamo il run "a cache calda"
+        for _ in app.get_range_metrics(start, end, workers=config["workers"]): pass
+        fake.stats.update({"http_requests": 0, "api_calls": 0, "errors": 0, "by_method": {}})
+        TimedFitService.durations.clear()
+
+    t0 = time.perf_counter()
+    results = []
+    for date_str, metrics, error in app.get_range_metrics(start, end, workers=config["workers"]):
+        if error is None:
+            metrics['date'] = date_str
+            results.append(metrics)
+    wall = time.perf_counter() - t0
+
+    # Throughput del rendering dei report (solo CPU, nessuna scrittura su disco)
+    render_rounds = max(1, 1000 // max(1, len(results)))
+    r0 = time.perf_counter()
+    for _ in range(render_rounds):
+        for m in results:
+            generate_daily_report(m, m['date'])
+    render_s = time.perf_counter() - r0
+
+    days = config["days"]
+    durations_ms = [d * 1000 for d in TimedFitService.durations]
+    return {
+        "days": days,
+        "days_ok": len(results),
+        "wall_s": round(wall, 3),
+        "api_calls": fake.stats["api_calls"],
+        "http_requests": fake.stats["http_requests"],
+        "api_calls_per_day": round(fake.stats["api_calls"] / days, 2),
+        "http_requests_per_day": round(fake.stats["http_requests"] / days, 2),
+        "calls_by_method": fake.stats["by_method"],
+        "day_latency_ms": {
+            "p50": round(percentile(durations_ms, 50), 2) if durations_ms else None,
+            "p95": round(percentile(durations_ms, 95), 2) if durations_ms else None,
+            "max": round(max(durations_ms), 2) if durations_ms else None,
+        },
+        # ru_maxrss è in KB su Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "report_render_per_s": round(render_rounds * len(results) / render_s, 1) if render_s > 0 else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {r["days"]: r for r in json.load(f)["results"]}
+    print(f"\n📊 Confronto con {previous_path}")
+    for r in current["results"]:
+        old = previous.get(r["days"])
+        if not old: continue
+        for key in ("wall_s", "http_requests_per_day", "peak_rss_mb", "report_render_per_s"):
+            if old.get(key) and r.get(key) is not None:
+                delta = (r[key] - old[key]) / old[key] * 100
+                print(f"   {r['days']:>4}g {key:<22} {old[key]:>10} → {r[key]:>10} ({delta:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline Fit contro backend offline")
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 30, 365])
+    parser.add_argument("--start", default="2025-01-01")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latenza simulata per richiesta HTTP")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-batch", dest="batch", action="store_false")
+    parser.add_argument("--cache", action="store_true", help="Misura il run a cache calda")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="File JSON dei risultati")
+    parser.add_argument("--compare", default=None, help="JSON di un run precedente da confrontare")
+    args = parser.parse_args()
+
+    base = {"start": args.start, "latency_ms": args.latency_ms, "workers": args.workers,
+            "batch": args.batch, "cache": args.cache, "seed": args.seed}
+    run = {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"), "config": base, "results": []}
+
+    ctx = multiprocessing.get_context("spawn")
+    for days in args.days:
+        print(f"⏱️ Scenario {days} giorni...")
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run_scenario, (dict(base, days=days),))
+        run["results"].append(r)
+        print(f"   wall {r['wall_s']}s | {r['http_requests_per_day']} req HTTP/giorno ({r['api_calls_per_day']} chiamate API) | "
+              f"p50 {r['day_latency_ms']['p50']}ms p95 {r['day_latency_ms']['p95']}ms | "
+              f"RSS {r['peak_rss_mb']}MB | {r['report_render_per_s']} report/s")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{run['timestamp'].replace(':', '')}_{run['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\n💾 Risultati salvati in {output}")
+
+    if args.compare: compare(run, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,42 @@
+import time
+_PROCESS_T0 = time.perf_counter()
 import os
-import json
-from datetime import datetime, timedelta
-from modules.auth_manager import GoogleAuthManager
-from modules.fit_service import GoogleFitService
-from modules.db_manager import SupabaseManager
-from googleapiclient.discovery import build
+from datetime import datetime
+from types import SimpleNamespace
+from modules.metrics import RunMetrics, StartupProfiler
+from modules.pipeline import DailyPipeline, DbSink, ReportFileSink, HistorySink
+# Le dipendenze pesanti (googleapiclient, google-auth, supabase, numpy, httpx) vengono importate
+# solo dove servono: i run brevi da cron non pagano ciò che non usano
 
 # CONFIGURAZIONE
 START_DATE = "2026-01-01" 
 END_DATE = "2026-01-10"   
+SYNC_MODE = "range"        # "range": da START_DATE a END_DATE | "incremental": solo i giorni non definitivi da START_DATE a oggi (cron)
+SYNC_SETTLE_HOURS = 48     # Un giorno è definitivo solo se completo e sincronizzato N ore dopo la sua fine (dati in ritardo)
 GENERATE_REPORT_FILE = True 
 SAVE_TO_DB = True          
+SAVE_TO_HISTORY = True     # Copia locale colonnare (HISTORY_DIR) per analisi offline, vedi HistoryStore
+HISTORY_DIR = "history"
+USE_BASELINES = True       # Medie personali 7/28 giorni, debito di sonno e carico acuto:cronico (raw_data.trends)
+USE_BATCH_REQUESTS = True  # Richieste indipendenti di un giorno in una sola BatchHttpRequest
+USE_RESPONSE_CACHE = True  # Cache su disco delle risposte Fit (cache/fit_responses.sqlite)
+CACHE_FINALIZED_HOURS = 72 # Finestre chiuse da più di N ore non vengono mai riscaricate
+WORKERS = 4                # Giorni elaborati in parallelo (1 = seriale)
+API_RATE_PER_MIN = 300     # Tetto richieste/minuto verso la Fitness API (quota per utente)
+MAX_RETRIES = 4            # Tentativi extra per richiesta su 429/5xx/timeout (backoff esponenziale con jitter)
+RETRY_BUDGET_S = 300       # Secondi totali di attesa per retry nel run: esauriti, i giorni restano incompleti
+CIRCUIT_MAX_PAUSE_S = 1800 # Pausa massima di tutti i worker a quota esaurita, poi le richieste falliscono subito
+RESET_STEP_SOURCE = False  # True dopo un cambio di orologio: ricalcola lo stream dei passi
+DB_CHUNK_SIZE = 100        # Righe daily_logs per singola upsert verso Supabase
+USE_RAW_HEART_RATE = True  # Statistiche HR dai campioni grezzi (datasets.get) invece che dalle medie a 5 minuti
+COMPACT_RAW_SERIES = False # raw_data.heart_rate_samples compatto (delta + base64, vedi SampleSeries.decode)
+SKIP_UNCHANGED_ROWS = True # Non riscrive i giorni il cui contenuto non è cambiato (impronta hash)
+FIT_BACKEND = "google"     # "google" | "fake" (offline: fixture o dati sintetici) | "record" (google + salva fixture)
+FIXTURES_DIR = "fixtures/fit"
+FIT_CLIENT = "sync"        # "sync" (googleapiclient + thread) | "async" (httpx, HTTP/2, richieste concorrenti)
+PROFILE_STARTUP = False    # Stampa il costo di import e inizializzazione di ogni componente
+PIPELINE_QUEUE_SIZE = 8    # Giorni in attesa per ogni stadio (DB, report) prima di rallentare il fetch
+METRICS_DIR = "metrics"    # Riepilogo del run: run_summary.json + fit_sync.prom (textfile collector)
 
 def generate_daily_report(data, date_str):
     def val(v, unit="", default="N/D"):
@@ -66,6 +92,20 @@ def generate_daily_report(data, date_str):
         report.append(f"     - Freq. Respiratoria: {val(resp, 'rpm')}")
     report.append("")
 
+    trends = data['raw_data'].get('trends')
+    if trends:
+        b = trends['baseline']
+        def delta(k, unit):
+            d = b[k]['delta_28d']
+            return f"{d:+g}{' ' + unit if unit else ''} vs media 28gg ({b[k]['avg_28d']})" if d is not None else "N/D"
+        report.append(f"📈 TREND PERSONALI")
+        report.append(f"   • RHR: {delta('rhr', 'bpm')}")
+        report.append(f"   • Sonno: {delta('sleep_min', 'min')}")
+        report.append(f"   • Passi: {delta('steps', None)}")
+        report.append(f"   • Debito di Sonno (7gg): {val(trends['sleep_debt_7d_min'], 'min')}")
+        report.append(f"   • Carico Acuto:Cronico: {val(trends['acute_chronic_ratio'])}")
+        report.append("")
+
     report.append(f"⚖️ COMPOSIZIONE CORPOREA")
     report.append(f"   • Peso: {val(data['health_weight_kg'], 'kg')}")
     report.append(f"   • BMI (IMC): {val(data['health_bmi'])}")
@@ -80,65 +120,243 @@ def generate_daily_report(data, date_str):
     report.append(f"   • Acqua Bevuta: {val(data['health_water_ml'], 'ml')}")
     report.append("")
     
+    status = data['raw_data'].get('fetch_status', {})
+    if not status.get('complete', True):
+        report.append(f"⚠️ DATI INCOMPLETI (N/D = non scaricato): {', '.join(status['missing'])}")
+        report.append("")
+
     report.append(f"----------------------------------------")
     report.append(f"Generato il: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     return "\n".join(report)
 
+def build_fit_service_factory(startup):
+    """Ritorna la factory del service Fitness (googleapiclient o fake) in base a FIT_BACKEND."""
+    if FIT_BACKEND == "fake":
+        with startup.step("import fake service"):
+            from modules.fit.fake_service import FakeFitService
+        print(f"🧪 Backend Fit offline (fixture: {FIXTURES_DIR})")
+        fake = FakeFitService(fixtures_dir=FIXTURES_DIR) # Thread-safe: un'unica istanza per tutti i worker
+        return lambda: fake
+
+    from modules.auth_manager import GoogleAuthManager
+    with startup.step("autenticazione (google-auth)"):
+        creds = GoogleAuthManager().authenticate()
+    with startup.step("import googleapiclient + discovery"):
+        # Documento di discovery letto e parsato una volta sola (cache locale), non a ogni worker
+        from modules.fit.discovery import build_fitness_service, fitness_document
+        fitness_document()
+    if FIT_BACKEND == "record":
+        from modules.fit.fake_service import RecordingFitService
+        print(f"⏺️ Registrazione risposte Fit in {FIXTURES_DIR}")
+        return lambda: RecordingFitService(build_fitness_service(creds), FIXTURES_DIR)
+    return lambda: build_fitness_service(creds)
+
+def build_async_fetcher(startup, **kwargs):
+    """AsyncFitFetcher per FIT_CLIENT = "async" (token da GoogleAuthManager, o fake in-process)."""
+    with startup.step("import httpx (client async)"):
+        from modules.fit.async_fetcher import AsyncFitFetcher
+    if FIT_BACKEND == "fake":
+        with startup.step("import fake service"):
+            from modules.fit.fake_service import FakeFitService
+            from modules.fit.fake_http import FakeFitTransport
+        print(f"🧪 Backend Fit offline (fixture: {FIXTURES_DIR})")
+        transport = FakeFitTransport(FakeFitService(fixtures_dir=FIXTURES_DIR))
+        return AsyncFitFetcher(lambda force_refresh=False: "fake", transport=transport, **kwargs)
+    if FIT_BACKEND == "record":
+        raise ValueError("La registrazione delle fixture richiede FIT_CLIENT = 'sync'")
+    from modules.auth_manager import GoogleAuthManager
+    return AsyncFitFetcher.from_auth_manager(GoogleAuthManager(), **kwargs)
+
+def write_run_metrics(run_metrics, cache, limiter, retry, breaker):
+    """Riepilogo finale del run in JSON e in formato Prometheus (node_exporter textfile)."""
+    if cache is not None:
+        st = cache.stats()
+        run_metrics.gauge("fit_cache_hit_rate", round(st['hit_rate'], 4))
+        run_metrics.gauge("fit_cache_entries", st['entries'])
+    run_metrics.gauge("fit_rate_limit_throttle_events", limiter.throttle_events)
+    run_metrics.gauge("fit_rate_limit_current_per_min", int(limiter.rate * 60))
+    run_metrics.gauge("fit_retry_budget_spent_seconds", round(retry.spent_s, 3))
+    run_metrics.gauge("fit_circuit_open_events", breaker.open_events)
+    run_metrics.gauge("fit_circuit_open_seconds", round(breaker.open_seconds, 3))
+    try:
+        run_metrics.write_json(os.path.join(METRICS_DIR, "run_summary.json"))
+        run_metrics.write_prometheus(os.path.join(METRICS_DIR, "fit_sync.prom"))
+        print(f"📈 Metriche del run salvate in {METRICS_DIR}/")
+    except OSError as e:
+        print(f"⚠️ Impossibile salvare le metriche del run: {e}")
+
+    errors = run_metrics.summary()["counters"].get("fit_errors_total", {})
+    for labels, count in sorted(errors.items()):
+        print(f"   ⚠️ Errori Fit [{labels}]: {count}")
+
+def record_sync_state(ledger, pipeline, db_failures):
+    """Aggiorna il ledger: completo solo se fetch completo e nessuno stadio ha fallito quel giorno."""
+    for date_str in pipeline.dates:
+        error = db_failures.get(date_str)
+        for errors in pipeline.errors.values():
+            # Un errore in close (es. flush finale) può riguardare qualsiasi giorno dello stadio
+            error = error or errors.get(date_str) or errors.get("close")
+        missing = pipeline.partial.get(date_str, [])
+        ledger.record(date_str, complete=error is None and not missing, missing=missing, error=error)
+    for date_str, error in pipeline.fetch_errors.items():
+        ledger.record(date_str, complete=False, error=error)
+
+def reports_dir():
+    """Directory dei report: quelli del backend finto non sovrascrivono i report reali."""
+    return "reports_fake" if FIT_BACKEND == "fake" else "reports"
+
+def history_dir():
+    """Directory dello HistoryStore: il backend finto ha il suo storico, i dati sintetici non si mescolano a quelli reali."""
+    return os.path.join(HISTORY_DIR, "fake") if FIT_BACKEND == "fake" else HISTORY_DIR
+
+def build_runtime(startup, run_metrics):
+    """
+    Componenti condivisi di un run (main e backfill): client Fit e fetch_range, cache, rate limiter,
+    retry, circuito, ledger di sync, storico e baseline personali (se attivi) e, se SAVE_TO_DB, il client Supabase.
+    """
+    with startup.step("import cache / rate limiter"):
+        from modules.fit.cache import ResponseCache
+        from modules.fit.ratelimit import RateLimiter
+        from modules.fit.retry import RetryPolicy, CircuitBreaker
+        from modules.fit.step_source import StepSourceCache
+        from modules.sync_ledger import SyncLedger
+
+    # Il backend finto usa cache separate: le sue risposte non devono mai finire nei run reali
+    cache_prefix = "fake_" if FIT_BACKEND == "fake" else ""
+    rt = SimpleNamespace(db=None)
+    rt.cache = ResponseCache(path=f"cache/{cache_prefix}fit_responses.sqlite", finalized_hours=CACHE_FINALIZED_HOURS) if USE_RESPONSE_CACHE else None
+    rt.limiter = RateLimiter(rate_per_min=API_RATE_PER_MIN)
+    # Condivisi da tutti i worker: budget di attesa per i retry e pausa comune a quota esaurita
+    rt.retry = RetryPolicy(max_retries=MAX_RETRIES, budget_s=RETRY_BUDGET_S)
+    rt.breaker = CircuitBreaker(max_open_s=CIRCUIT_MAX_PAUSE_S)
+    step_source = StepSourceCache(path=f"cache/{cache_prefix}step_source.json")
+    rt.ledger = SyncLedger(path=f"cache/{cache_prefix}sync_ledger.sqlite", settle_hours=SYNC_SETTLE_HOURS)
+
+    with startup.step("import fit service (pytz, numpy)"):
+        from modules.fit_service import GoogleFitService
+
+    if FIT_CLIENT == "async":
+        from modules.async_fit_service import AsyncGoogleFitService
+        fetcher = build_async_fetcher(startup, cache=rt.cache, limiter=rt.limiter, step_source=step_source, metrics=run_metrics,
+                                      retry=rt.retry, breaker=rt.breaker)
+        rt.app = AsyncGoogleFitService(fetcher, metrics=run_metrics, raw_hr=USE_RAW_HEART_RATE, compact_series=COMPACT_RAW_SERIES)
+        # WORKERS = giorni in corso contemporaneamente sull'event loop
+        rt.fetch_range = lambda s, e: rt.app.iter_range_metrics(s, e, concurrency=WORKERS)
+    else:
+        service_factory = build_fit_service_factory(startup)
+        with startup.step("build service Fitness"):
+            fit_service = service_factory()
+        rt.app = GoogleFitService(
+            fit_service, batch=USE_BATCH_REQUESTS, cache=rt.cache, limiter=rt.limiter,
+            # Ogni worker thread ha il suo service (httplib2 non è thread-safe)
+            service_factory=service_factory,
+            step_source=step_source,
+            metrics=run_metrics,
+            raw_hr=USE_RAW_HEART_RATE,
+            compact_series=COMPACT_RAW_SERIES,
+            retry=rt.retry,
+            breaker=rt.breaker
+        )
+        rt.fetch_range = lambda s, e: rt.app.get_range_metrics(s, e, workers=WORKERS)
+
+    rt.history = None
+    if SAVE_TO_HISTORY:
+        from modules.history_store import HistoryStore
+        rt.history = HistoryStore(history_dir())
+
+    rt.baselines = None
+    if USE_BASELINES:
+        from modules.fit.baselines import RollingBaselines
+        # Lo storico locale serve solo per i giorni più vecchi della finestra (rielaborazioni)
+        rt.baselines = RollingBaselines(path=f"cache/{cache_prefix}baselines.sqlite", history=rt.history)
+
+    if SAVE_TO_DB and FIT_BACKEND == "fake":
+        # I giorni sintetici non devono mai finire nella tabella daily_logs reale
+        print("🧪 Backend Fit offline: scrittura su Supabase disattivata")
+    elif SAVE_TO_DB:
+        with startup.step("import supabase + client"):
+            from modules.db_manager import SupabaseManager
+            rt.db = SupabaseManager(fingerprints_file=f"cache/{cache_prefix}db_fingerprints.json")
+
+    if RESET_STEP_SOURCE:
+        rt.app.fetcher.invalidate_step_source()
+        print("🔁 Sorgente passi invalidata: verrà risolta di nuovo")
+    return rt
+
+def run_days(rt, ranges, run_metrics):
+    """
+    Fetch dei range [(inizio, fine)] attraverso la pipeline (DB, report) e aggiornamento del ledger.
+    Stadi nuovi a ogni chiamata: al ritorno le righe sono già tutte scritte. Ritorna la pipeline.
+    """
+    # Stadi a valle del fetch: ognuno col suo thread e la sua coda (aggiungere/togliere sink qui)
+    sinks = []
+    writer = None
+    if rt.db is not None:
+        from modules.db_manager import BufferedDailyLogWriter
+        # Le scritture DB avvengono in background a blocchi, mentre il fetch continua
+        writer = BufferedDailyLogWriter(rt.db, chunk_size=DB_CHUNK_SIZE, skip_unchanged=SKIP_UNCHANGED_ROWS, metrics=run_metrics)
+        sinks.append(DbSink(writer))
+    if GENERATE_REPORT_FILE:
+        sinks.append(ReportFileSink(generate_daily_report, reports_dir()))
+    if rt.history is not None:
+        sinks.append(HistorySink(rt.history))
+
+    # Produttore: le aggregate giornaliere vengono scaricate per tutto il range in poche chiamate,
+    # i giorni arrivano in ordine e passano agli stadi mentre si scaricano i successivi
+    pipeline = DailyPipeline(sinks, queue_size=PIPELINE_QUEUE_SIZE, metrics=run_metrics)
+    source = (item for s, e in ranges for item in rt.fetch_range(s, e))
+    if rt.baselines is not None:
+        # Nel produttore, in ordine di data: i trend sono già nel payload quando arriva agli stadi
+        source = rt.baselines.annotate(source)
+    pipeline.run(source)
+    print(f"\n📊 Giorni elaborati: {pipeline.processed} (incompleti: {len(pipeline.partial)}), fetch falliti: {len(pipeline.fetch_errors)}")
+    if pipeline.partial:
+        # Solo questi giorni vanno riscaricati: gli altri sono completi
+        print(f"   ⚠️ Giorni incompleti da riscaricare: {', '.join(sorted(pipeline.partial))}")
+
+    # Il ledger decide cosa rielaborare al prossimo run incrementale
+    record_sync_state(rt.ledger, pipeline, writer.failures if writer is not None else {})
+    return pipeline
+
+def finish_run(rt, run_metrics):
+    """Riepilogo finale (ledger, cache, rate limit, retry) e metriche del run su disco."""
+    st = rt.ledger.stats()
+    print(f"📒 Ledger sync: {st['days']} giorni registrati, {st['complete']} completi, {st['finalized']} definitivi")
+    if rt.cache is not None:
+        st = rt.cache.stats()
+        print(f"\n📦 Cache Fit: {st['hits']} hit / {st['misses']} miss ({int(st['hit_rate'] * 100)}%), {st['entries']} voci")
+    if rt.limiter.throttle_events:
+        print(f"⏳ Rate limit Fit: {rt.limiter.throttle_events} rallentamenti (velocità attuale {int(rt.limiter.rate * 60)} req/min)")
+    if rt.retry.spent_s or rt.breaker.open_events:
+        print(f"🔁 Retry Fit: {rt.retry.spent_s:.1f}s di attesa (budget {RETRY_BUDGET_S}s), circuito aperto {rt.breaker.open_events} volte")
+
+    write_run_metrics(run_metrics, rt.cache, rt.limiter, rt.retry, rt.breaker)
+    if rt.cache is not None: rt.cache.close()  # Scrive gli ultimi accessi in sospeso (LRU)
+
 def main():
     print("--- 🚀 MY LIFE TRACKER: REPORT GENERATOR ---")
-    
-    if GENERATE_REPORT_FILE and not os.path.exists("reports"):
-        os.makedirs("reports")
 
-    auth_manager = GoogleAuthManager()
-    creds = auth_manager.authenticate()
-    fit_service = build('fitness', 'v1', credentials=creds)
-    
-    app = GoogleFitService(fit_service)
-    db = SupabaseManager()
+    startup = StartupProfiler(PROFILE_STARTUP, started_at=_PROCESS_T0)
+    run_metrics = RunMetrics()
+    rt = build_runtime(startup, run_metrics)
+    startup.report(run_metrics)
 
     start = datetime.strptime(START_DATE, "%Y-%m-%d")
     end = datetime.strptime(END_DATE, "%Y-%m-%d")
-    
-    current = start
-    while current <= end:
-        date_str = current.strftime("%Y-%m-%d")
-        print(f"\n🔄 Elaborazione: {date_str}")
-        
-        metrics = None
-        
-        # 1. SCARICA DATI (Fondamentale)
-        try:
-            metrics = app.get_full_day_metrics(current)
-            metrics['date'] = date_str # Chiave primaria per DB
-        except Exception as e:
-            print(f"   ❌ ERRORE FETCH DATI: {e}")
-            current += timedelta(days=1)
-            continue # Se non ho i dati, passo al prossimo giorno
-
-        # 2. SALVA SU DB (Opzionale e Isolato)
-        if SAVE_TO_DB:
-            try:
-                db.upsert_daily_log(metrics)
-                print("   ✅ DB Aggiornato")
-            except Exception as e:
-                print(f"   ⚠️ Errore scrittura DB (Ma continuo): {e}")
-
-        # 3. GENERA FILE REPORT (Isolato)
-        if GENERATE_REPORT_FILE:
-            try:
-                report_text = generate_daily_report(metrics, date_str)
-                filename = f"reports/report_{date_str}.txt"
-                with open(filename, "w", encoding="utf-8") as f:
-                    f.write(report_text)
-                print(f"   📄 Report creato: {filename}")
-            except Exception as e:
-                print(f"   ❌ Errore creazione Report: {e}")
-
-        current += timedelta(days=1)
+    if SYNC_MODE == "incremental":
+        # Solo giorni mancanti, incompleti o ancora in assestamento, raggruppati in blocchi consecutivi
+        days = rt.ledger.pending(start, datetime.now())
+        ranges = rt.ledger.contiguous_ranges(days)
+        print(f"🔎 Sync incrementale: {len(days)} giorni da sincronizzare in {len(ranges)} blocchi")
+    else:
+        ranges = [(start, end)]
+    run_metrics.gauge("sync_days_planned", sum((e - s).days + 1 for s, e in ranges))
+
+    run_days(rt, ranges, run_metrics)
+    finish_run(rt, run_metrics)
 
     print("\n✅ FINE ELABORAZIONE.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,108 @@
+import queue
+import asyncio
+import threading
+from collections import deque
+from modules.fit_service import GoogleFitService
+
+class AsyncGoogleFitService(GoogleFitService):
+    """
+    Controparte asyncio di GoogleFitService, costruita su AsyncFitFetcher.
+    Usa gli stessi piani di fetch (_range_plan, _day_plan) e gli stessi calcoli: cambia solo
+    l'esecuzione, con le query indipendenti di ogni fase lanciate insieme (asyncio.gather)
+    e più giorni in corso contemporaneamente su un unico pool di connessioni.
+    """
+    def __init__(self, fetcher, metrics=None, raw_hr=True, compact_series=False):
+        super().__init__(None, metrics=metrics, raw_hr=raw_hr, compact_series=compact_series)
+        self.fetcher = fetcher
+
+    @staticmethod
+    async def _run_plan_async(plan, fetch_many):
+        """Come GoogleFitService._run_plan, con un fetch_many coroutine."""
+        try:
+            calls = next(plan)
+            while True:
+                try:
+                    results = await fetch_many(calls)
+                except Exception as e:
+                    calls = plan.throw(e)
+                else:
+                    calls = plan.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+    async def get_full_day_metrics(self, target_date=None, prefetched=None, watch_id=None, body_timeline=None):
+        if watch_id is None: watch_id = await self.fetcher.find_step_source()
+        return await self._run_plan_async(self._day_plan(target_date, prefetched, watch_id, body_timeline), self.fetcher.fetch_many)
+
+    async def get_range_metrics(self, start_date, end_date, concurrency=4):
+        """
+        Generatore asincrono di (date_str, metrics, errore), in ordine di data.
+        Fino a `concurrency` giorni sono in corso insieme, e al massimo 2 * concurrency
+        tra in corso e pronti non ancora consegnati (le richieste HTTP restano
+        comunque limitate da max_in_flight del fetcher e dal rate limiter).
+        """
+        days = self._range_days(start_date, end_date)
+        watch_id = await self.fetcher.find_step_source()
+        prefetched, body_timeline = await self._run_plan_async(self._range_plan(days, watch_id), self.fetcher.fetch_many)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def _process_day(day):
+            date_str = day.strftime("%Y-%m-%d")
+            async with semaphore:
+                t0 = loop.time()
+                try:
+                    metrics = await self.get_full_day_metrics(day, prefetched=prefetched.get(date_str), watch_id=watch_id, body_timeline=body_timeline)
+                    result = date_str, metrics, None
+                except Exception as e:
+                    if self.metrics is not None: self.metrics.error("day_errors_total", e, date=date_str)
+                    result = date_str, None, e
+                if self.metrics is not None:
+                    self.metrics.observe("day_duration_seconds", loop.time() - t0)
+                    self.metrics.incr("days_total", result=self._day_result(result))
+                return result
+
+        # Finestra scorrevole di task (2 * concurrency giorni creati e non ancora consegnati):
+        # se il consumatore rallenta, il fetch si ferma invece di accumulare giorni pronti
+        window = 2 * concurrency
+        pending = deque()
+        try:
+            for day in days:
+                pending.append(asyncio.ensure_future(_process_day(day)))
+                if len(pending) >= window:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending: task.cancel()
+
+    def iter_range_metrics(self, start_date, end_date, concurrency=4, buffer_days=8):
+        """
+        Versione sincrona di get_range_metrics (stesso formato di GoogleFitService.get_range_metrics),
+        per la pipeline di main: l'event loop gira in un thread dedicato e passa i giorni da una
+        coda limitata. Il client HTTP viene chiuso a fine range.
+        """
+        out = queue.Queue(maxsize=buffer_days)
+        done = object()
+
+        async def _produce():
+            try:
+                async for item in self.get_range_metrics(start_date, end_date, concurrency=concurrency):
+                    await asyncio.to_thread(out.put, item)
+            finally:
+                await self.fetcher.aclose()
+
+        def _run():
+            try:
+                asyncio.run(_produce())
+            except Exception as e:
+                out.put(e)
+            out.put(done)
+
+        threading.Thread(target=_run, name="fit-async-loop", daemon=True).start()
+        while True:
+            item = out.get()
+            if item is done: return
+            if isinstance(item, Exception): raise item
+            yield item
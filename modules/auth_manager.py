@@ -1,8 +1,7 @@
 import os
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+import threading
+# google-auth e oauthlib vengono importati solo quando servono (avvio più rapido)
 
 # Definiamo gli SCOPES necessari. 
 # NOTA: Devono coincidere con quelli che hai abilitato su Google Cloud.
@@ -28,6 +27,8 @@ class GoogleAuthManager:
         base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.secrets_file = os.path.join(base_path, 'config', 'client_secrets.json')
         self.token_file = os.path.join(base_path, 'config', 'token.json')
+        self._creds = None
+        self._lock = threading.Lock()
 
     def authenticate(self):
         """
@@ -35,6 +36,9 @@ class GoogleAuthManager:
         Se esiste già un token valido in config/token.json, lo usa.
         Altrimenti, apre il browser per il login e salva il nuovo token.
         """
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
         creds = None
         
         # 1. Controllo se esiste già un token salvato
@@ -50,6 +54,7 @@ class GoogleAuthManager:
             else:
                 # 2b. Primo login assoluto: Apertura Browser
                 print("🌐 Avvio procedura di login nel browser...")
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.secrets_file, SCOPES)
                 # run_local_server apre una porta locale per ricevere il callback da Google
@@ -62,6 +67,22 @@ class GoogleAuthManager:
                 
         return creds
 
+    def access_token(self, force_refresh=False):
+        """
+        Access token valido per le chiamate REST dirette (es. AsyncFitFetcher).
+        Rinnovato se scaduto o se force_refresh (es. dopo un 401); thread-safe.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = self.authenticate()
+            if force_refresh or not self._creds.valid:
+                from google.auth.transport.requests import Request
+                print("🔄 Refreshing del token...")
+                self._creds.refresh(Request())
+                with open(self.token_file, 'w') as token:
+                    token.write(self._creds.to_json())
+            return self._creds.token
+
 # Test rapido se esegui questo file direttamente
 if __name__ == "__main__":
     manager = GoogleAuthManager()
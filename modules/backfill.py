@@ -0,0 +1,165 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import pytz
+
+def month_chunks(start_date, end_date):
+    """[(inizio, fine)] per mese di calendario, tagliati su [start_date, end_date]."""
+    chunks = []
+    current = start_date
+    while current <= end_date:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunks.append((current, min(end_date, next_month - timedelta(days=1))))
+        current = next_month
+    return chunks
+
+def next_quota_reset(now=None, timezone='America/Los_Angeles'):
+    """Prossima mezzanotte del Pacifico: quando Google ripristina le quote giornaliere delle API."""
+    tz = pytz.timezone(timezone)
+    now = now.astimezone(tz) if now is not None else datetime.now(tz)
+    tomorrow = (now + timedelta(days=1)).date()
+    return tz.localize(datetime(tomorrow.year, tomorrow.month, tomorrow.day))
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60: return f"{seconds}s"
+    if seconds < 3600: return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+class BackfillCheckpoints:
+    """
+    Checkpoint dei blocchi (mesi) di un backfill, su SQLite (cache/backfill.sqlite).
+    Un job è identificato dal suo range: rilanciando lo stesso range si riparte dai blocchi
+    non ancora "done". Stato di un blocco: done (tutti i giorni completi e scritti) o
+    partial (tentativi esauriti: i giorni mancanti restano nel ledger per la sync incrementale).
+    """
+    def __init__(self, path=None):
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            path = os.path.join(base_dir, 'cache', 'backfill.sqlite')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS backfill_chunks ("
+            " job TEXT NOT NULL, chunk_start TEXT NOT NULL, chunk_end TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL, incomplete_days INTEGER NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (job, chunk_start))"
+        )
+        self._conn.commit()
+
+    def statuses(self, job):
+        """{chunk_start: status} dei blocchi già registrati per il job."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT chunk_start, status FROM backfill_chunks WHERE job = ?", (job,)))
+
+    def mark(self, job, chunk_start, chunk_end, status, attempts, incomplete_days=0):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO backfill_chunks"
+                " (job, chunk_start, chunk_end, status, attempts, incomplete_days, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job, chunk_start, chunk_end, status, attempts, incomplete_days, time.time())
+            )
+            self._conn.commit()
+
+
+class BackfillScheduler:
+    """
+    Import dello storico a blocchi mensili, ripristinabile.
+    - run_chunk(giorni) elabora i giorni indicati (fetch → DB → report) e aggiorna il ledger;
+      di un blocco si elaborano solo i giorni che il ledger non ha ancora completi,
+      così un blocco interrotto a metà riprende dal primo giorno mancante.
+    - Blocco con tutti i giorni completi: checkpoint "done", saltato ai rilanci successivi.
+    - Quota esaurita (circuito fermo): pausa fino al ripristino delle quote (mezzanotte del
+      Pacifico), poi il blocco riprende con retry e circuito azzerati. Con wait_for_quota=False
+      il job si ferma e riparte dal checkpoint al prossimo lancio (es. da cron).
+    - Altri errori persistenti: dopo max_attempts il blocco è "partial" e si passa al successivo.
+    - Avanzamento con ETA calcolata sul tempo attivo (pause per quota escluse).
+    """
+    def __init__(self, ledger, checkpoints, run_chunk, breaker=None, retry=None, max_attempts=3,
+                 wait_for_quota=True, metrics=None, sleep=time.sleep):
+        self.ledger = ledger
+        self.checkpoints = checkpoints
+        self.run_chunk = run_chunk
+        self.breaker = breaker
+        self.retry = retry
+        self.max_attempts = max_attempts
+        self.wait_for_quota = wait_for_quota
+        self.metrics = metrics
+        self.sleep = sleep
+
+    def run(self, start_date, end_date):
+        """Ritorna True se tutti i blocchi sono stati elaborati (done o partial), False se fermato per quota."""
+        job = f"{start_date:%Y-%m-%d}:{end_date:%Y-%m-%d}"
+        chunks = month_chunks(start_date, end_date)
+        statuses = self.checkpoints.statuses(job)
+        days_of = lambda c: (c[1] - c[0]).days + 1
+
+        total_days = sum(days_of(c) for c in chunks)
+        done_days = sum(days_of(c) for c in chunks if statuses.get(f"{c[0]:%Y-%m-%d}") == "done")
+        todo = [c for c in chunks if statuses.get(f"{c[0]:%Y-%m-%d}") != "done"]
+        print(f"🗂️ Backfill {job}: {len(chunks)} blocchi, {len(chunks) - len(todo)} già completati (checkpoint)")
+
+        self._progress = {"total": total_days, "done": done_days, "active_s": 0.0, "run_days": 0}
+        for chunk_start, chunk_end in todo:
+            if not self._run_one(job, chunk_start, chunk_end): return False
+            self._progress["done"] += days_of((chunk_start, chunk_end))
+            self._report_progress()
+        print(f"✅ Backfill {job} completato")
+        return True
+
+    def _run_one(self, job, chunk_start, chunk_end):
+        key = f"{chunk_start:%Y-%m-%d}"
+        label = f"{chunk_start:%Y-%m}"
+        attempts = 0
+        while True:
+            days = self.ledger.incomplete(chunk_start, chunk_end)
+            if not days:
+                self.checkpoints.mark(job, key, f"{chunk_end:%Y-%m-%d}", "done", attempts)
+                print(f"📌 Checkpoint {label}: blocco completato")
+                return True
+            if attempts >= self.max_attempts:
+                self.checkpoints.mark(job, key, f"{chunk_end:%Y-%m-%d}", "partial", attempts, len(days))
+                print(f"⚠️ Blocco {label}: {len(days)} giorni ancora incompleti dopo {attempts} tentativi, passo oltre")
+                return True
+
+            attempts += 1
+            print(f"\n📦 Blocco {label}: {len(days)} giorni da elaborare (tentativo {attempts})")
+            t0 = time.monotonic()
+            self.run_chunk(days)
+            self._progress["active_s"] += time.monotonic() - t0
+            self._progress["run_days"] += len(days)
+
+            if self.breaker is not None and self.breaker.state == "stopped":
+                # Quota esaurita: il tentativo non conta, si riprende nella prossima finestra di quota
+                attempts -= 1
+                if not self._wait_quota(): return False
+
+    def _wait_quota(self):
+        resume_at = next_quota_reset()
+        pause_s = max(0.0, resume_at.timestamp() - time.time())
+        if not self.wait_for_quota:
+            print(f"⏸️ Quota Fit esaurita: backfill fermato, rilanciare dopo {resume_at:%Y-%m-%d %H:%M %Z} per riprendere")
+            return False
+        print(f"⏸️ Quota Fit esaurita: pausa di {format_duration(pause_s)} fino a {resume_at:%Y-%m-%d %H:%M %Z}, poi riprendo")
+        if self.metrics is not None: self.metrics.incr("backfill_quota_pauses_total")
+        self.sleep(pause_s)
+        if self.breaker is not None: self.breaker.reset()
+        if self.retry is not None: self.retry.reset()
+        return True
+
+    def _report_progress(self):
+        p = self._progress
+        remaining = p["total"] - p["done"]
+        eta = p["active_s"] / p["run_days"] * remaining if p["run_days"] else None
+        pct = p["done"] / p["total"] * 100 if p["total"] else 100.0
+        eta_txt = format_duration(eta) if eta is not None else "n/d"
+        print(f"📈 Backfill: {p['done']}/{p['total']} giorni ({pct:.1f}%), ETA {eta_txt}")
+        if self.metrics is not None:
+            self.metrics.gauge("backfill_days_done", p["done"])
+            self.metrics.gauge("backfill_days_total", p["total"])
+            if eta is not None: self.metrics.gauge("backfill_eta_seconds", round(eta, 1))
@@ -1,14 +1,22 @@
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import json
+import time
+import hashlib
+import queue
+import atexit
+import threading
 
 class SupabaseManager:
-    def __init__(self):
+    def __init__(self, fingerprints_file=None):
         # 1. Calcoliamo il percorso assoluto della root del progetto
         # (Saliamo di due livelli da modules/db_manager.py)
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         env_path = os.path.join(base_dir, '.env')
 
+        # Import ritardati: supabase è pesante e serve solo se si scrive davvero sul DB
+        from dotenv import load_dotenv
+        from supabase import create_client
+
         # 2. Carichiamo le variabili d'ambiente dal file .env
         # override=True forza l'aggiornamento se per caso ce ne sono già in memoria
         loaded = load_dotenv(dotenv_path=env_path, override=True)
@@ -30,7 +38,12 @@ class SupabaseManager:
             raise ValueError("Credenziali Supabase mancanti nel file .env")
 
         # 5. Inizializzazione Client
-        self.supabase: Client = create_client(self.url, self.key)
+        self.supabase = create_client(self.url, self.key)
+
+        # 6. Impronte (hash) delle righe già scritte, per saltare i giorni invariati
+        self.fingerprints_file = fingerprints_file or os.path.join(base_dir, 'cache', 'db_fingerprints.json')
+        self._fingerprints = None
+        self._fp_lock = threading.Lock()
 
     def upsert_daily_log(self, data_dict):
         """
@@ -41,4 +54,181 @@ class SupabaseManager:
             return response
         except Exception as e:
             print(f"   ⚠️ Errore Supabase interno: {e}")
-            raise e
\ No newline at end of file
+            raise e
+
+    def upsert_daily_logs(self, rows):
+        """
+        Upsert multi-riga (una sola richiesta HTTP) nella tabella daily_logs.
+        """
+        return self.supabase.table('daily_logs').upsert(rows).execute()
+
+    def fetch_daily_logs(self, start_date, end_date, page_size=1000):
+        """
+        Righe di daily_logs con date in [start_date, end_date] ('YYYY-MM-DD'), in ordine di data.
+        Letta a pagine: PostgREST limita le righe per risposta.
+        """
+        rows = []
+        while True:
+            response = (self.supabase.table('daily_logs').select('*')
+                        .gte('date', start_date).lte('date', end_date).order('date')
+                        .range(len(rows), len(rows) + page_size - 1).execute())
+            rows.extend(response.data)
+            if len(response.data) < page_size: return rows
+
+    @staticmethod
+    def fingerprint(data_dict):
+        """
+        Hash stabile del contenuto di una riga. raw_data.last_sync è escluso:
+        cambia a ogni esecuzione anche quando i dati sono identici.
+        """
+        payload = dict(data_dict)
+        if isinstance(payload.get('raw_data'), dict):
+            payload['raw_data'] = {k: v for k, v in payload['raw_data'].items() if k != 'last_sync'}
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def has_changed(self, data_dict, fingerprint=None):
+        """
+        True se la riga è nuova o diversa dall'ultima scritta con successo per quella data.
+        fingerprint: impronta già calcolata della riga (evita di riserializzarla).
+        """
+        fingerprint = fingerprint or self.fingerprint(data_dict)
+        with self._fp_lock:
+            return self._load_fingerprints().get(data_dict.get('date')) != fingerprint
+
+    def remember_written(self, rows, fingerprints=None):
+        """Registra (e salva su disco) le impronte delle righe scritte con successo (già calcolate, se passate)."""
+        if fingerprints is None: fingerprints = [self.fingerprint(row) for row in rows]
+        with self._fp_lock:
+            stored = self._load_fingerprints()
+            for row, fingerprint in zip(rows, fingerprints):
+                stored[row.get('date')] = fingerprint
+            try:
+                os.makedirs(os.path.dirname(self.fingerprints_file), exist_ok=True)
+                with open(self.fingerprints_file, 'w', encoding='utf-8') as f:
+                    json.dump(stored, f, sort_keys=True)
+            except OSError as e:
+                print(f"   ⚠️ Impossibile salvare le impronte DB: {e}")
+
+    def _load_fingerprints(self):
+        if self._fingerprints is None:
+            try:
+                with open(self.fingerprints_file, encoding='utf-8') as f:
+                    self._fingerprints = json.load(f)
+            except (OSError, ValueError):
+                self._fingerprints = {}
+        return self._fingerprints
+
+
+class BufferedDailyLogWriter:
+    """
+    Accumula le righe daily_logs e le invia a Supabase a blocchi (upsert multi-riga)
+    da un thread in background, così il loop di fetch non aspetta il DB.
+    - Blocco pieno (chunk_size righe) o nessuna riga nuova per flush_interval_s: invio.
+    - Blocco fallito: ritentato con backoff esponenziale; se fallisce ancora, le righe
+      vengono riprovate una per una per isolare (e riportare) le date problematiche.
+    - skip_unchanged: le righe identiche all'ultima scritta (stessa impronta) non vengono inviate.
+      L'impronta di ogni riga si calcola una volta sola in add() e viaggia con la riga fino al salvataggio.
+    - close() (anche via with/atexit) esegue il flush finale.
+    - metrics (RunMetrics opzionale): durata di ogni upsert, righe scritte/saltate/fallite, errori.
+    """
+    _STOP = object()
+
+    def __init__(self, db, chunk_size=100, flush_interval_s=5.0, max_retries=3, backoff_s=1.0, skip_unchanged=True, metrics=None):
+        self.db = db
+        self.metrics = metrics
+        self.skip_unchanged = skip_unchanged
+        self.chunk_size = chunk_size
+        self.flush_interval_s = flush_interval_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+
+        self.written = 0
+        self.skipped = 0
+        self.failures = {}  # date -> errore
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="daily-logs-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, row):
+        if self._closed: raise RuntimeError("Writer daily_logs già chiuso")
+        fingerprint = self.db.fingerprint(row)
+        if self.skip_unchanged and not self.db.has_changed(row, fingerprint):
+            self.skipped += 1
+            if self.metrics is not None: self.metrics.incr("supabase_rows_total", result="skipped")
+            return False
+        self._queue.put((row, fingerprint))
+        return True
+
+    def close(self):
+        if self._closed: return
+        self._closed = True
+        # Writer chiuso: non serve più il flush all'uscita (e l'atexit non lo tiene in vita)
+        atexit.unregister(self.close)
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        buffer = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                if buffer: self._write_chunk(buffer)
+                return
+            if item is not None: buffer.append(item)
+
+            if len(buffer) >= self.chunk_size or (item is None and buffer):
+                self._write_chunk(buffer)
+                buffer = []
+
+    def _write_chunk(self, items):
+        """items: [(riga, impronta)] accodati da add()."""
+        rows = [row for row, _ in items]
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._upsert(rows)
+                self.written += len(rows)
+                self.db.remember_written(rows, [fingerprint for _, fingerprint in items])
+                print(f"   ✅ DB Aggiornato: {len(rows)} giorni ({rows[0].get('date')} → {rows[-1].get('date')})")
+                return
+            except Exception as e:
+                if attempt == self.max_retries: break
+                delay = self.backoff_s * (2 ** attempt)
+                print(f"   ⚠️ Errore scrittura blocco DB (tentativo {attempt + 1}), riprovo tra {delay:.0f}s: {e}")
+                time.sleep(delay)
+
+        # Il blocco continua a fallire: riga per riga per capire QUALI date non passano
+        for row, fingerprint in items:
+            try:
+                self._upsert([row])
+                self.written += 1
+                self.db.remember_written([row], [fingerprint])
+            except Exception as e:
+                self.failures[row.get('date')] = e
+                if self.metrics is not None: self.metrics.incr("supabase_rows_total", result="failed")
+                print(f"   ⚠️ Errore scrittura DB {row.get('date')}: {e}")
+
+    def _upsert(self, rows):
+        if self.metrics is None: return self.db.upsert_daily_logs(rows)
+        t0 = time.perf_counter()
+        try:
+            self.db.upsert_daily_logs(rows)
+        except Exception as e:
+            self.metrics.error("supabase_errors_total", e, rows=len(rows), first_date=rows[0].get('date'))
+            raise
+        finally:
+            self.metrics.observe("supabase_write_duration_seconds", time.perf_counter() - t0)
+        self.metrics.incr("supabase_rows_total", len(rows), result="written")
@@ -0,0 +1,213 @@
+import time
+import asyncio
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import httpx
+
+from modules.fit.fetchers import FitFetcher
+from modules.fit.retry import is_transient_error
+
+
+class FitHttpError(Exception):
+    """Errore HTTP della Fitness API con la stessa forma di googleapiclient.errors.HttpError (resp.status, content)."""
+    class _Response(dict):
+        def __init__(self, status, headers):
+            super().__init__({k.lower(): v for k, v in headers.items()})
+            self.status = status
+
+    def __init__(self, status, headers, content):
+        self.resp = self._Response(status, headers)
+        self.content = content
+        super().__init__(f"HTTP {status}: {content[:200].decode('utf-8', 'ignore')}")
+
+
+class AsyncFitFetcher(FitFetcher):
+    """
+    Controparte asyncio di FitFetcher: stessi metodi (fetch_aggregate, fetch_raw_sessions,
+    fetch_latest_data_point, fetch_many, find_step_source) ma coroutine, su un client httpx
+    con pool di connessioni keep-alive e HTTP/2. Le richieste di un fetch_many partono in
+    parallelo (al massimo max_in_flight alla volta) invece che in una BatchHttpRequest.
+    Cache, limiter, indice sessioni, sorgente passi e metriche sono gli stessi del fetcher sincrono.
+    token_provider(force_refresh) -> access token OAuth (vedi GoogleAuthManager.access_token);
+    transport: trasporto httpx alternativo, es. FakeFitTransport per i test senza rete.
+    Niente clone() per thread: un solo fetcher serve tutti i giorni sull'event loop
+    (AsyncGoogleFitService non ha service_factory, quindi non crea worker thread).
+    """
+    BASE_URL = "https://www.googleapis.com/fitness/v1/users/me"
+
+    def __init__(self, token_provider, base_url=BASE_URL, max_in_flight=10, http2=True, transport=None,
+                 timeout_s=30.0, cache=None, limiter=None, step_source=None, metrics=None, retry=None, breaker=None):
+        super().__init__(None, batch=False, cache=cache, limiter=limiter, step_source=step_source, metrics=metrics,
+                         retry=retry, breaker=breaker)
+        self.token_provider = token_provider
+        self.base_url = base_url.rstrip('/')
+        self.max_in_flight = max_in_flight
+        self._client_args = {
+            "http2": http2 and transport is None,
+            "transport": transport,
+            "timeout": timeout_s,
+            "limits": httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+        }
+        self._client = None
+        self._semaphore = None
+        self._token = None
+
+    @classmethod
+    def from_auth_manager(cls, auth_manager, **kwargs):
+        return cls(auth_manager.access_token, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- Metodi pubblici (coroutine) ---
+
+    async def fetch_aggregate(self, start_ms, end_ms, request_body):
+        return (await self.fetch_many({"r": ("aggregate", start_ms, end_ms, request_body)}))["r"]
+
+    async def fetch_raw_sessions(self, start_ms, end_ms):
+        return (await self.fetch_many({"r": ("sessions", start_ms, end_ms)}))["r"]
+
+    async def fetch_latest_data_point(self, start_ms, end_ms, data_type_name):
+        return (await self.fetch_many({"r": ("latest", start_ms, end_ms, data_type_name)}))["r"]
+
+    async def fetch_many(self, calls):
+        """Stessa semantica di FitFetcher.fetch_many; le richieste HTTP partono tutte insieme."""
+        if not calls: return {}
+        http_calls, session_calls, gaps = self._expand_sessions(calls)
+        return self._collect_sessions(await self._execute(http_calls), session_calls, gaps)
+
+    async def find_step_source(self):
+        cached, fresh = self.step_source.get()
+        if fresh: return cached
+
+        try:
+            response = (await self.fetch_many({"r": ("data_sources", 'com.google.step_count.delta')}))["r"]
+        except Exception as e:
+            # Lookup fallito: meglio lo stream già noto (anche se scaduto) del merge generico
+            print(f"⚠️ Lookup sorgente passi fallito: {e}")
+            return cached or self.DEFAULT_STEP_SOURCE
+
+        stream_id = self._select_step_source(response)
+        self.step_source.set(stream_id)
+        return stream_id
+
+    # --- Esecuzione ---
+
+    async def _execute(self, calls):
+        raw = {}
+        pending = {}
+        for key, spec in calls.items():
+            cached = self.cache.get(self._cache_parts(spec)) if self.cache is not None else None
+            if cached is not None: raw[key] = (cached, None)
+            else: pending[key] = spec
+            if self.cache is not None and self.metrics is not None:
+                self.metrics.incr("fit_cache_lookups_total", result="hit" if cached is not None else "miss",
+                                  endpoint=self.ENDPOINTS[spec[0]])
+
+        keys = list(pending)
+        outcomes = await asyncio.gather(*(self._send_one(pending[k]) for k in keys), return_exceptions=True)
+        for key, outcome in zip(keys, outcomes):
+            raw[key] = (None, outcome) if isinstance(outcome, BaseException) else (outcome, None)
+
+        results = {}
+        for key, spec in calls.items():
+            response, exception = raw[key]
+            if exception is None:
+                try:
+                    results[key] = self._parse_response(spec, response)
+                    if key in pending and self.cache is not None:
+                        self.cache.put(self._cache_parts(spec), response, self._window_end(spec))
+                    continue
+                except Exception as e:
+                    exception = e
+            if self.metrics is not None:
+                self.metrics.error("fit_errors_total", exception, window=self._window(spec), **self._labels(spec))
+            results[key] = self._on_error(spec, exception)
+        return results
+
+    async def _send_one(self, spec):
+        """
+        Una richiesta REST, con rinnovo del token su 401 e nuovi tentativi sugli errori
+        transitori (RetryPolicy; rate limit anche via limiter, circuito condiviso se attivo).
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(**self._client_args)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        method, path, kwargs = self._http_request(spec)
+
+        refreshed = False
+        attempt = 0
+        while True:
+            # Limiter e circuito sono bloccanti (condivisi con i worker sincroni): attesa fuori dall'event loop
+            if self.breaker is not None: await asyncio.to_thread(self.breaker.wait)
+            if self.limiter is not None: await asyncio.to_thread(self.limiter.acquire, 1)
+            headers = {"Authorization": f"Bearer {await self._access_token()}"}
+            t0 = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    resp = await self._client.request(method, self.base_url + path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                # Timeout e cadute di connessione: stesso trattamento dei 5xx
+                resp, error = None, e
+            else:
+                error = FitHttpError(resp.status_code, resp.headers, resp.content) if resp.status_code >= 400 else None
+            elapsed = time.perf_counter() - t0
+
+            if resp is not None and resp.status_code == 401 and not refreshed:
+                refreshed = True
+                self._token = await asyncio.to_thread(self.token_provider, True)
+                continue
+            if self.breaker is not None: self.breaker.record(error)
+            if error is None:
+                data = resp.json()
+                self._record(spec, data, elapsed, size_bytes=len(resp.content))
+                if self.limiter is not None: self.limiter.on_success(1)
+                return data
+
+            self._record(spec, None, elapsed)
+            delay = self._retry_delay([(spec, error)], attempt) if is_transient_error(error) else None
+            if delay is None: raise error
+            if delay > 0: await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _access_token(self):
+        if self._token is None:
+            # Il provider può fare I/O bloccante (refresh OAuth): fuori dall'event loop
+            self._token = await asyncio.to_thread(self.token_provider, False)
+        return self._token
+
+    def _http_request(self, spec):
+        """(metodo, path, argomenti httpx) dell'endpoint REST corrispondente alla richiesta."""
+        kind = spec[0]
+        if kind == "aggregate":
+            _, start_ms, end_ms, request_body = spec
+            body = dict(request_body, startTimeMillis=start_ms, endTimeMillis=end_ms)
+            return "POST", "/dataset:aggregate", {"json": body}
+        if kind == "latest":
+            return "POST", "/dataset:aggregate", {"json": self._latest_body(spec)}
+        if kind == "sessions":
+            _, start_ms, end_ms = spec
+            params = {
+                "startTime": datetime.fromtimestamp(start_ms/1000, timezone.utc).isoformat(),
+                "endTime": datetime.fromtimestamp(end_ms/1000, timezone.utc).isoformat(),
+                "includeDeleted": "false",
+            }
+            return "GET", "/sessions", {"params": params}
+        if kind == "data_sources":
+            return "GET", "/dataSources", {"params": {"dataTypeName": spec[1]}}
+        if kind == "dataset":
+            _, start_ms, end_ms, data_source_id, limit, page_token = spec
+            params = {"limit": limit}
+            if page_token: params["pageToken"] = page_token
+            path = f"/dataSources/{quote(data_source_id, safe='')}/datasets/{start_ms * 1_000_000}-{end_ms * 1_000_000}"
+            return "GET", path, {"params": params}
+        raise ValueError(f"Tipo di richiesta sconosciuto: {kind}")
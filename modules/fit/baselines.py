@@ -0,0 +1,189 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import date
+from modules.fit.processors import FitProcessor
+
+class RollingBaselines:
+    """
+    Medie mobili personali a 7 e 28 giorni (RHR, sonno, passi, HR medio, temperatura cutanea),
+    debito di sonno e rapporto carico acuto:cronico, aggiornate in modo incrementale.
+    Stato su SQLite (cache/baselines.sqlite): solo gli ultimi 56 giorni (un giorno rielaborato
+    in finestra ha bisogno dei 28 precedenti), più somme e conteggi
+    per finestra tenuti in memoria; un giorno nuovo costa O(1) (entra un valore, escono quelli
+    usciti dalla finestra) senza rileggere lo storico.
+    Per ogni giorno la baseline è calcolata sui giorni PRECEDENTI (il giorno stesso non influenza
+    il confronto); debito di sonno e carico includono invece il giorno stesso.
+    I giorni vanno passati in ordine di data. Un giorno già visto (rielaborato) dentro la finestra
+    sostituisce il suo valore; per uno più vecchio della finestra (es. rielaborazione di un vecchio
+    range) i 28 giorni precedenti si leggono dallo storico locale (HistoryStore), se disponibile,
+    altrimenti il giorno resta senza trend (None).
+    """
+    # chiave -> campo del payload
+    METRICS = {"rhr": "health_resting_hr", "sleep_min": "health_sleep_minutes", "steps": "health_steps",
+               "avg_hr": "health_avg_hr", "skin_temp": "health_skin_temp_avg", "load": "health_cardio_points"}
+    WINDOWS = (7, 28)
+    MIN_DAYS = 7          # Giorni con dato (su 28) per usare la baseline nell'energy score
+    SLEEP_NEED_MIN = 480  # Fabbisogno di sonno per il debito (8 ore)
+    KEEP_DAYS = 56        # Giorni di stato conservati: finestra + baseline dei giorni rielaborati
+
+    def __init__(self, path=None, history=None, sleep_need_min=SLEEP_NEED_MIN, min_days=MIN_DAYS):
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            path = os.path.join(base_dir, 'cache', 'baselines.sqlite')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.history = history
+        self.sleep_need_min = sleep_need_min
+        self.min_days = min_days
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS baseline_days (date TEXT PRIMARY KEY, metrics TEXT NOT NULL)")
+        self._conn.commit()
+
+        # Stato: valori degli ultimi KEEP_DAYS giorni (ordinale -> {chiave: valore}) e somme per finestra
+        self._days = {}
+        self._last = None
+        self._sums = {w: {k: [0.0, 0] for k in self.METRICS} for w in self.WINDOWS}
+        rows = self._conn.execute("SELECT date, metrics FROM baseline_days").fetchall()
+        for d, values in rows:
+            self._days[date.fromisoformat(d).toordinal()] = json.loads(values)
+        if self._days:
+            self._last = max(self._days)
+            for w in self.WINDOWS:
+                for o in range(self._last - w + 1, self._last + 1): self._add(w, self._days.get(o), 1)
+
+    # --- Aggiornamento ---
+
+    def update(self, date_str, metrics):
+        """
+        Registra il giorno e ritorna i suoi trend:
+        {"baseline": {chiave: {"avg_7d", "avg_28d", "days_28d", "delta_28d"}},
+         "sleep_debt_7d_min", "acute_chronic_ratio"}; None se il giorno è fuori finestra e non c'è storico.
+        """
+        day = date.fromisoformat(date_str).toordinal()
+        values = {k: metrics.get(f) for k, f in self.METRICS.items()}
+        window = max(self.WINDOWS)
+
+        with self._lock:
+            if self._last is not None and day <= self._last - window:
+                return self._from_history(day, values)
+            if self._last is None or day > self._last:
+                self._slide(day - 1)
+                baseline = {w: {k: tuple(s) for k, s in self._sums[w].items()} for w in self.WINDOWS}
+                self._days[day] = values
+                self._slide(day)
+            else:
+                # Rielaborazione di un giorno ancora in finestra: baseline dai (≤28) giorni precedenti
+                baseline = {w: self._window_sums(self._days, day - w, day - 1) for w in self.WINDOWS}
+                old = self._days.get(day)
+                for w in self.WINDOWS:
+                    if day > self._last - w:
+                        self._add(w, old, -1)
+                        self._add(w, values, 1)
+                self._days[day] = values
+            current = {w: {k: tuple(s) for k, s in self._sums[w].items()} for w in self.WINDOWS} \
+                if day == self._last else {w: self._window_sums(self._days, day - w + 1, day) for w in self.WINDOWS}
+
+            self._conn.execute("INSERT OR REPLACE INTO baseline_days (date, metrics) VALUES (?, ?)",
+                               (date_str, json.dumps(values)))
+            self._conn.execute("DELETE FROM baseline_days WHERE date <= ?",
+                               (date.fromordinal(self._last - self.KEEP_DAYS).isoformat(),))
+            self._conn.commit()
+
+        return self._trends(values, baseline, current)
+
+    def apply(self, date_str, metrics):
+        """
+        Aggiunge raw_data["trends"] al payload e ricalcola l'energy score sulle medie personali
+        (se ci sono abbastanza giorni). Ritorna i trend.
+        """
+        trends = self.update(date_str, metrics)
+        metrics.setdefault('raw_data', {})['trends'] = trends
+        if trends is None or metrics.get('health_energy_score') is None: return trends
+
+        personal = {k: b['avg_28d'] for k, b in trends['baseline'].items() if b['days_28d'] >= self.min_days}
+        if personal:
+            sleep_hours = (metrics.get('health_sleep_minutes') or 0) / 60.0
+            metrics['health_energy_score'] = FitProcessor.calculate_energy_score(
+                {"total_hours": sleep_hours}, metrics.get('health_steps') or 0, metrics.get('health_resting_hr'), personal)
+        trends['energy_baseline'] = bool(personal)
+        return trends
+
+    def annotate(self, source):
+        """Applica apply() a un flusso (date_str, metrics, errore) in ordine di data, come get_range_metrics."""
+        for date_str, metrics, error in source:
+            if error is None: self.apply(date_str, metrics)
+            yield date_str, metrics, error
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Finestre ---
+
+    def _slide(self, end):
+        """Sposta la fine delle finestre a `end`: entrano i nuovi giorni, escono quelli troppo vecchi."""
+        if self._last is None or end - self._last > max(self.WINDOWS):
+            # Buco più lungo della finestra: niente da tenere
+            self._sums = {w: {k: [0.0, 0] for k in self.METRICS} for w in self.WINDOWS}
+        else:
+            for o in range(self._last + 1, end + 1):
+                for w in self.WINDOWS:
+                    self._add(w, self._days.get(o - w), -1)
+                    self._add(w, self._days.get(o), 1)
+        self._last = max(end, self._last) if self._last is not None else end
+        for o in [o for o in self._days if o <= self._last - self.KEEP_DAYS]: del self._days[o]
+
+    def _add(self, w, values, sign):
+        if not values: return
+        for k, v in values.items():
+            if v is None: continue
+            s = self._sums[w][k]
+            s[0] += sign * v
+            s[1] += sign
+
+    def _from_history(self, day, values):
+        """Trend di un giorno fuori finestra, dai 28 giorni precedenti dello storico locale (lo stato non cambia)."""
+        if self.history is None: return None
+        first = date.fromordinal(day - max(self.WINDOWS))
+        cols = self.history.daily(first, date.fromordinal(day - 1), columns=list(self.METRICS.values()))
+        days = {}
+        for i, d in enumerate(cols["date"].tolist()):
+            row = {k: float(cols[f][i]) for k, f in self.METRICS.items()}
+            days[d.toordinal()] = {k: (None if v != v else v) for k, v in row.items()}  # NaN -> None
+        days[day] = values
+        baseline = {w: self._window_sums(days, day - w, day - 1) for w in self.WINDOWS}
+        current = {w: self._window_sums(days, day - w + 1, day) for w in self.WINDOWS}
+        return self._trends(values, baseline, current)
+
+    def _window_sums(self, days, first, last):
+        sums = {k: [0.0, 0] for k in self.METRICS}
+        for o in range(first, last + 1):
+            for k, v in (days.get(o) or {}).items():
+                if v is None: continue
+                sums[k][0] += v
+                sums[k][1] += 1
+        return {k: tuple(s) for k, s in sums.items()}
+
+    def _trends(self, values, baseline, current):
+        mean = lambda s: s[0] / s[1] if s[1] else None
+        out = {}
+        for k in self.METRICS:
+            avg_28 = mean(baseline[28][k])
+            avg_7 = mean(baseline[7][k])
+            delta = values[k] - avg_28 if values[k] is not None and avg_28 is not None else None
+            out[k] = {"avg_7d": self._round(avg_7), "avg_28d": self._round(avg_28),
+                      "days_28d": baseline[28][k][1], "delta_28d": self._round(delta)}
+
+        total, n = current[7]["sleep_min"]
+        debt = max(0.0, n * self.sleep_need_min - total) if n else None
+        acute, chronic = mean(current[7]["load"]), mean(current[28]["load"])
+        ratio = acute / chronic if acute is not None and chronic else None
+        return {"baseline": out, "sleep_debt_7d_min": self._round(debt), "acute_chronic_ratio": self._round(ratio, 2)}
+
+    @staticmethod
+    def _round(value, digits=1):
+        return round(value, digits) if value is not None else None
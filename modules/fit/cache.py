@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+class ResponseCache:
+    """
+    Cache su disco (SQLite) delle risposte grezze dell'API Fit.
+    - Chiave: hash SHA-256 della richiesta canonica (tipo, finestra temporale, body).
+    - Finestre chiuse da più di `finalized_hours` ore: immutabili, non scadono mai.
+    - Finestre recenti (il dato può ancora arrivare dall'orologio): TTL breve.
+    - Dimensione massima `max_bytes` con eviction LRU (ultimo accesso più vecchio).
+    Gli accessi (last_access) delle hit restano in memoria e vengono scritti in una sola
+    transazione alla put successiva, ogni `access_flush_every` hit o a close(): la lettura
+    dalla cache non paga una commit (fsync) per ogni hit.
+    """
+    def __init__(self, path=None, finalized_hours=72, recent_ttl_s=15 * 60, max_bytes=256 * 1024 * 1024,
+                 access_flush_every=256):
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            path = os.path.join(base_dir, 'cache', 'fit_responses.sqlite')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.finalized_ms = finalized_hours * 60 * 60 * 1000
+        self.recent_ttl_s = recent_ttl_s
+        self.max_bytes = max_bytes
+        self.access_flush_every = access_flush_every
+        self.hits = 0
+        self.misses = 0
+
+        # Connessione condivisa tra thread, serializzata dal lock
+        self._lock = threading.Lock()
+        self._accessed = {}  # key -> ultimo accesso non ancora scritto su disco
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(parts):
+        canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, parts):
+        key = self.make_key(parts)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= self.access_flush_every:
+                self._flush_access()
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, parts, response, window_end_ms=None):
+        """window_end_ms=None: richiesta senza finestra temporale (es. dataSources), sempre TTL."""
+        now = time.time()
+        finalized = window_end_ms is not None and window_end_ms < now * 1000 - self.finalized_ms
+        expires_at = None if finalized else now + self.recent_ttl_s
+        blob = zlib.compress(json.dumps(response, separators=(',', ':')).encode('utf-8'))
+
+        key = self.make_key(parts)
+        with self._lock:
+            # Accessi in sospeso nella stessa transazione della put (e prima dell'eviction LRU)
+            self._flush_access()
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), expires_at, now)
+            )
+            self._total_bytes += len(blob) - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes: self._evict(now)
+            self._conn.commit()
+
+    def _flush_access(self):
+        """Scrive gli accessi in sospeso (senza commit: la fa il chiamante). Da chiamare col lock."""
+        if not self._accessed: return
+        self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                               [(ts, key) for key, ts in self._accessed.items()])
+        self._accessed.clear()
+
+    def _evict(self, now):
+        # Prima le voci scadute, poi LRU (ultimo accesso più vecchio) finché si rientra nel limite
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+        ).fetchone()[0]
+        self._conn.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        self._total_bytes -= expired
+
+        cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+        victims = []
+        while self._total_bytes > self.max_bytes:
+            row = cursor.fetchone()
+            if row is None: break
+            victims.append((row[0],))
+            self._total_bytes -= row[1]
+        cursor.close()
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries, "bytes": self._total_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
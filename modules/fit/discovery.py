@@ -0,0 +1,68 @@
+import os
+import json
+import threading
+import urllib.request
+
+DISCOVERY_URL = "https://fitness.googleapis.com/$discovery/rest?version=v1"
+
+_document = None
+_lock = threading.Lock()
+
+def fitness_document(path=None):
+    """
+    Documento di discovery della Fitness API v1, letto e parsato UNA volta per processo.
+    Ordine: copia locale (cache/discovery_fitness_v1.json), copia statica inclusa in
+    googleapiclient, infine download; le ultime due vengono salvate in cache per i run successivi.
+    """
+    global _document
+    with _lock:
+        if _document is not None: return _document
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            path = os.path.join(base_dir, 'cache', 'discovery_fitness_v1.json')
+        try:
+            with open(path, encoding='utf-8') as f:
+                _document = json.load(f)
+            return _document
+        except (OSError, ValueError):
+            pass
+
+        from googleapiclient.discovery_cache import get_static_doc
+        text = get_static_doc('fitness', 'v1')
+        if text is None:
+            with urllib.request.urlopen(DISCOVERY_URL, timeout=30) as resp:
+                text = resp.read().decode('utf-8')
+        _document = json.loads(text)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare il documento di discovery: {e}")
+        return _document
+
+class CountingHttp:
+    """
+    Trasporto httplib2 (AuthorizedHttp) che conta i byte dei corpi di risposta ricevuti:
+    googleapiclient consegna al fetcher solo il JSON già parsato. Un'istanza per service (per thread).
+    """
+    def __init__(self, http):
+        self.http = http
+        self.received_bytes = 0
+
+    def request(self, *args, **kwargs):
+        resp, content = self.http.request(*args, **kwargs)
+        self.received_bytes += len(content or b"")
+        return resp, content
+
+    def __getattr__(self, name):
+        # credentials, timeout, close...: quelli del trasporto avvolto (le batch leggono le credenziali da qui)
+        if name == "http": raise AttributeError(name)
+        return getattr(self.http, name)
+
+def build_fitness_service(credentials):
+    """Service Fitness v1 dal documento già parsato (nessun fetch né parsing per worker), con byte ricevuti contati."""
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.http import build_http
+    from google_auth_httplib2 import AuthorizedHttp
+    return build_from_document(fitness_document(), http=CountingHttp(AuthorizedHttp(credentials, http=build_http())))
@@ -0,0 +1,85 @@
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import httpx
+from googleapiclient.errors import HttpError
+
+API_PREFIX = "/fitness/v1/users/me"
+
+
+def handle_fit_request(fake, method, path, query, body):
+    """
+    Instrada una richiesta REST della Fitness API verso FakeFitService.
+    Ritorna (status, headers, corpo in bytes), come farebbe l'endpoint reale.
+    """
+    if not path.startswith(API_PREFIX):
+        return 404, {}, b'{"error": {"code": 404, "message": "path sconosciuto"}}'
+    route = path[len(API_PREFIX):]
+    q = lambda name, default=None: query.get(name, [default])[0]
+    users = fake.users()
+
+    if method == "POST" and route == "/dataset:aggregate":
+        request = users.dataset().aggregate(userId='me', body=json.loads(body or b'{}'))
+    elif method == "GET" and route == "/sessions":
+        request = users.sessions().list(userId='me', startTime=q("startTime"), endTime=q("endTime"),
+                                        includeDeleted=q("includeDeleted", "false") == "true")
+    elif method == "GET" and route == "/dataSources":
+        request = users.dataSources().list(userId='me', dataTypeName=q("dataTypeName"))
+    elif method == "GET" and route.startswith("/dataSources/") and "/datasets/" in route:
+        source, dataset_id = route[len("/dataSources/"):].split("/datasets/")
+        limit = q("limit")
+        request = users.dataSources().datasets().get(userId='me', dataSourceId=unquote(source), datasetId=dataset_id,
+                                                     limit=int(limit) if limit else None, pageToken=q("pageToken"))
+    else:
+        return 404, {}, b'{"error": {"code": 404, "message": "endpoint non supportato dal fake"}}'
+
+    try:
+        response = request.execute()
+    except HttpError as e:
+        headers = {"retry-after": e.resp["retry-after"]} if "retry-after" in e.resp else {}
+        return e.resp.status, headers, e.content
+    return 200, {"content-type": "application/json"}, json.dumps(response).encode('utf-8')
+
+
+class FakeFitTransport(httpx.AsyncBaseTransport):
+    """Trasporto httpx in-process che risponde con FakeFitService (latenza ed errori inclusi)."""
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def handle_async_request(self, request):
+        url = urlsplit(str(request.url))
+        body = await request.aread()
+        # FakeFitService simula la latenza con sleep bloccanti: fuori dall'event loop
+        status, headers, content = await asyncio.to_thread(
+            handle_fit_request, self.fake, request.method, url.path, parse_qs(url.query), body)
+        return httpx.Response(status, headers=headers, content=content)
+
+
+def serve_fake_fit(fake, host="127.0.0.1", port=0):
+    """
+    Avvia un vero server HTTP locale (thread in background) davanti a FakeFitService.
+    Ritorna (server, base_url da passare ad AsyncFitFetcher); server.shutdown() per fermarlo.
+    """
+    class _Handler(BaseHTTPRequestHandler):
+        def _respond(self):
+            url = urlsplit(self.path)
+            length = int(self.headers.get("content-length") or 0)
+            status, headers, content = handle_fit_request(
+                fake, self.command, url.path, parse_qs(url.query), self.rfile.read(length) if length else b"")
+            self.send_response(status)
+            for k, v in headers.items(): self.send_header(k, v)
+            self.send_header("content-length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = _respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="fake-fit-http", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{API_PREFIX}"
@@ -0,0 +1,441 @@
+import os
+import json
+import time
+import random
+import bisect
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+DAY_MS = 24 * 60 * 60 * 1000
+WATCH_STEP_SOURCE = "derived:com.google.step_count.delta:com.samsung.health:SM-R960:watch_steps"
+
+# Tipi aggregati per somma (un punto per bucket) e per media (punto .summary: avg, max, min)
+SUM_TYPES = {
+    "com.google.step_count.delta": "intVal", "com.google.distance.delta": "fpVal",
+    "com.google.calories.expended": "fpVal", "com.google.heart_minutes": "fpVal",
+    "com.google.active_minutes": "intVal", "com.google.floor_change": "fpVal",
+    "com.google.hydration": "fpVal",
+}
+SUMMARY_TYPES = {
+    "com.google.heart_rate.bpm", "com.google.oxygen_saturation", "com.google.heart_rate.resting",
+    "com.google.power.sample", "com.google.weight", "com.google.body.fat.percentage",
+    "com.google.height", "com.google.body.water_mass", "com.google.blood_glucose",
+    "com.google.body.temperature", "com.google.respiratory_rate",
+}
+
+
+def request_key(method, params):
+    """Chiave canonica (SHA-256) di una richiesta, usata per i file fixture."""
+    canonical = json.dumps([method, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class FakeRequest:
+    """Stessa interfaccia minima di googleapiclient.http.HttpRequest: execute()."""
+    def __init__(self, owner, method, params):
+        self.owner = owner
+        self.method = method
+        self.params = params
+
+    def execute(self, num_retries=0):
+        return self.owner._execute(self, batched=False)
+
+
+class FakeBatch:
+    """Stand-in di BatchHttpRequest: una sola latenza per tutta la batch, callback per richiesta."""
+    def __init__(self, owner, callback):
+        self.owner = owner
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback))
+
+    def execute(self):
+        self.owner._begin_batch(len(self._requests))
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request.owner._execute(request, batched=True), None
+            except HttpError as e:
+                response, exception = None, e
+            (callback or self.callback)(request_id, response, exception)
+
+
+class _Resource:
+    def __init__(self, owner, **methods):
+        self._owner = owner
+        self._methods = methods
+
+    def __getattr__(self, name):
+        if name not in self._methods: raise AttributeError(name)
+        return self._methods[name]
+
+
+class FakeFitService:
+    """
+    Stand-in offline della Fitness API v1 (stessa superficie usata da FitFetcher):
+    users().dataset().aggregate, users().sessions().list, users().dataSources().list,
+    users().dataSources().datasets().get (paginato) e new_batch_http_request. Nessuna rete né credenziali.
+    - Risposte: da fixture registrate (fixtures_dir) se presenti, altrimenti dati sintetici
+      deterministici (stesso seed => stessi dati).
+    - latency_s: latenza simulata per richiesta HTTP (una batch conta come una richiesta).
+    - error_rate / error_statuses: errori HTTP iniettati in modo riproducibile.
+    - hr_resolution_s: passo dei campioni HR restituiti da datasets.get (60 = un punto al minuto,
+      1 = flusso a 1 Hz come l'orologio durante l'allenamento).
+    """
+    def __init__(self, seed=0, latency_s=0.0, error_rate=0.0, error_statuses=(503, 429),
+                 fixtures_dir=None, replay_only=False, hr_resolution_s=60):
+        self.seed = seed
+        self.latency_s = latency_s
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.fixtures_dir = fixtures_dir
+        self.replay_only = replay_only
+        self.hr_resolution_s = hr_resolution_s
+
+        self.stats = {"http_requests": 0, "api_calls": 0, "errors": 0, "by_method": {}}
+        self._lock = threading.Lock()
+        self._error_rng = random.Random(f"{seed}:errors")
+        self._days = {}  # giorno (UTC) -> {data_type: [punti]}, sessioni
+
+    # --- Superficie googleapiclient ---
+
+    def users(self):
+        return _Resource(
+            self,
+            dataset=lambda: _Resource(self, aggregate=lambda userId, body: FakeRequest(self, "dataset.aggregate", {"userId": userId, "body": body})),
+            sessions=lambda: _Resource(self, list=lambda userId, startTime=None, endTime=None, includeDeleted=False, **kw: FakeRequest(
+                self, "sessions.list", {"userId": userId, "startTime": startTime, "endTime": endTime, "includeDeleted": includeDeleted})),
+            dataSources=lambda: _Resource(
+                self,
+                list=lambda userId, dataTypeName=None, **kw: FakeRequest(
+                    self, "dataSources.list", {"userId": userId, "dataTypeName": dataTypeName}),
+                datasets=lambda: _Resource(self, get=lambda userId, dataSourceId, datasetId, limit=None, pageToken=None, **kw: FakeRequest(
+                    self, "datasets.get", {"userId": userId, "dataSourceId": dataSourceId, "datasetId": datasetId,
+                                           "limit": limit, "pageToken": pageToken}))),
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    # --- Esecuzione ---
+
+    def _begin_batch(self, size):
+        with self._lock:
+            self.stats["http_requests"] += 1
+        if self.latency_s: time.sleep(self.latency_s)
+
+    def _execute(self, request, batched):
+        with self._lock:
+            if not batched: self.stats["http_requests"] += 1
+            self.stats["api_calls"] += 1
+            self.stats["by_method"][request.method] = self.stats["by_method"].get(request.method, 0) + 1
+            fail = self.error_rate > 0 and self._error_rng.random() < self.error_rate
+            status = self._error_rng.choice(self.error_statuses) if fail else None
+            if fail: self.stats["errors"] += 1
+        if not batched and self.latency_s: time.sleep(self.latency_s)
+
+        if status is not None:
+            reason = "rateLimitExceeded" if status in (403, 429) else "backendError"
+            content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}]}}).encode('utf-8')
+            raise HttpError(httplib2.Response({"status": status, "retry-after": "1"}), content)
+
+        fixture = self._load_fixture(request.method, request.params)
+        if fixture is not None: return fixture
+        if self.replay_only:
+            raise HttpError(httplib2.Response({"status": 404}), b'{"error": {"code": 404, "message": "fixture mancante"}}')
+        return self._synthesize(request.method, request.params)
+
+    def _load_fixture(self, method, params):
+        if not self.fixtures_dir: return None
+        path = os.path.join(self.fixtures_dir, method, request_key(method, params) + ".json")
+        if not os.path.exists(path): return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)["response"]
+
+    # --- Dati sintetici ---
+
+    def _synthesize(self, method, params):
+        if method == "dataSources.list":
+            return {"dataSource": [
+                {"dataStreamId": WATCH_STEP_SOURCE, "type": "derived", "dataType": {"name": params["dataTypeName"]},
+                 "device": {"model": "SM-R960", "manufacturer": "Samsung", "type": "watch"}},
+                {"dataStreamId": "derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas",
+                 "type": "derived", "dataType": {"name": params["dataTypeName"]}},
+            ]}
+        if method == "sessions.list":
+            s = self._parse_rfc3339(params["startTime"])
+            e = self._parse_rfc3339(params["endTime"])
+            # Come l'API reale: sessioni che TERMINANO nella finestra
+            return {"session": [x for d in self._day_range(s - DAY_MS, e + DAY_MS)
+                                for x in self._day(d)["sessions"] if s <= int(x["endTimeMillis"]) <= e]}
+        if method == "dataset.aggregate":
+            return self._aggregate(params["body"])
+        if method == "datasets.get":
+            return self._dataset(params)
+        raise ValueError(f"Metodo non supportato dal fake: {method}")
+
+    def _aggregate(self, body):
+        s = int(body["startTimeMillis"])
+        e = int(body["endTimeMillis"])
+        buckets = []
+        for bs, be in self._bucket_windows(s, e, body.get("bucketByTime")):
+            dataset = []
+            for agg in body["aggregateBy"]:
+                data_type = agg["dataTypeName"]
+                points = self._points(data_type, bs, be)
+                if agg.get("dataSourceId") == WATCH_STEP_SOURCE:
+                    # Lo stream dell'orologio conta un po' meno passi del merge
+                    points = [dict(p, value=[{"intVal": int(p["value"][0]["intVal"] * 0.97)}]) for p in points]
+                dataset.append({
+                    "dataSourceId": f"derived:{data_type}:com.google.android.gms:aggregated",
+                    "point": self._reduce(data_type, points)
+                })
+            buckets.append({"startTimeMillis": str(bs), "endTimeMillis": str(be), "dataset": dataset})
+        return {"bucket": buckets}
+
+    def _dataset(self, params):
+        """Punti grezzi dello stream (datasetId = "startNanos-endNanos"), a pagine di `limit` punti."""
+        s_ns, e_ns = (int(x) for x in params["datasetId"].split("-"))
+        data_type = params["dataSourceId"].split(":")[1]
+        base = self._points(data_type, s_ns // 1_000_000, e_ns // 1_000_000 + 1)
+
+        # HR più fitto del minuto: ogni punto sintetico viene espanso in più campioni (indicizzati, non materializzati)
+        per = max(1, 60 // self.hr_resolution_s) if data_type == "com.google.heart_rate.bpm" else 1
+        total = len(base) * per
+        offset = int(params["pageToken"] or 0)
+        limit = int(params["limit"] or total or 1)
+        points = []
+        for i in range(offset, min(offset + limit, total)):
+            p = base[i // per]
+            if per == 1:
+                points.append(p)
+                continue
+            ts_ns = int(p["startTimeNanos"]) + (i % per) * self.hr_resolution_s * 1_000_000_000
+            points.append({"startTimeNanos": str(ts_ns), "endTimeNanos": str(ts_ns), "dataTypeName": data_type,
+                           "value": [{"fpVal": p["value"][0]["fpVal"] + (i * 7919) % 5 - 2}]})
+
+        response = {"minStartTimeNs": str(s_ns), "maxEndTimeNs": str(e_ns),
+                    "dataSourceId": params["dataSourceId"], "point": points}
+        if offset + limit < total: response["nextPageToken"] = str(offset + limit)
+        return response
+
+    def _bucket_windows(self, s, e, bucket_by_time):
+        if not bucket_by_time: return [(s, e)]
+        if "period" in bucket_by_time:
+            tz = pytz.timezone(bucket_by_time["period"].get("timeZoneId", "UTC"))
+            windows = []
+            day = datetime.fromtimestamp(s / 1000, tz).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+            while True:
+                ws = int(tz.localize(day).timestamp() * 1000)
+                we = int(tz.localize(day + timedelta(days=1)).timestamp() * 1000)
+                if ws > e: break
+                windows.append((max(ws, s), min(we, e)))
+                day += timedelta(days=1)
+            return windows
+        step = int(bucket_by_time["durationMillis"])
+        return [(t, min(t + step, e)) for t in range(s, e, step)]
+
+    @staticmethod
+    def _reduce(data_type, points):
+        if not points: return []
+        start_ns, end_ns = points[0]["startTimeNanos"], points[-1]["endTimeNanos"]
+        if data_type in SUM_TYPES:
+            kind = SUM_TYPES[data_type]
+            total = sum(p["value"][0][kind] for p in points)
+            return [{"startTimeNanos": start_ns, "endTimeNanos": end_ns, "dataTypeName": data_type,
+                     "value": [{kind: int(total) if kind == "intVal" else total}]}]
+        if data_type in SUMMARY_TYPES:
+            vals = [p["value"][0]["fpVal"] for p in points]
+            return [{"startTimeNanos": start_ns, "endTimeNanos": end_ns, "dataTypeName": data_type + ".summary",
+                     "value": [{"fpVal": sum(vals) / len(vals)}, {"fpVal": max(vals)}, {"fpVal": min(vals)}]}]
+        if data_type == "com.google.blood_pressure":
+            sys_v = [p["value"][0]["fpVal"] for p in points]
+            dia_v = [p["value"][1]["fpVal"] for p in points]
+            return [{"startTimeNanos": start_ns, "endTimeNanos": end_ns, "dataTypeName": data_type + ".summary",
+                     "value": [{"fpVal": sum(sys_v) / len(sys_v)}, {"fpVal": sum(dia_v) / len(dia_v)}]}]
+        if data_type == "com.google.nutrition":
+            cal = sum(p["value"][0]["mapVal"][0]["value"]["fpVal"] for p in points)
+            return [{"startTimeNanos": start_ns, "endTimeNanos": end_ns, "dataTypeName": "com.google.nutrition.summary",
+                     "value": [{"mapVal": [{"key": "calories", "value": {"fpVal": cal}}]}]}]
+        return points # es. sleep.segment: i segmenti restano punti singoli
+
+    def _points(self, data_type, s, e):
+        """Punti grezzi di data_type con inizio in [s, e)."""
+        out = []
+        for d in self._day_range(s, e):
+            day_points = self._day(d)["points"].get(data_type, [])
+            starts = self._day(d)["starts"].get(data_type, [])
+            out.extend(day_points[bisect.bisect_left(starts, s):bisect.bisect_left(starts, e)])
+        return out
+
+    @staticmethod
+    def _day_range(s, e):
+        return range((s // DAY_MS) * DAY_MS, e + 1, DAY_MS)
+
+    def _day(self, day_ms):
+        with self._lock:
+            day = self._days.get(day_ms)
+            if day is None:
+                if len(self._days) > 1000: self._days.clear()
+                day = self._days[day_ms] = self._generate_day(day_ms)
+        return day
+
+    def _generate_day(self, d):
+        """Giornata sintetica (UTC) deterministica: notte, eventuale sport, vitali, misure, pasti."""
+        rng = random.Random(f"{self.seed}:{d}")
+        points = {}
+        def add(data_type, start_ms, end_ms, value):
+            points.setdefault(data_type, []).append({
+                "startTimeNanos": str(start_ms * 1_000_000), "endTimeNanos": str(end_ms * 1_000_000),
+                "dataTypeName": data_type, "value": value})
+
+        minute = 60 * 1000
+        sleep_s = d - rng.randint(30, 90) * minute
+        sleep_e = d + rng.randint(330, 450) * minute
+        sessions = [{"id": f"sleep-{d}", "name": "Sonno", "activityType": 72,
+                     "startTimeMillis": str(sleep_s), "endTimeMillis": str(sleep_e)}]
+        t = sleep_s
+        while t < sleep_e:
+            seg_e = min(sleep_e, t + rng.randint(10, 40) * minute)
+            add("com.google.sleep.segment", t, seg_e, [{"intVal": rng.choice([1, 4, 4, 4, 5, 5, 6, 6])}])
+            t = seg_e
+
+        sport = None
+        if rng.random() < 0.5:
+            sport_s = d + rng.randint(15 * 60, 18 * 60) * minute
+            sport = (sport_s, sport_s + rng.randint(30, 90) * minute, rng.choice([7, 8, 97, 28]))
+            sessions.append({"id": f"sport-{d}", "name": "Workout", "activityType": sport[2],
+                             "startTimeMillis": str(sport[0]), "endTimeMillis": str(sport[1])})
+
+        def asleep(ts): return sleep_s <= ts < sleep_e
+        def active(ts): return sport is not None and sport[0] <= ts < sport[1]
+
+        for m in range(0, 24 * 60):
+            ts = d + m * minute
+            base = 56 if asleep(ts) else (135 if active(ts) else 74)
+            add("com.google.heart_rate.bpm", ts, ts, [{"fpVal": float(base + rng.randint(-6, 6))}])
+            if m % 15 == 0 and not asleep(ts):
+                steps = rng.randint(600, 1500) if active(ts) else rng.randint(0, 350)
+                add("com.google.step_count.delta", ts, ts + 15 * minute, [{"intVal": steps}])
+                add("com.google.distance.delta", ts, ts + 15 * minute, [{"fpVal": steps * 0.75}])
+                if active(ts):
+                    add("com.google.active_minutes", ts, ts + 15 * minute, [{"intVal": 15}])
+                    add("com.google.heart_minutes", ts, ts + 15 * minute, [{"fpVal": 30.0}])
+                    add("com.google.power.sample", ts, ts, [{"fpVal": float(rng.randint(120, 260))}])
+            if m % 60 == 0:
+                add("com.google.calories.expended", ts, ts + 60 * minute, [{"fpVal": 55.0 + rng.random() * 50}])
+            if m % 10 == 0 and asleep(ts):
+                add("com.google.oxygen_saturation", ts, ts, [{"fpVal": float(rng.randint(93, 99))}])
+            if m % 30 == 0 and asleep(ts):
+                add("com.google.body.temperature", ts, ts, [{"fpVal": 33.5 + rng.random()}])
+                add("com.google.respiratory_rate", ts, ts, [{"fpVal": 13.0 + rng.random() * 3}])
+
+        for _ in range(rng.randint(0, 6)):
+            ts = d + rng.randint(8 * 60, 22 * 60) * minute
+            add("com.google.floor_change", ts, ts + minute, [{"fpVal": 1.0}])
+        add("com.google.heart_rate.resting", d + 8 * 60 * minute, d + 8 * 60 * minute, [{"fpVal": float(rng.randint(50, 62))}])
+
+        weigh_in = d + 7 * 60 * minute + rng.randint(0, 30) * minute
+        if rng.random() < 0.35:
+            add("com.google.weight", weigh_in, weigh_in, [{"fpVal": round(72.0 + rng.uniform(-1.5, 1.5), 1)}])
+            add("com.google.body.fat.percentage", weigh_in, weigh_in, [{"fpVal": round(17.0 + rng.uniform(-1, 1), 1)}])
+            if rng.random() < 0.5:
+                add("com.google.body.water_mass", weigh_in, weigh_in, [{"fpVal": round(41.0 + rng.uniform(-1, 1), 2)}])
+        if (d // DAY_MS) % 90 == 0:
+            add("com.google.height", weigh_in, weigh_in, [{"fpVal": 1.78}])
+        if rng.random() < 0.05:
+            add("com.google.blood_pressure", weigh_in, weigh_in, [{"fpVal": float(rng.randint(110, 130))}, {"fpVal": float(rng.randint(70, 85))}])
+        if rng.random() < 0.05:
+            add("com.google.blood_glucose", weigh_in, weigh_in, [{"fpVal": float(rng.randint(80, 110))}])
+
+        for hour in (8, 13, 20):
+            ts = d + hour * 60 * minute
+            add("com.google.nutrition", ts, ts, [{"mapVal": [{"key": "calories", "value": {"fpVal": float(rng.randint(350, 900))}}]}])
+        for _ in range(rng.randint(3, 7)):
+            ts = d + rng.randint(8 * 60, 22 * 60) * minute
+            add("com.google.hydration", ts, ts, [{"fpVal": 0.25}])
+
+        for plist in points.values():
+            plist.sort(key=lambda p: int(p["startTimeNanos"]))
+        starts = {k: [int(p["startTimeNanos"]) // 1_000_000 for p in v] for k, v in points.items()}
+        return {"points": points, "starts": starts, "sessions": sessions}
+
+    @staticmethod
+    def _parse_rfc3339(value):
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).timestamp() * 1000)
+
+
+class RecordingFitService:
+    """
+    Avvolge il service reale di googleapiclient e salva ogni risposta come fixture
+    (fixtures_dir/<metodo>/<hash>.json), riutilizzabile poi da FakeFitService in replay.
+    Le batch vengono eseguite una richiesta alla volta: in registrazione conta la fedeltà, non la velocità.
+    """
+    def __init__(self, service, fixtures_dir):
+        self.service = service
+        self.fixtures_dir = fixtures_dir
+        self._http = getattr(service, '_http', None)  # Trasporto reale (CountingHttp): byte ricevuti misurabili
+
+    def users(self):
+        users = self.service.users()
+        return _Resource(
+            self,
+            dataset=lambda: _Resource(self, aggregate=lambda userId, body: self._wrap(
+                "dataset.aggregate", {"userId": userId, "body": body},
+                lambda: users.dataset().aggregate(userId=userId, body=body))),
+            sessions=lambda: _Resource(self, list=lambda userId, startTime=None, endTime=None, includeDeleted=False, **kw: self._wrap(
+                "sessions.list", {"userId": userId, "startTime": startTime, "endTime": endTime, "includeDeleted": includeDeleted},
+                lambda: users.sessions().list(userId=userId, startTime=startTime, endTime=endTime, includeDeleted=includeDeleted, **kw))),
+            dataSources=lambda: _Resource(
+                self,
+                list=lambda userId, dataTypeName=None, **kw: self._wrap(
+                    "dataSources.list", {"userId": userId, "dataTypeName": dataTypeName},
+                    lambda: users.dataSources().list(userId=userId, dataTypeName=dataTypeName, **kw)),
+                datasets=lambda: _Resource(self, get=lambda userId, dataSourceId, datasetId, limit=None, pageToken=None, **kw: self._wrap(
+                    "datasets.get", {"userId": userId, "dataSourceId": dataSourceId, "datasetId": datasetId,
+                                     "limit": limit, "pageToken": pageToken},
+                    lambda: users.dataSources().datasets().get(
+                        userId=userId, dataSourceId=dataSourceId, datasetId=datasetId,
+                        **{k: v for k, v in (("limit", limit), ("pageToken", pageToken)) if v is not None}, **kw)))),
+        )
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(_NoLatency(), callback)
+
+    def _wrap(self, method, params, build_request):
+        # I parametri vanno fotografati ora: FitFetcher riusa e modifica i body
+        return _RecordingRequest(self, method, json.loads(json.dumps(params)), build_request)
+
+    def _save(self, method, params, response):
+        folder = os.path.join(self.fixtures_dir, method)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, request_key(method, params) + ".json"), 'w', encoding='utf-8') as f:
+            json.dump({"method": method, "params": params, "response": response}, f)
+
+
+class _RecordingRequest:
+    def __init__(self, recorder, method, params, build_request):
+        self.owner = self
+        self.recorder = recorder
+        self.method = method
+        self.params = params
+        self.build_request = build_request
+
+    def execute(self, num_retries=0):
+        return self._execute(self, batched=False)
+
+    def _execute(self, request, batched):
+        response = self.build_request().execute()
+        self.recorder._save(self.method, self.params, response)
+        return response
+
+
+class _NoLatency:
+    def _begin_batch(self, size):
+        pass
@@ -1,86 +1,419 @@
+import time
 from datetime import datetime, timezone
+from modules.fit.sessions import SessionIndex
+from modules.fit.ratelimit import is_rate_limit_error
+from modules.fit.retry import RetryPolicy, CircuitOpenError, is_transient_error
+from modules.fit.step_source import StepSourceCache
+
+class MissingResponse(dict):
+    """
+    Risposta NON ottenuta (errore anche dopo i tentativi). Si comporta come una risposta vuota,
+    ma is_retrieved() la distingue da una giornata davvero a zero.
+    """
+    def __init__(self, error=None):
+        super().__init__()
+        self.error = error
+
+class MissingSessions(list):
+    """Sessioni di una finestra non scaricata del tutto: contiene solo quelle già note."""
+    def __init__(self, sessions=(), error=None):
+        super().__init__(sessions)
+        self.error = error
+
+def is_retrieved(result):
+    """False se il risultato di fetch_many è un segnaposto per dati non scaricati."""
+    return not isinstance(result, (MissingResponse, MissingSessions))
 
 class FitFetcher:
-    def __init__(self, service):
+    DEFAULT_STEP_SOURCE = "derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas"
+    # Punti per pagina di datasets.get: limita i punti decodificati in memoria per ogni richiesta
+    DATASET_PAGE_SIZE = 2000
+
+    # Endpoint REST per tipo di richiesta (label delle metriche)
+    ENDPOINTS = {"aggregate": "dataset.aggregate", "latest": "dataset.aggregate",
+                 "sessions": "sessions.list", "data_sources": "dataSources.list", "dataset": "datasets.get"}
+
+    def __init__(self, service, batch=False, cache=None, limiter=None, step_source=None, metrics=None, retry=None, breaker=None):
         self.service = service
+        # Se True, fetch_many invia le richieste indipendenti in un'unica BatchHttpRequest
+        self.batch = batch
+        # ResponseCache opzionale: le risposte già viste non consumano quota
+        self.cache = cache
+        # RateLimiter opzionale condiviso tra i worker (quota per-utente della Fitness API)
+        self.limiter = limiter
+        # Sessioni già scaricate: sonno e sport (e giorni consecutivi) le condividono
+        self.sessions = SessionIndex()
+        # Sorgente passi risolta, in memoria e su disco (cache/step_source.json) con TTL
+        self.step_source = step_source if step_source is not None else StepSourceCache()
+        # RunMetrics opzionale: tempi, byte ed errori per endpoint e dataTypeName
+        self.metrics = metrics
+        # Retry degli errori transitori (backoff con jitter, Retry-After, budget di attesa del run)
+        self.retry = retry if retry is not None else RetryPolicy()
+        # CircuitBreaker opzionale condiviso: mette in pausa tutti i worker quando la quota è esaurita
+        self.breaker = breaker
+
+    def clone(self, service):
+        """Fetcher per un altro thread: service proprio (httplib2 non è thread-safe), stato condiviso."""
+        other = FitFetcher(service, batch=self.batch, cache=self.cache, limiter=self.limiter,
+                           step_source=self.step_source, metrics=self.metrics, retry=self.retry, breaker=self.breaker)
+        other.sessions = self.sessions
+        return other
 
     def fetch_aggregate(self, start_ms, end_ms, request_body):
-        request_body['startTimeMillis'] = start_ms
-        request_body['endTimeMillis'] = end_ms
-        try:
-            return self.service.users().dataset().aggregate(userId='me', body=request_body).execute()
-        except Exception as e:
-            # print(f"DEBUG: Aggreg Error {e}") # Scommenta se vuoi debuggare
-            return {}
+        return self.fetch_many({"r": ("aggregate", start_ms, end_ms, request_body)})["r"]
 
     def fetch_raw_sessions(self, start_ms, end_ms):
-        try:
+        return self.fetch_many({"r": ("sessions", start_ms, end_ms)})["r"]
+
+    def fetch_latest_data_point(self, start_ms, end_ms, data_type_name):
+        return self.fetch_many({"r": ("latest", start_ms, end_ms, data_type_name)})["r"]
+
+    @staticmethod
+    def dataset_samples(page):
+        """(ts_ms, valore) dei punti di una pagina di datasets.get."""
+        for p in page.get('point', []):
+            v = p['value'][0]
+            yield int(p['startTimeNanos']) // 1_000_000, v['fpVal'] if 'fpVal' in v else v.get('intVal', 0)
+
+    def fetch_many(self, calls):
+        """
+        Esegue un gruppo di richieste INDIPENDENTI tra loro.
+        calls: {chiave: (tipo, *argomenti)} con tipo tra
+            ("aggregate", start_ms, end_ms, body), ("sessions", start_ms, end_ms),
+            ("latest", start_ms, end_ms, data_type_name), ("data_sources", data_type_name),
+            ("dataset", start_ms, end_ms, data_source_id, limit, page_token).
+        Ritorna {chiave: risultato}, identico a quello del metodo singolo corrispondente.
+        Le richieste fallite anche dopo i retry diventano MissingResponse / MissingSessions
+        (vuote, ma riconoscibili con is_retrieved): "non scaricato" non è "zero".
+        Le sessions vengono servite dall'indice: si scaricano solo le porzioni di finestra
+        non ancora coperte, unite in una richiesta per buco.
+        In modalità batch tutte le richieste viaggiano in un'unica chiamata HTTP.
+        """
+        if not calls: return {}
+        http_calls, session_calls, gaps = self._expand_sessions(calls)
+        return self._collect_sessions(self._execute(http_calls), session_calls, gaps)
+
+    def _expand_sessions(self, calls):
+        """Sostituisce le richieste sessions con una richiesta per ogni buco dell'indice."""
+        session_calls = {k: spec for k, spec in calls.items() if spec[0] == "sessions"}
+        http_calls = {k: spec for k, spec in calls.items() if spec[0] != "sessions"}
+
+        gaps = self.sessions.missing([(spec[1], spec[2]) for spec in session_calls.values()])
+        for i, (gs, ge) in enumerate(gaps):
+            http_calls[f"_sessions_gap_{i}"] = ("sessions", gs, ge)
+        return http_calls, session_calls, gaps
+
+    def _collect_sessions(self, results, session_calls, gaps):
+        failed = []
+        for i, (gs, ge) in enumerate(gaps):
+            sessions = results.pop(f"_sessions_gap_{i}")
+            if is_retrieved(sessions): self.sessions.add(gs, ge, sessions)
+            else: failed.append((gs, ge, sessions.error))
+        for key, spec in session_calls.items():
+            found = self.sessions.query(spec[1], spec[2])
+            errors = [err for gs, ge, err in failed if gs <= spec[2] and ge >= spec[1]]
+            results[key] = MissingSessions(found, errors[0]) if errors else found
+        return results
+
+    def _execute(self, calls):
+        raw = {}
+        pending = {}
+        for key, spec in calls.items():
+            cached = self.cache.get(self._cache_parts(spec)) if self.cache is not None else None
+            if cached is not None: raw[key] = (cached, None)
+            else: pending[key] = spec
+            if self.cache is not None and self.metrics is not None:
+                self.metrics.incr("fit_cache_lookups_total", result="hit" if cached is not None else "miss",
+                                  endpoint=self.ENDPOINTS[spec[0]])
+        raw.update(self._send(pending))
+
+        results = {}
+        for key, spec in calls.items():
+            response, exception = raw[key]
+            if exception is None:
+                try:
+                    results[key] = self._parse_response(spec, response)
+                    if key in pending and self.cache is not None:
+                        self.cache.put(self._cache_parts(spec), response, self._window_end(spec))
+                    continue
+                except Exception as e:
+                    exception = e
+            if self.metrics is not None:
+                self.metrics.error("fit_errors_total", exception, window=self._window(spec), **self._labels(spec))
+            results[key] = self._on_error(spec, exception)
+        return results
+
+    def _send(self, calls):
+        """
+        Invia le richieste (una per una o in batch). Ritorna {chiave: (risposta, eccezione)}.
+        Le richieste fallite per errori transitori vengono rimandate secondo la RetryPolicy;
+        i rate limit, con un limiter attivo, rallentano e mettono in pausa tutti i worker.
+        """
+        raw = {}
+        pending = calls
+        attempt = 0
+        while pending:
+            try:
+                if self.breaker is not None: self.breaker.wait()
+            except CircuitOpenError as e:
+                raw.update((k, (None, e)) for k in pending)
+                break
+            raw.update(self._send_once(pending))
+            failed = {k: raw[k][1] for k in pending if raw[k][1] is not None}
+            if self.limiter is not None:
+                self.limiter.on_success(len(pending) - sum(is_rate_limit_error(e) for e in failed.values()))
+            if self.breaker is not None:
+                for k in pending: self.breaker.record(raw[k][1])
+
+            retry = {k: e for k, e in failed.items() if is_transient_error(e)}
+            delay = self._retry_delay([(calls[k], e) for k, e in retry.items()], attempt) if retry else None
+            if delay is None: break
+            if delay > 0: time.sleep(delay)
+            attempt += 1
+            pending = {k: calls[k] for k in retry}
+        return raw
+
+    def _retry_delay(self, failures, attempt):
+        """
+        Attesa prima di ritentare le richieste fallite [(spec, errore)], o None se non si ritenta
+        (tentativi o budget esauriti). Per i rate limit con limiter attivo la pausa passa dal
+        limiter, che ferma tutti i worker: in quel caso l'attesa diretta è 0.
+        """
+        _, error = next(((s, e) for s, e in failures if is_rate_limit_error(e)), failures[0])
+        delay = self.retry.next_delay(attempt, error)
+        if self.metrics is not None:
+            for spec, e in failures:
+                self.metrics.incr("fit_retries_total", endpoint=self.ENDPOINTS[spec[0]],
+                                  outcome="retry" if delay is not None else "gave_up",
+                                  reason="rate_limit" if is_rate_limit_error(e) else type(e).__name__)
+        if delay is None: return None
+        if self.metrics is not None: self.metrics.observe("fit_retry_wait_seconds", delay)
+        if self.limiter is not None and is_rate_limit_error(error):
+            self.limiter.on_rate_limited(delay)
+            return 0.0
+        return delay
+
+    def _send_once(self, calls):
+        if not calls: return {}
+        requests = {key: self._build_request(spec) for key, spec in calls.items()}
+        if self.limiter is not None: self.limiter.acquire(len(requests))
+
+        if not self.batch or len(calls) == 1:
+            raw = {}
+            for key, req in requests.items():
+                before = self._received_bytes()
+                t0 = time.perf_counter()
+                try:
+                    raw[key] = (req.execute(), None)
+                except Exception as e:
+                    raw[key] = (None, e)
+                size = self._received_bytes() - before if before is not None else None
+                self._record(calls[key], raw[key][0], time.perf_counter() - t0, size)
+            return raw
+
+        raw = {}
+        def _callback(request_id, response, exception):
+            raw[request_id] = (response, exception)
+
+        # L'endpoint batch accetta al massimo 1000 richieste per chiamata
+        keys = list(requests)
+        before = self._received_bytes()
+        for i in range(0, len(keys), 1000):
+            batch = self.service.new_batch_http_request(callback=_callback)
+            for key in keys[i:i + 1000]:
+                batch.add(requests[key], request_id=key)
+            t0 = time.perf_counter()
+            try:
+                batch.execute()
+            except Exception as e:
+                for key in keys[i:i + 1000]: raw.setdefault(key, (None, e))
+            if self.metrics is not None:
+                self.metrics.observe("fit_batch_duration_seconds", time.perf_counter() - t0)
+
+        if before is not None and self.metrics is not None:
+            # Una sola risposta multipart per batch: i byte non si dividono per endpoint
+            self.metrics.incr("fit_response_bytes_total", self._received_bytes() - before, endpoint="batch")
+
+        for key in calls:
+            raw.setdefault(key, (None, RuntimeError("Risposta batch mancante")))
+            # In batch la durata è per chiamata HTTP, non per singola richiesta
+            self._record(calls[key], raw[key][0])
+        return raw
+
+    # --- METRICHE ---
+
+    def _labels(self, spec):
+        kind = spec[0]
+        if kind == "aggregate":
+            data_type = ",".join(sorted(a.get('dataTypeName') or a.get('dataSourceId', '?') for a in spec[3].get('aggregateBy', [])))
+        elif kind == "latest": data_type = spec[3]
+        elif kind == "data_sources": data_type = spec[1]
+        elif kind == "dataset": data_type = spec[3].split(':')[1]
+        else: data_type = None
+        return {"endpoint": self.ENDPOINTS[kind], "data_type": data_type}
+
+    @staticmethod
+    def _window(spec):
+        if spec[0] == "data_sources": return None
+        fmt = lambda ms: datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%MZ')
+        return f"{fmt(spec[1])}/{fmt(spec[2])}"
+
+    def _record(self, spec, response, seconds=None, size_bytes=None):
+        if self.metrics is None: return
+        labels = self._labels(spec)
+        self.metrics.incr("fit_requests_total", **labels)
+        if seconds is not None: self.metrics.observe("fit_request_duration_seconds", seconds, **labels)
+        if response is not None:
+            # Volume della risposta senza riserializzarla: bucket + punti + sessioni
+            self.metrics.incr("fit_response_items_total", self._response_items(response), endpoint=labels["endpoint"])
+        if size_bytes is not None:
+            # Byte esatti dei corpi ricevuti (httpx, CountingHttp); in batch li conta _send_once
+            self.metrics.incr("fit_response_bytes_total", size_bytes, endpoint=labels["endpoint"])
+
+    def _received_bytes(self):
+        """Byte ricevuti finora dal trasporto del service (CountingHttp), None se non misurabili (es. fake)."""
+        return getattr(getattr(self.service, '_http', None), 'received_bytes', None)
+
+    @staticmethod
+    def _response_items(response):
+        if isinstance(response, list): return len(response)
+        items = len(response.get('point', ())) + len(response.get('session', ())) + len(response.get('dataSource', ()))
+        for b in response.get('bucket', ()):
+            items += 1 + sum(len(ds.get('point', ())) for ds in b.get('dataset', ()))
+        return items
+
+    @staticmethod
+    def _cache_parts(spec):
+        """Forma canonica della richiesta (tipo + finestra + body) usata come chiave di cache."""
+        if spec[0] == "aggregate":
+            body = {k: v for k, v in spec[3].items() if k not in ('startTimeMillis', 'endTimeMillis')}
+            return ["aggregate", spec[1], spec[2], body]
+        return list(spec)
+
+    @staticmethod
+    def _window_end(spec):
+        return spec[2] if spec[0] in ("aggregate", "sessions", "latest", "dataset") else None
+
+    # --- COSTRUZIONE / PARSING DELLE RICHIESTE ---
+
+    def _build_request(self, spec):
+        kind = spec[0]
+        if kind == "aggregate":
+            _, start_ms, end_ms, request_body = spec
+            request_body['startTimeMillis'] = start_ms
+            request_body['endTimeMillis'] = end_ms
+            return self.service.users().dataset().aggregate(userId='me', body=request_body)
+        if kind == "sessions":
+            _, start_ms, end_ms = spec
             # FIX DEPRECATION: Usa datetime.fromtimestamp(ts, timezone.utc)
             start_dt = datetime.fromtimestamp(start_ms/1000, timezone.utc).isoformat()
             end_dt = datetime.fromtimestamp(end_ms/1000, timezone.utc).isoformat()
-            
-            response = self.service.users().sessions().list(
-                userId='me', 
+            return self.service.users().sessions().list(
+                userId='me',
                 startTime=start_dt,
                 endTime=end_dt,
                 includeDeleted=False
-            ).execute()
-            
-            raw_list = response.get('session', [])
-            cleaned_list = []
-            
-            for s in raw_list:
-                start = int(s.get('startTimeMillis', 0))
-                end = int(s.get('endTimeMillis', 0))
-                
-                # Calcolo duration in minuti
-                duration_min = (end - start) / 60000
-                
-                # Format time usando il fuso locale per leggibilità nel JSON finale, 
-                # MA i calcoli interni usano i timestamp raw.
-                # Nota: qui usiamo fromtimestamp "semplice" per avere l'ora locale (es. 23:00) per il report
-                s_fmt = datetime.fromtimestamp(start/1000).strftime('%H:%M')
-                e_fmt = datetime.fromtimestamp(end/1000).strftime('%H:%M')
-
-                cleaned_list.append({
-                    "name": s.get('name', 'Activity'),
-                    "activity_type": int(s.get('activityType', 0)),
-                    "start_ms": start,
-                    "end_ms": end,
-                    "start_fmt": s_fmt,
-                    "end_fmt": e_fmt,
-                    "duration": duration_min
-                })
-            
-            return cleaned_list
-        except Exception as e: 
-            print(f"⚠️ Session Fetch Error: {e}")
-            return []
-
-    # ... (Il resto di fetch_latest_data_point e find_step_source rimane uguale)
-    def fetch_latest_data_point(self, start_ms, end_ms, data_type_name):
-        body = {
+            )
+        if kind == "latest":
+            return self.service.users().dataset().aggregate(userId='me', body=self._latest_body(spec))
+        if kind == "data_sources":
+            return self.service.users().dataSources().list(userId='me', dataTypeName=spec[1])
+        if kind == "dataset":
+            _, start_ms, end_ms, data_source_id, limit, page_token = spec
+            extra = {"pageToken": page_token} if page_token else {}
+            return self.service.users().dataSources().datasets().get(
+                userId='me', dataSourceId=data_source_id,
+                datasetId=f"{start_ms * 1_000_000}-{end_ms * 1_000_000}", limit=limit, **extra
+            )
+        raise ValueError(f"Tipo di richiesta sconosciuto: {kind}")
+
+    @staticmethod
+    def _latest_body(spec):
+        _, start_ms, end_ms, data_type_name = spec
+        return {
             "aggregateBy": [{"dataTypeName": data_type_name}],
             "bucketByTime": {"durationMillis": end_ms - start_ms},
             "startTimeMillis": start_ms, "endTimeMillis": end_ms
         }
-        try:
-            r = self.service.users().dataset().aggregate(userId='me', body=body).execute()
-            if r.get('bucket') and r['bucket'][0].get('dataset'):
-                d = r['bucket'][0]['dataset'][0]
-                if d.get('point'):
-                    return d['point'][-1]['value'] # Qui va bene l'ultimo punto (es. ultimo peso registrato)
-        except: pass
+
+    def _parse_response(self, spec, response):
+        kind = spec[0]
+        if kind == "sessions": return self._clean_sessions(response)
+        if kind == "latest": return self._extract_latest(response)
+        return response
+
+    @staticmethod
+    def _on_error(spec, error):
+        kind = spec[0]
+        if kind in ("data_sources", "dataset"): raise error
+        if kind == "sessions":
+            # Finestra NON coperta: non entra nell'indice, verrà richiesta di nuovo alla prossima occasione
+            print(f"⚠️ Session Fetch Error: {error}")
+            return MissingSessions(error=error)
+        # Errore registrato in RunMetrics (con endpoint, dataTypeName e finestra) se attivo
+        return MissingResponse(error)
+
+    @staticmethod
+    def _clean_sessions(response):
+        raw_list = response.get('session', [])
+        cleaned_list = []
+
+        for s in raw_list:
+            start = int(s.get('startTimeMillis', 0))
+            end = int(s.get('endTimeMillis', 0))
+
+            # Calcolo duration in minuti
+            duration_min = (end - start) / 60000
+
+            # Format time usando il fuso locale per leggibilità nel JSON finale,
+            # MA i calcoli interni usano i timestamp raw.
+            # Nota: qui usiamo fromtimestamp "semplice" per avere l'ora locale (es. 23:00) per il report
+            s_fmt = datetime.fromtimestamp(start/1000).strftime('%H:%M')
+            e_fmt = datetime.fromtimestamp(end/1000).strftime('%H:%M')
+
+            cleaned_list.append({
+                "name": s.get('name', 'Activity'),
+                "activity_type": int(s.get('activityType', 0)),
+                "start_ms": start,
+                "end_ms": end,
+                "start_fmt": s_fmt,
+                "end_fmt": e_fmt,
+                "duration": duration_min
+            })
+
+        return cleaned_list
+
+    @staticmethod
+    def _extract_latest(response):
+        if response.get('bucket') and response['bucket'][0].get('dataset'):
+            d = response['bucket'][0]['dataset'][0]
+            if d.get('point'):
+                return d['point'][-1]['value'] # Qui va bene l'ultimo punto (es. ultimo peso registrato)
         return None
 
     def find_step_source(self):
+        cached, fresh = self.step_source.get()
+        if fresh: return cached
+
         try:
-            response = self.service.users().dataSources().list(userId='me', dataTypeName='com.google.step_count.delta').execute()
-            for ds in response.get('dataSource', []):
-                if "SM-R9" in ds.get('device', {}).get('model', '') and "derived" in ds.get('type', ''):
-                    return ds.get('dataStreamId')
-            for ds in response.get('dataSource', []):
-                if "SM-R9" in ds.get('device', {}).get('model', ''):
-                    return ds.get('dataStreamId')
-            return "derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas"
-        except: return "derived:com.google.step_count.delta:com.google.android.gms:merge_step_deltas"
\ No newline at end of file
+            response = self.fetch_many({"r": ("data_sources", 'com.google.step_count.delta')})["r"]
+        except Exception as e:
+            # Lookup fallito: meglio lo stream già noto (anche se scaduto) del merge generico
+            print(f"⚠️ Lookup sorgente passi fallito: {e}")
+            return cached or self.DEFAULT_STEP_SOURCE
+
+        stream_id = self._select_step_source(response)
+        self.step_source.set(stream_id)
+        return stream_id
+
+    def invalidate_step_source(self):
+        self.step_source.invalidate()
+
+    def _select_step_source(self, response):
+        for ds in response.get('dataSource', []):
+            if "SM-R9" in ds.get('device', {}).get('model', '') and "derived" in ds.get('type', ''):
+                return ds.get('dataStreamId')
+        for ds in response.get('dataSource', []):
+            if "SM-R9" in ds.get('device', {}).get('model', ''):
+                return ds.get('dataStreamId')
+        return self.DEFAULT_STEP_SOURCE
\ No newline at end of file
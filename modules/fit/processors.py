@@ -1,6 +1,20 @@
-from datetime import datetime
+import bisect
 
 class FitProcessor:
+    # com.google.sleep.segment -> (fase, conta come sonno). 3 = "fuori dal letto": ignorato
+    SLEEP_STAGES = {
+        1: ("awake", False),
+        2: ("sleep", True),
+        4: ("light", True),
+        5: ("deep", True),
+        6: ("rem", True),
+    }
+    # Zone cardio come frazioni della FC massima (da personalizzare: test o 220 - età)
+    HR_MAX = 190
+    HR_ZONE_BOUNDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+    # Un campione HR "vale" al massimo fino al successivo o per 5 minuti (bucket dell'aggregate)
+    HR_SAMPLE_MAX_GAP_MS = 5 * 60 * 1000
+
     @staticmethod
     def extract_int(dataset_item):
         points = dataset_item.get('point', [])
@@ -11,58 +25,74 @@ class FitProcessor:
         points = dataset_item.get('point', [])
         return sum(v['fpVal'] for x in points for v in x['value'] if 'fpVal' in v)
 
-    @staticmethod
-    def _is_time_in_range(time_str, start_str, end_str):
-        """Helper per verificare se un orario HH:MM è dentro un range (gestisce accavallamento notte)."""
-        def to_mins(t): 
-            h, m = map(int, t.split(':'))
-            return h * 60 + m
-        
-        t = to_mins(time_str)
-        s = to_mins(start_str)
-        e = to_mins(end_str)
+    def calculate_active_hr(self, hr, sleep_intervals):
+        """Media HR escludendo i campioni che cadono nelle sessioni di sonno (intervalli epoch ms)."""
+        st = hr.stats(~hr.mask_within(sleep_intervals))
+        return int(st['mean']) if st else None
 
-        if s > e: # Scavalla la mezzanotte (es. 23:00 -> 07:00)
-            return t >= s or t <= e
-        else:     # Stesso giorno (es. 14:00 -> 16:00)
-            return s <= t <= e
+    def calculate_sleep_rhr(self, hr, sleep_intervals):
+        """Media HR dei soli campioni dentro le sessioni di sonno."""
+        if not sleep_intervals: return None
+        st = hr.stats(hr.mask_within(sleep_intervals))
+        return int(st['mean']) if st else None
 
-    def calculate_active_hr(self, hr_samples, sleep_data):
-        """Calcola la media HR escludendo ESPLICITAMENTE gli orari di sonno."""
-        if not hr_samples: return None
-        
-        # Se non c'è sonno, tutto è "active"
-        if not sleep_data or sleep_data.get('total_hours', 0) == 0:
-            avg = sum(s['bpm'] for s in hr_samples) / len(hr_samples)
-            return int(avg)
+    def calculate_hr_zones(self, hr, max_gap_ms=HR_SAMPLE_MAX_GAP_MS):
+        """Minuti per zona cardio (z0 = sotto la prima soglia), pesando ogni campione per la sua durata."""
+        bounds = [self.HR_MAX * f for f in self.HR_ZONE_BOUNDS]
+        minutes = hr.time_in_ranges(bounds, max_gap_ms)
+        return {f"z{i}": round(float(m), 1) for i, m in enumerate(minutes)}
+
+    @staticmethod
+    def assign_sleep_segments(sessions, points):
+        """
+        Attribuisce ogni segmento di sonno alla sessione con cui si sovrappone di più (sweep ordinato).
+        Ritorna, per ogni sessione (stesso ordine di input), la lista dei suoi punti in ordine temporale.
+        """
+        assigned = [[] for _ in sessions]
+        if not sessions or not points: return assigned
 
-        active_vals = []
-        for sample in hr_samples:
-            # Se NON è nel range del sonno, è attivo
-            if not self._is_time_in_range(sample['time'], sleep_data['start'], sleep_data['end']):
-                active_vals.append(sample['bpm'])
-        
-        return int(sum(active_vals)/len(active_vals)) if active_vals else None
+        order = sorted(range(len(sessions)), key=lambda i: sessions[i]['start_ms'])
+        starts = [sessions[i]['start_ms'] for i in order]
+        # max_end[k] = fine massima tra le prime k+1 sessioni (in ordine di inizio)
+        max_end = []
+        for i in order:
+            max_end.append(max(sessions[i]['end_ms'], max_end[-1] if max_end else 0))
 
-    def calculate_sleep_rhr(self, hr_samples, sleep_data):
-        """Calcola la media HR includendo SOLO gli orari di sonno."""
-        if not sleep_data or sleep_data.get('total_hours', 0) == 0 or not hr_samples: 
-            return None
-            
-        sleep_vals = []
-        for sample in hr_samples:
-            if self._is_time_in_range(sample['time'], sleep_data['start'], sleep_data['end']):
-                sleep_vals.append(sample['bpm'])
-                
-        return int(sum(sleep_vals)/len(sleep_vals)) if sleep_vals else None
+        for p in sorted(points, key=lambda x: int(x.get('startTimeNanos', 0))):
+            p_s = int(p.get('startTimeNanos', 0)) // 1_000_000
+            p_e = int(p.get('endTimeNanos', 0)) // 1_000_000
+            # Prima sessione che può ancora sovrapporsi (tutte le precedenti finiscono prima di p_s)
+            k = bisect.bisect_right(max_end, p_s)
+            best, best_overlap = None, 0
+            while k < len(order) and starts[k] < p_e:
+                sess = sessions[order[k]]
+                overlap = min(p_e, sess['end_ms']) - max(p_s, sess['start_ms'])
+                if overlap > best_overlap: best, best_overlap = order[k], overlap
+                k += 1
+            if best is not None: assigned[best].append(p)
+        return assigned
 
     @staticmethod
-    def calculate_energy_score(sleep, steps, rhr):
-        score = 0
+    def calculate_energy_score(sleep, steps, rhr, baseline=None):
+        """
+        Punteggio 0-100: sonno (40), RHR (30), passi (30).
+        baseline (medie personali a 28 giorni, vedi RollingBaselines): ogni componente è
+        proporzionale allo scostamento dalla propria media; senza baseline soglie fisse.
+        """
         # FIX: Usa total_hours (calcolato nel service come helper) o converti total_minutes
         hours = sleep.get('total_hours', 0) 
         # Oppure se sleep ha solo minuti: hours = sleep.get('total_minutes', 0) / 60
-        
+
+        if baseline:
+            clip = lambda x: max(0.0, min(1.0, x))
+            score = 0.0
+            if baseline.get('sleep_min'): score += 40 * clip(hours * 60 / baseline['sleep_min'])
+            # RHR pari o sotto la media: pieno; -5 punti per ogni bpm sopra
+            if rhr and baseline.get('rhr'): score += 30 * clip(1 - (rhr - baseline['rhr']) / 6)
+            if baseline.get('steps'): score += 30 * clip(steps / baseline['steps'])
+            return min(100, int(round(score)))
+
+        score = 0
         if hours >= 7: score += 40
         if rhr and rhr < 60: score += 30
         if steps > 8000: score += 30
@@ -0,0 +1,76 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+
+# Reason dei 403 che indicano quota/rate limit (non un permesso mancante)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'dailyLimitExceeded')
+
+def is_rate_limit_error(error):
+    """True per HTTP 429 o 403 con reason di rate limit / quota esaurita."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status == 429: return True
+    if status == 403:
+        content = getattr(error, 'content', b'') or b''
+        if isinstance(content, bytes): content = content.decode('utf-8', 'ignore')
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+def retry_after_seconds(error):
+    """Valore dell'header Retry-After (secondi o data HTTP) se presente nella risposta di errore."""
+    resp = getattr(error, 'resp', None)
+    try:
+        value = resp.get('retry-after') if resp is not None else None
+    except (TypeError, AttributeError):
+        return None
+    if value is None: return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """
+    Token bucket condiviso tra tutti i worker, tarato sulla quota per-utente della Fitness API.
+    Adattivo: su 429/403 rateLimitExceeded dimezza la velocità e sospende tutti per un cooldown,
+    poi risale gradualmente verso la velocità configurata a ogni risposta andata a buon fine.
+    """
+    def __init__(self, rate_per_min=300, burst=None, min_rate_per_min=10, cooldown_s=5.0):
+        self.max_rate = rate_per_min / 60.0
+        self.min_rate = min_rate_per_min / 60.0
+        self.rate = self.max_rate
+        self.capacity = burst or max(1, rate_per_min // 10)
+        self.cooldown_s = cooldown_s
+        self.throttle_events = 0
+
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Prenota n richieste e attende il tempo necessario (i token possono andare in debito)."""
+        with self._lock:
+            now = time.monotonic()
+            if now > self._last:
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+            self._tokens -= n
+            # _last può essere nel futuro durante una pausa per rate limit
+            wait = (self._last - now) + max(0.0, -self._tokens) / self.rate
+        if wait > 0: time.sleep(wait)
+
+    def on_rate_limited(self, retry_after=None):
+        with self._lock:
+            self.throttle_events += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause_until = time.monotonic() + (retry_after if retry_after is not None else self.cooldown_s)
+            self._last = max(self._last, pause_until)
+            self._tokens = min(self._tokens, 0.0)
+
+    def on_success(self, n=1):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + n * self.max_rate * 0.05)
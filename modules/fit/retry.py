@@ -0,0 +1,130 @@
+import time
+import random
+import threading
+from modules.fit.ratelimit import is_rate_limit_error, retry_after_seconds
+
+# Status HTTP per cui ha senso ritentare (oltre ai rate limit)
+TRANSIENT_STATUSES = (408, 500, 502, 503, 504)
+
+def is_transient_error(error):
+    """True per errori che possono sparire ritentando: rate limit/quota, 5xx, timeout e cadute di connessione."""
+    if is_rate_limit_error(error): return True
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        return int(status) in TRANSIENT_STATUSES
+    if isinstance(error, (TimeoutError, ConnectionError)): return True
+    # Errori di trasporto di httplib2 / httpx, riconosciuti senza importare le librerie
+    return any(c.__name__ in ("HttpLib2Error", "TransportError") for c in type(error).__mro__)
+
+
+class RetryPolicy:
+    """
+    Quando e quanto attendere prima di ritentare una richiesta fallita per un errore transitorio.
+    Backoff esponenziale con "full jitter" (attesa casuale in [0, base * 2^tentativo], al massimo
+    max_delay_s), oppure il Retry-After indicato dal server.
+    budget_s: secondi totali di attesa per retry nell'intero run, condivisi da tutti i worker.
+    A budget esaurito non si ritenta più: la richiesta resta "non recuperata" e il giorno incompleto.
+    """
+    def __init__(self, max_retries=4, base_delay_s=0.5, max_delay_s=30.0, budget_s=None, seed=None):
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.budget_s = budget_s
+        self.spent_s = 0.0
+        self.budget_exhausted = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_delay(self, attempt, error=None):
+        """Attesa (s) prima del tentativo attempt+1, o None se non si deve ritentare."""
+        if attempt >= self.max_retries: return None
+        retry_after = retry_after_seconds(error) if error is not None else None
+        with self._lock:
+            if retry_after is not None: delay = retry_after
+            else: delay = self._rng.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+            if self.budget_s is not None and self.spent_s + delay > self.budget_s:
+                self.budget_exhausted += 1
+                return None
+            self.spent_s += delay
+        return delay
+
+    def reset(self):
+        """Nuovo budget di attesa (es. backfill: a ogni finestra di quota)."""
+        with self._lock:
+            self.spent_s = 0.0
+
+
+class CircuitOpenError(Exception):
+    """La richiesta non parte: il circuito è rimasto aperto oltre la pausa massima del run."""
+
+
+class CircuitBreaker:
+    """
+    Interruttore condiviso da tutti i worker (thread o coroutine).
+    Dopo `threshold` errori transitori consecutivi (quota esaurita, 5xx, timeout) si apre:
+    ogni nuova richiesta attende in wait() la fine della pausa (cooldown_s, o il Retry-After
+    se più lungo). Alla riapertura il primo errore lo riapre subito con pausa doppia
+    (fino a max_cooldown_s); la prima risposta buona lo richiude.
+    Oltre max_open_s di pausa complessiva nel run resta aperto: le richieste falliscono
+    subito con CircuitOpenError e i giorni restano marcati incompleti, invece di bloccare il run.
+    """
+    def __init__(self, threshold=5, cooldown_s=30.0, max_cooldown_s=600.0, max_open_s=1800.0):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.max_open_s = max_open_s
+        self.state = "closed"  # closed | open | half_open | stopped
+        self.open_events = 0
+        self.open_seconds = 0.0
+
+        self._failures = 0
+        self._cooldown = cooldown_s
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Richiude il circuito e azzera la pausa consumata (es. backfill: quota giornaliera ripristinata)."""
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._cooldown = self.cooldown_s
+            self._open_until = 0.0
+            self.open_seconds = 0.0
+
+    def wait(self):
+        """Blocca finché il circuito è aperto. CircuitOpenError se la pausa massima è esaurita."""
+        while True:
+            with self._lock:
+                if self.state == "stopped":
+                    raise CircuitOpenError(f"Circuito aperto da oltre {self.max_open_s:.0f}s: richiesta non inviata")
+                wait = self._open_until - time.monotonic()
+                if wait <= 0:
+                    if self.state == "open": self.state = "half_open"
+                    return
+            time.sleep(wait)
+
+    def record(self, error=None):
+        """Esito di una richiesta: None o errore non transitorio = servizio raggiungibile."""
+        if error is None or not is_transient_error(error):
+            with self._lock:
+                self._failures = 0
+                if self.state == "half_open":
+                    self.state = "closed"
+                    self._cooldown = self.cooldown_s
+            return
+
+        with self._lock:
+            self._failures += 1
+            retrying = self.state == "half_open"
+            if not retrying and (self.state != "closed" or self._failures < self.threshold): return
+            if retrying: self._cooldown = min(self.max_cooldown_s, self._cooldown * 2)
+            pause = max(self._cooldown, retry_after_seconds(error) or 0.0)
+            if self.open_seconds + pause > self.max_open_s:
+                self.state = "stopped"
+                print(f"🔌 Circuito Fit aperto definitivamente: pausa massima del run ({self.max_open_s:.0f}s) esaurita")
+                return
+            self.state = "open"
+            self.open_events += 1
+            self.open_seconds += pause
+            self._open_until = time.monotonic() + pause
+        print(f"🔌 Circuito Fit aperto: tutti i worker in pausa per {pause:.0f}s ({type(error).__name__})")
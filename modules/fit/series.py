@@ -0,0 +1,156 @@
+import zlib
+import base64
+from array import array
+from datetime import datetime
+import numpy as np
+
+# Versione del formato compatto di SampleSeries.encode (campo "v")
+SERIES_SCHEMA_VERSION = 1
+# Chiave del payload giornaliero con le SampleSeries esatte ({nome: serie}) per lo storico locale:
+# solo in memoria, non va su Supabase né nel JSON dei payload (vedi DbSink, HistoryStore)
+PAYLOAD_SERIES_KEY = "_series"
+
+class SampleSeries:
+    """
+    Campioni di una grandezza (HR, SpO2, ...) come array NumPy paralleli:
+    ts_ms (epoch ms, int64, ordinati) e values (float64).
+    Le finestre (sonno, attività) sono intervalli assoluti in epoch ms: niente orari HH:MM,
+    quindi nessuna ambiguità a cavallo della mezzanotte o tra giorni diversi.
+    """
+    def __init__(self, ts_ms=(), values=()):
+        self.ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if len(self.ts_ms) > 1 and np.any(np.diff(self.ts_ms) < 0):
+            order = np.argsort(self.ts_ms, kind='stable')
+            self.ts_ms, self.values = self.ts_ms[order], self.values[order]
+
+    def __len__(self):
+        return len(self.ts_ms)
+
+    @classmethod
+    def from_buckets(cls, response, dataset_index, cast=float):
+        """Un campione per bucket (primo punto del dataset), con timestamp = inizio del bucket."""
+        ts, values = [], []
+        for b in response.get('bucket', []):
+            ds = b.get('dataset', [])
+            if len(ds) > dataset_index and ds[dataset_index].get('point'):
+                ts.append(int(b['startTimeMillis']))
+                values.append(cast(ds[dataset_index]['point'][0]['value'][0]['fpVal']))
+        return cls(ts, values)
+
+    def mask_within(self, intervals):
+        """Maschera booleana dei campioni che cadono in almeno uno degli intervalli [start_ms, end_ms]."""
+        if not len(self) or not intervals:
+            return np.zeros(len(self), dtype=bool)
+        iv = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        starts = np.sort(iv[:, 0])
+        ends = np.sort(iv[:, 1])
+        # Intervalli "aperti" in t = iniziati entro t meno quelli già finiti prima di t
+        open_count = np.searchsorted(starts, self.ts_ms, side='right') - np.searchsorted(ends, self.ts_ms, side='left')
+        return open_count > 0
+
+    def stats(self, mask=None):
+        """min/max/media/percentili dei valori (eventualmente filtrati), o None se vuoti."""
+        v = self.values if mask is None else self.values[mask]
+        if not len(v): return None
+        p5, p50, p95 = np.percentile(v, [5, 50, 95])
+        return {
+            "count": int(len(v)), "min": float(v.min()), "max": float(v.max()), "mean": float(v.mean()),
+            "p5": float(p5), "p50": float(p50), "p95": float(p95)
+        }
+
+    def sample_durations_ms(self, max_gap_ms):
+        """Durata rappresentata da ogni campione: distanza dal successivo, limitata a max_gap_ms."""
+        if not len(self): return np.zeros(0, dtype=np.int64)
+        gaps = np.diff(self.ts_ms, append=self.ts_ms[-1] + max_gap_ms)
+        return np.minimum(gaps, max_gap_ms)
+
+    def time_in_ranges(self, bounds, max_gap_ms, mask=None):
+        """Minuti trascorsi in ciascuna fascia definita dai limiti crescenti `bounds` (len(bounds)+1 fasce)."""
+        durations = self.sample_durations_ms(max_gap_ms)
+        values = self.values
+        if mask is not None: durations, values = durations[mask], values[mask]
+        idx = np.digitize(values, bounds)
+        return np.bincount(idx, weights=durations, minlength=len(bounds) + 1) / 60000.0
+
+    def encode(self):
+        """
+        Rappresentazione compatta e senza perdite per il payload (raw_data):
+        timestamp come delta dal primo (int32, o int64 se non bastano), valori come int16 se tutti
+        interi in range, altrimenti float64; entrambi compressi con zlib e in base64.
+        """
+        deltas = np.diff(self.ts_ms)
+        ts_dtype = '<i4' if not len(deltas) or (deltas.min() >= -2**31 and deltas.max() < 2**31) else '<i8'
+        v = self.values
+        integral = len(v) and np.all(np.isfinite(v)) and np.all(v == np.round(v)) and v.min() >= -2**15 and v.max() < 2**15
+        val_dtype = '<i2' if integral or not len(v) else '<f8'
+        pack = lambda a, dt: base64.b64encode(zlib.compress(a.astype(dt).tobytes(), 6)).decode('ascii')
+        return {
+            "v": SERIES_SCHEMA_VERSION,
+            "n": len(self),
+            "t0": int(self.ts_ms[0]) if len(self) else None,
+            "ts_dtype": ts_dtype, "val_dtype": val_dtype,
+            "dts": pack(deltas, ts_dtype),
+            "vals": pack(v, val_dtype),
+        }
+
+    @classmethod
+    def decode(cls, payload):
+        """Inverso di encode()."""
+        if payload.get("v") != SERIES_SCHEMA_VERSION:
+            raise ValueError(f"Versione serie non supportata: {payload.get('v')}")
+        if not payload["n"]: return cls()
+        unpack = lambda text, dt: np.frombuffer(zlib.decompress(base64.b64decode(text)), dtype=dt)
+        deltas = unpack(payload["dts"], payload["ts_dtype"]).astype(np.int64)
+        ts = np.concatenate(([payload["t0"]], payload["t0"] + np.cumsum(deltas)))
+        return cls(ts, unpack(payload["vals"], payload["val_dtype"]).astype(np.float64))
+
+    @staticmethod
+    def is_encoded(obj):
+        return isinstance(obj, dict) and "v" in obj and "dts" in obj
+
+    def to_dicts(self, key, cast=int):
+        """Vista serializzabile compatibile col payload storico: [{"time": "HH:MM", key: valore}]."""
+        return [
+            {"time": datetime.fromtimestamp(ts / 1000).strftime('%H:%M'), key: cast(v)}
+            for ts, v in zip(self.ts_ms.tolist(), self.values.tolist())
+        ]
+
+
+class SeriesBuffer:
+    """
+    Buffer colonnare per campioni in streaming: due array compatti (int64 timestamp, float64 valori),
+    16 byte per campione, senza liste di dict. Una giornata a 1 Hz (86.400 campioni) occupa ~1,4 MB.
+    Oltre max_points i campioni vengono scartati (e contati in `dropped`): la memoria resta limitata.
+    """
+    def __init__(self, max_points=2 * 86400):
+        self.max_points = max_points
+        self.ts_ms = array('q')
+        self.values = array('d')
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.ts_ms)
+
+    def extend(self, samples):
+        """samples: iterabile (anche generatore) di (ts_ms, valore)."""
+        for ts, v in samples:
+            if len(self.ts_ms) >= self.max_points:
+                self.dropped += 1
+                continue
+            self.ts_ms.append(ts)
+            self.values.append(v)
+        return self
+
+    def merge(self, other):
+        """Accoda i campioni di un altro buffer (successivi a questi), sempre entro max_points."""
+        room = max(0, self.max_points - len(self))
+        self.ts_ms.extend(other.ts_ms[:room])
+        self.values.extend(other.values[:room])
+        self.dropped += other.dropped + max(0, len(other) - room)
+        return self
+
+    def to_series(self):
+        """SampleSeries che condivide la memoria del buffer (il buffer non va più esteso dopo)."""
+        if not len(self): return SampleSeries()
+        return SampleSeries(np.frombuffer(self.ts_ms, dtype=np.int64), np.frombuffer(self.values, dtype=np.float64))
@@ -0,0 +1,59 @@
+import bisect
+import threading
+
+class SessionIndex:
+    """
+    Indice in memoria delle sessioni già scaricate (sonno + sport).
+    Tiene traccia delle finestre già coperte, così finestre sovrapposte (lookback del sonno,
+    giorni consecutivi di un range) interrogano l'indice invece di riscaricare la lista.
+    Semantica identica a sessions.list: una sessione appartiene a [s, e] se TERMINA nella finestra.
+    """
+    def __init__(self):
+        self._keys = set()
+        self._by_end = []   # (end_ms, start_ms, seq, sessione) ordinata per fine
+        self._covered = []  # intervalli [s, e] già scaricati, disgiunti e ordinati
+        self._lock = threading.Lock()  # condiviso tra i worker in modalità concorrente
+
+    def add(self, s, e, sessions):
+        with self._lock:
+            self._add(s, e, sessions)
+
+    def _add(self, s, e, sessions):
+        for sess in sessions:
+            key = (sess['start_ms'], sess['end_ms'], sess['activity_type'], sess['name'])
+            if key in self._keys: continue
+            self._keys.add(key)
+            bisect.insort(self._by_end, (sess['end_ms'], sess['start_ms'], len(self._keys), sess))
+        self._covered = self._merge(self._covered + [(s, e)])
+
+    def query(self, s, e):
+        """Sessioni che terminano in [s, e], ordinate per inizio."""
+        with self._lock:
+            lo = bisect.bisect_left(self._by_end, (s,))
+            hi = bisect.bisect_right(self._by_end, (e, float('inf')))
+            found = self._by_end[lo:hi]
+        return [x[3] for x in sorted(found, key=lambda x: (x[1], x[2]))]
+
+    def missing(self, windows):
+        """Porzioni delle finestre richieste non ancora coperte, unite in intervalli disgiunti."""
+        gaps = []
+        with self._lock:
+            covered = list(self._covered)
+        for s, e in self._merge(windows):
+            cursor = s
+            for cs, ce in covered:
+                if ce < cursor or cs > e: continue
+                if cs > cursor: gaps.append((cursor, cs))
+                cursor = max(cursor, ce)
+            if cursor < e: gaps.append((cursor, e))
+        return gaps
+
+    @staticmethod
+    def _merge(intervals):
+        merged = []
+        for s, e in sorted(intervals):
+            if merged and s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        return merged
@@ -0,0 +1,55 @@
+import os
+import json
+import time
+import threading
+
+class StepSourceCache:
+    """
+    Memorizza lo stream dei passi risolto (es. quello dell'orologio SM-R9) in memoria e su disco.
+    Il valore resta valido per `ttl_s` secondi; se il lookup fallisce si usa anche un valore
+    scaduto, così un errore transitorio non fa passare allo stream "merge" a metà range.
+    """
+    def __init__(self, path=None, ttl_s=7 * 24 * 60 * 60):
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            path = os.path.join(base_dir, 'cache', 'step_source.json')
+        self.path = path
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entry = None  # {"stream_id": ..., "resolved_at": epoch}
+        self._loaded = False
+
+    def get(self):
+        """Ritorna (stream_id, fresco) oppure (None, False) se non c'è nulla in cache."""
+        with self._lock:
+            entry = self._load()
+        if not entry: return None, False
+        return entry['stream_id'], time.time() - entry['resolved_at'] < self.ttl_s
+
+    def set(self, stream_id):
+        with self._lock:
+            self._entry = {"stream_id": stream_id, "resolved_at": time.time()}
+            self._loaded = True
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entry, f)
+            except OSError as e:
+                print(f"⚠️ Impossibile salvare la sorgente passi: {e}")
+
+    def invalidate(self):
+        """Da usare quando cambia il dispositivo: il prossimo lookup interroga di nuovo l'API."""
+        with self._lock:
+            self._entry = None
+            self._loaded = True
+            if os.path.exists(self.path): os.remove(self.path)
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entry = json.load(f)
+            except (OSError, ValueError):
+                self._entry = None
+        return self._entry
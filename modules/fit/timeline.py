@@ -0,0 +1,33 @@
+import bisect
+
+class BodyTimeline:
+    """
+    Punti grezzi ordinati (timestamp, valore) delle misure corporee (peso, grasso, altezza, acqua).
+    Si carica una volta per range da datasets.get e risponde per ogni giorno con lo stesso
+    punto .summary che darebbe una aggregate a bucket unica sulla finestra [start, end):
+    [media, max, min] dei punti con inizio nella finestra, trovati in O(log n) con bisect.
+    """
+    def __init__(self):
+        self._points = {}  # data_type -> [(ts_ms, seq, fpVal)]
+        self._index = {}   # data_type -> lista ordinata dei timestamp, per bisect
+        self._seq = 0
+
+    def add_points(self, data_type, page):
+        """page: risposta di datasets.get (una pagina) dello stream di data_type."""
+        points = self._points.setdefault(data_type, [])
+        for p in page.get('point', []):
+            self._seq += 1
+            points.append((int(p['startTimeNanos']) // 1_000_000, self._seq, p['value'][0].get('fpVal')))
+        # Indice ricostruito subito: summary() resta in sola lettura (condivisa tra i worker)
+        points.sort()
+        self._index[data_type] = [p[0] for p in points]
+
+    def summary(self, data_type, start_ms, end_ms):
+        """Valore del punto .summary ([{fpVal: media}, {fpVal: max}, {fpVal: min}]) su [start_ms, end_ms), o None."""
+        points = self._points.get(data_type)
+        if not points: return None
+        index = self._index[data_type]
+        values = [p[2] for p in points[bisect.bisect_left(index, start_ms):bisect.bisect_left(index, end_ms)]]
+        if not values: return None
+        # Somma in ordine di tempo, come l'aggregate
+        return [{"fpVal": sum(values) / len(values)}, {"fpVal": max(values)}, {"fpVal": min(values)}]
@@ -1,12 +1,81 @@
-from datetime import datetime
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import pytz
-from modules.fit.fetchers import FitFetcher
+from modules.fit.fetchers import FitFetcher, is_retrieved
+from modules.fit.retry import is_transient_error
 from modules.fit.processors import FitProcessor
+from modules.fit.timeline import BodyTimeline
+from modules.fit.series import SampleSeries, SeriesBuffer, PAYLOAD_SERIES_KEY
 
 class GoogleFitService:
-    def __init__(self, service):
-        self.fetcher = FitFetcher(service)
+    TIMEZONE = 'Europe/Rome'
+    # Giorni per singola chiamata aggregate in modalità range (l'endpoint limita la finestra)
+    RANGE_CHUNK_DAYS = 30
+    SLEEP_LOOKBACK_MS = 14 * 60 * 60 * 1000
+    # Peso, grasso e altezza valgono fino a 30 giorni dopo la misura; l'acqua solo nel giorno
+    BODY_LOOKBACK_MS = 30 * 24 * 60 * 60 * 1000
+    # Stream HR grezzo (tutti i dispositivi uniti), letto a piena risoluzione con datasets.get
+    HR_RAW_SOURCE = "derived:com.google.heart_rate.bpm:com.google.android.gms:merge_heart_rate_bpm"
+    # HR grezzo: giornata divisa in finestre scaricate in parallelo (una pagina per finestra alla volta)
+    HR_RAW_WINDOWS = 2
+    # Stream uniti delle misure corporee (punti grezzi per la BodyTimeline in modalità range)
+    BODY_SOURCES = {
+        "com.google.weight": "derived:com.google.weight:com.google.android.gms:merge_weight",
+        "com.google.body.fat.percentage": "derived:com.google.body.fat.percentage:com.google.android.gms:merged",
+        "com.google.height": "derived:com.google.height:com.google.android.gms:merge_height",
+        "com.google.body.water_mass": "derived:com.google.body.water_mass:com.google.android.gms:merged",
+    }
+
+    # Campi del payload calcolati da ciascuna risposta: se la risposta non è stata scaricata
+    # valgono None (non 0) e il giorno viene marcato incompleto (raw_data.fetch_status)
+    _SLEEP_FIELDS = ["health_sleep_minutes", "health_sleep_awake_minutes", "health_sleep_light_minutes",
+                     "health_sleep_deep_minutes", "health_sleep_rem_minutes", "health_sleep_score"]
+    _HR_FIELDS = ["health_avg_hr", "health_min_hr", "health_max_hr", "health_active_hr", "health_resting_hr"]
+    _BODY_FIELDS = ["health_weight_kg", "health_bmi", "health_body_fat_perc", "health_body_fat_kg",
+                    "health_muscle_mass_kg", "health_bmr_kcal", "health_body_water_perc", "health_body_water_kg"]
+    SECTION_FIELDS = {
+        "core_main": ["health_steps", "health_distance_m", "health_active_minutes", "health_cardio_points",
+                      "health_calories_burnt", "health_energy_score"],
+        "core_floor": ["health_floors_climbed"],
+        "core_power": ["health_power_avg_watts"],
+        "nutrition": ["health_calories_intake", "health_water_ml"],
+        "resting_hr": ["health_resting_hr", "health_energy_score"],
+        "body_weight": _BODY_FIELDS,
+        "body_fat": ["health_body_fat_perc", "health_body_fat_kg", "health_muscle_mass_kg",
+                     "health_body_water_perc", "health_body_water_kg"],
+        "body_height": ["health_bmi", "health_bmr_kcal"],
+        "body_water": ["health_body_water_perc", "health_body_water_kg"],
+        "medical_bp": ["health_blood_pressure_sys", "health_blood_pressure_dia"],
+        "medical_glucose": ["health_blood_glucose_avg"],
+        "vitals": _HR_FIELDS + ["health_avg_spo2", "health_energy_score"],
+        "hr_raw": _HR_FIELDS + ["health_energy_score"],
+        "sleep_sessions": _SLEEP_FIELDS + ["health_active_hr", "health_resting_hr", "health_energy_score"],
+        "overnight_sessions": ["health_active_hr", "health_resting_hr"],
+        "sleep_segments": _SLEEP_FIELDS + ["health_energy_score"],
+        "night_vitals": ["health_skin_temp_avg", "health_respiratory_rate_avg"],
+        "sport_sessions": [],
+    }
+
+    def __init__(self, service, batch=False, cache=None, limiter=None, service_factory=None, step_source=None, metrics=None, raw_hr=True, compact_series=False,
+                 retry=None, breaker=None):
+        # batch=True: le richieste indipendenti di una giornata partono in una sola BatchHttpRequest
+        # cache: ResponseCache opzionale (giorni già chiusi non vengono riscaricati)
+        # limiter: RateLimiter condiviso; service_factory: crea un service per ogni worker thread
+        # metrics: RunMetrics opzionale (chiamate API, tempi per giorno, errori)
+        # raw_hr: statistiche HR dai campioni grezzi (datasets.get) invece che dalle bucket di 5 minuti
+        # compact_series: raw_data.heart_rate_samples in formato compatto (SampleSeries.encode)
+        # retry / breaker: RetryPolicy e CircuitBreaker condivisi da tutti i worker
+        self.fetcher = FitFetcher(service, batch=batch, cache=cache, limiter=limiter, step_source=step_source, metrics=metrics,
+                                  retry=retry, breaker=breaker)
+        self.metrics = metrics
+        self.raw_hr = raw_hr
+        self.compact_series = compact_series
         self.processor = FitProcessor()
+        self.service_factory = service_factory
+        self._local = threading.local()
         
         self.ACTIVITY_MAP = {
             7: "Camminata", 8: "Corsa", 9: "Aerobica", 
@@ -14,8 +83,172 @@ class GoogleFitService:
             58: "Trekking", 72: "Sonno", 97: "Palestra"
         }
 
-    def get_full_day_metrics(self, target_date=None):
-        tz = pytz.timezone('Europe/Rome')
+    def get_range_metrics(self, start_date, end_date, workers=1):
+        """
+        Scarica le metriche di un intervallo di giorni [start_date, end_date].
+        Le aggregate giornaliere (passi, calorie, piani, potenza, nutrizione, RHR) vengono
+        chieste UNA volta per tutto il range con bucket di 1 giorno (confini Europe/Rome)
+        e poi ridistribuite ai singoli giorni.
+        Generatore: restituisce (date_str, metrics, errore) per ogni giorno, così il
+        chiamante mantiene l'isolamento degli errori per giornata.
+        Con workers > 1 (e un service_factory) i giorni vengono elaborati in parallelo,
+        al massimo 2 * workers alla volta, ma restituiti sempre in ordine di data.
+        """
+        days = self._range_days(start_date, end_date)
+        watch_id = self.fetcher.find_step_source()
+        prefetched, body_timeline = self._run_plan(self._range_plan(days, watch_id), self.fetcher.fetch_many)
+
+        def _process_day(day, parallel=False):
+            date_str = day.strftime("%Y-%m-%d")
+            app = self._worker() if parallel else self
+            t0 = time.perf_counter()
+            try:
+                metrics = app.get_full_day_metrics(day, prefetched=prefetched.get(date_str), watch_id=watch_id, body_timeline=body_timeline)
+                result = date_str, metrics, None
+            except Exception as e:
+                if self.metrics is not None: self.metrics.error("day_errors_total", e, date=date_str)
+                result = date_str, None, e
+            if self.metrics is not None:
+                self.metrics.observe("day_duration_seconds", time.perf_counter() - t0)
+                self.metrics.incr("days_total", result=self._day_result(result))
+            return result
+
+        if workers <= 1 or self.service_factory is None:
+            for day in days:
+                yield _process_day(day)
+            return
+
+        # Finestra di invio limitata (2 * workers giorni in corso): se il consumatore rallenta
+        # (coda della pipeline piena) si ferma anche il fetch, senza accumulare giorni pronti in memoria.
+        # I risultati escono nell'ordine dei giorni: output deterministico
+        window = 2 * workers
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for day in days:
+                pending.append(pool.submit(_process_day, day, True))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def _day_result(result):
+        """Esito di un giorno per le metriche: ok, partial (dati mancanti) o error."""
+        _, metrics, error = result
+        if error is not None: return "error"
+        return "ok" if metrics['raw_data']['fetch_status']['complete'] else "partial"
+
+    def _worker(self):
+        """Istanza del worker thread corrente: service proprio, cache/limiter/sessioni condivisi."""
+        app = getattr(self._local, 'app', None)
+        if app is None:
+            app = type(self)(None, metrics=self.metrics, raw_hr=self.raw_hr, compact_series=self.compact_series)
+            app.fetcher = self.fetcher.clone(self.service_factory())
+            self._local.app = app
+        return app
+
+    def _range_days(self, start_date, end_date):
+        tz = pytz.timezone(self.TIMEZONE)
+        days = []
+        current = start_date
+        while current <= end_date:
+            days.append(tz.localize(datetime(current.year, current.month, current.day)))
+            current += timedelta(days=1)
+        return days
+
+    # --- PIANI DI FETCH ---
+    # Un "piano" è un generatore che cede gruppi di richieste INDIPENDENTI (dict per fetch_many)
+    # e riceve i risultati: la logica resta una sola, eseguita in modo sincrono (_run_plan)
+    # o asincrono (AsyncGoogleFitService), senza duplicare i calcoli.
+
+    @staticmethod
+    def _run_plan(plan, fetch_many):
+        """Esegue un piano con un fetch_many sincrono. Gli errori vengono rilanciati dentro il piano."""
+        try:
+            calls = next(plan)
+            while True:
+                try:
+                    results = fetch_many(calls)
+                except Exception as e:
+                    calls = plan.throw(e)
+                else:
+                    calls = plan.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+    def _range_plan(self, days, watch_id):
+        """
+        Preparazione del range in un solo gruppo di richieste:
+        - aggregate giornaliere con bucket di 1 giorno, una per query per chunk di RANGE_CHUNK_DAYS;
+        - lista sessioni di tutto il range (incluso il lookback del sonno del primo giorno e il sonno
+          che inizia l'ultima sera): i giorni la interrogano dall'indice del fetcher;
+        - misure corporee di tutto il range (+ lookback), punti grezzi interrogati poi per giorno.
+        Ritorna (prefetched {date_str: {chiave_query: risposta_del_giorno}}, BodyTimeline o None).
+        """
+        tz = pytz.timezone(self.TIMEZONE)
+        day_end_ms = lambda d: int(tz.localize(datetime(d.year, d.month, d.day) + timedelta(days=1)).timestamp() * 1000) - 1
+
+        calls = {}
+        for i in range(0, len(days), self.RANGE_CHUNK_DAYS):
+            chunk = days[i:i + self.RANGE_CHUNK_DAYS]
+            s = int(chunk[0].timestamp() * 1000)
+            e = day_end_ms(chunk[-1])
+            for key, body in self._daily_aggregate_bodies(watch_id).items():
+                body['bucketByTime'] = {"period": {"type": "day", "value": 1, "timeZoneId": self.TIMEZONE}}
+                calls[f"daily:{key}:{i}"] = ("aggregate", s, e, body)
+
+        range_start_ms = int(days[0].timestamp() * 1000)
+        range_end_ms = day_end_ms(days[-1])
+        calls["range_sessions"] = ("sessions", range_start_ms - self.SLEEP_LOOKBACK_MS, range_end_ms + self.SLEEP_LOOKBACK_MS)
+
+        r = yield calls
+
+        prefetched = {}
+        for k in calls:
+            if not k.startswith("daily:"): continue
+            key = k.split(":")[1]
+            for b in r[k].get('bucket', []):
+                # Ogni bucket diventa una risposta "a un solo bucket", identica a quella per-giorno
+                date_str = datetime.fromtimestamp(int(b['startTimeMillis']) / 1000, tz).strftime("%Y-%m-%d")
+                prefetched.setdefault(date_str, {})[key] = {"bucket": [b]}
+
+        timeline = yield from self._body_timeline_plan(range_start_ms - self.BODY_LOOKBACK_MS, range_end_ms)
+        return prefetched, timeline
+
+    def _body_timeline_plan(self, s, e):
+        """
+        Punti grezzi delle misure corporee di [s, e] (datasets.get sugli stream uniti, a pagine).
+        Le misure sono rare: di solito una pagina per tipo. Errore transitorio: None, e ogni giorno
+        rifà le sue query per finestra. Stream inesistente (errore non transitorio): nessun punto,
+        come per l'aggregate.
+        """
+        timeline = BodyTimeline()
+        tokens = {t: None for t in self.BODY_SOURCES}
+        isolate = False  # Dopo un errore non transitorio: un tipo per richiesta, per trovare lo stream mancante
+        while tokens:
+            group = list(tokens)[:1] if isolate else list(tokens)
+            calls = {f"body:{t}": ("dataset", s, e, self.BODY_SOURCES[t], self.fetcher.DATASET_PAGE_SIZE, tokens[t])
+                     for t in group}
+            try:
+                pages = yield calls
+            except Exception as err:
+                if is_transient_error(err): return None
+                if isolate: del tokens[group[0]]
+                isolate = True
+                continue
+            for t in group:
+                page = pages[f"body:{t}"]
+                timeline.add_points(t, page)
+                tokens[t] = page.get('nextPageToken')
+                if not tokens[t]: del tokens[t]
+        return timeline
+
+    def get_full_day_metrics(self, target_date=None, prefetched=None, watch_id=None, body_timeline=None):
+        if watch_id is None: watch_id = self.fetcher.find_step_source()
+        return self._run_plan(self._day_plan(target_date, prefetched, watch_id, body_timeline), self.fetcher.fetch_many)
+
+    def _day_plan(self, target_date, prefetched, watch_id, body_timeline):
+        tz = pytz.timezone(self.TIMEZONE)
         if target_date is None: target_date = datetime.now(tz)
         
         if target_date.tzinfo is None: target_date = tz.localize(target_date)
@@ -25,35 +258,75 @@ class GoogleFitService:
         start_ms = int(start_of_day.timestamp() * 1000)
         end_ms = int(end_of_window.timestamp() * 1000)
 
-        # 1. FETCH
-        watch_id = self.fetcher.find_step_source()
-        core = self._get_core_stats(start_ms, end_ms, watch_id)
-        
-        body = self._get_body_stats_robust(start_ms, end_ms)
-        medical = self._get_medical_stats_robust(start_ms, end_ms) 
-        vitals = self._get_vitals(start_ms, end_ms)
-        
+        # Risposte già scaricate in modalità range (le query mancanti vengono fatte qui)
+        pre = prefetched or {}
+
         # Sonno (14h lookback)
-        sleep_start_search = start_ms - (14 * 60 * 60 * 1000) 
-        sleep = self._get_sleep(sleep_start_search, end_ms)
+        sleep_start_search = start_ms - self.SLEEP_LOOKBACK_MS
+
+        # 1. FETCH
+        # Fase 1: tutte le richieste indipendenti della giornata (una sola batch se abilitata)
+        calls = {k: ("aggregate", start_ms, end_ms, b) for k, b in self._daily_aggregate_bodies(watch_id).items() if k not in pre}
+        if body_timeline is None:
+            calls.update(self._body_calls(start_ms, end_ms))
+        calls.update(self._medical_calls(start_ms, end_ms))
+        calls["vitals"] = ("aggregate", start_ms, end_ms, self._vitals_body())
+        # Le due finestre si sovrappongono: il fetcher scarica solo l'unione (e solo la parte non in indice)
+        calls["sleep_sessions"] = ("sessions", sleep_start_search, end_ms)
+        calls["sport_sessions"] = ("sessions", start_ms, end_ms)
+        # Sonno iniziato in serata e finito il giorno dopo: serve per le maschere HR di oggi
+        calls["overnight_sessions"] = ("sessions", start_ms, end_ms + self.SLEEP_LOOKBACK_MS)
+        r = dict(pre)
+        r.update((yield calls))
+
+        core = self._get_core_stats(r)
+        body = self._get_body_stats_robust(self._body_values(r, body_timeline, start_ms, end_ms))
+        medical = self._get_medical_stats_robust(r)
+        raw_hr, raw_hr_error = (yield from self._raw_hr_plan(start_ms, end_ms)) if self.raw_hr else (None, None)
+        vitals = self._get_vitals(r['vitals'], raw_hr)
+
+        # Fase 2: dipende dalle sessioni di sonno (segmenti di tutte le sessioni + finestra notturna)
+        sleeps = [x for x in r['sleep_sessions'] if x['activity_type'] == 72]
+        night_start = sleep_start_search if sleeps else start_ms
+        calls = {}
+        if sleeps:
+            # Una sola query copre tutte le sessioni (anche pisolini / sonno spezzato)
+            seg_s = min(x['start_ms'] for x in sleeps)
+            seg_e = max(x['end_ms'] for x in sleeps)
+            calls["sleep_segments"] = ("aggregate", seg_s, seg_e, self._sleep_segments_body())
+        calls["night_vitals"] = ("aggregate", night_start, end_ms, self._night_vitals_body(night_start, end_ms))
+        r.update((yield calls))
+
+        sleep = self._get_sleep(sleeps, r)
         
         # Vitali Notturni
-        night_start = sleep_start_search if sleep['total_minutes'] > 0 else start_ms
-        night_vitals = self._get_night_vitals(night_start, end_ms)
+        if sleeps and sleep['total_minutes'] == 0:
+            # Sessioni presenti ma senza minuti di sonno: la finestra corretta parte da mezzanotte
+            r.update((yield {"night_vitals": ("aggregate", start_ms, end_ms, self._night_vitals_body(start_ms, end_ms))}))
+        night_vitals = self._get_night_vitals(r['night_vitals'])
 
-        sport = self._get_sport(start_ms, end_ms)
-        nutrition = self._get_nutrition(start_ms, end_ms)
+        sport = self._get_sport(r['sport_sessions'])
+        nutrition = self._get_nutrition(r['nutrition'])
 
         # 2. CALCOLI
-        rhr = self._resolve_rhr(start_ms, end_ms, vitals, sleep)
-        act_hr = self.processor.calculate_active_hr(vitals['hr_samples'], sleep)
+        # Intervalli reali (epoch ms) di tutte le sessioni di sonno che toccano la giornata
+        sleep_intervals = sorted({(x['start_ms'], x['end_ms']) for x in sleeps + r['overnight_sessions']
+                                  if x['activity_type'] == 72 and x['start_ms'] <= end_ms and x['end_ms'] >= start_ms})
+        rhr = self._resolve_rhr(r['resting_hr'], vitals, sleep_intervals)
+        act_hr = self.processor.calculate_active_hr(vitals['hr'], sleep_intervals)
+        hr_stats = self._get_hr_stats(vitals, sleep_intervals)
         
         # Energy Score
         sleep_hours_for_calc = sleep['total_minutes'] / 60.0
         en_score = self.processor.calculate_energy_score({"total_hours": sleep_hours_for_calc}, core['steps'], rhr)
 
+        # Risposte mancanti anche dopo i retry: l'HR grezzo conta solo se l'errore era transitorio
+        # (uno stream assente non deve rendere il giorno incompleto per sempre)
+        missing = sorted(k for k, v in r.items() if not is_retrieved(v))
+        if raw_hr_error is not None and is_transient_error(raw_hr_error): missing.append("hr_raw")
+
         # 3. PAYLOAD
-        return {
+        payload = {
             "health_steps": int(core['steps']),
             "health_distance_m": int(core['distance']),
             "health_floors_climbed": int(core['floors']),
@@ -103,28 +376,44 @@ class GoogleFitService:
                 "sleep_detailed": sleep,
                 "night_vitals_raw": night_vitals,
                 "sport_activities": sport,
-                "heart_rate_samples": vitals['hr_samples'],
+                "heart_rate_samples": vitals['hr_buckets'].encode() if self.compact_series else vitals['hr_samples'],
+                "heart_rate_stats": hr_stats,
                 "step_source_used": watch_id,
+                "fetch_status": {"complete": not missing, "missing": missing},
                 "last_sync": datetime.now(tz).isoformat()
-            }
+            },
+            # Timestamp esatti (epoch ms) per lo storico: "HH:MM" di heart_rate_samples non basta
+            PAYLOAD_SERIES_KEY: {"heart_rate": vitals['hr_buckets']}
         }
+        for section in missing:
+            for field in self.SECTION_FIELDS.get(section, ()): payload[field] = None
+        return payload
 
     # --- HELPERS ---
 
-    def _get_core_stats(self, s, e, watch_id):
-        body_main = {
-            "aggregateBy": [
-                {"dataTypeName": "com.google.step_count.delta"}, 
-                {"dataTypeName": "com.google.step_count.delta", "dataSourceId": watch_id},
-                {"dataTypeName": "com.google.distance.delta"},
-                {"dataTypeName": "com.google.calories.expended"},
-                {"dataTypeName": "com.google.heart_minutes"},
-                {"dataTypeName": "com.google.active_minutes"}
-            ]
+    def _daily_aggregate_bodies(self, watch_id):
+        """Query aggregate che producono un solo valore per giornata (prefetchabili in range)."""
+        return {
+            "core_main": {
+                "aggregateBy": [
+                    {"dataTypeName": "com.google.step_count.delta"}, 
+                    {"dataTypeName": "com.google.step_count.delta", "dataSourceId": watch_id},
+                    {"dataTypeName": "com.google.distance.delta"},
+                    {"dataTypeName": "com.google.calories.expended"},
+                    {"dataTypeName": "com.google.heart_minutes"},
+                    {"dataTypeName": "com.google.active_minutes"}
+                ]
+            },
+            "core_floor": {"aggregateBy": [{"dataTypeName": "com.google.floor_change"}]},
+            "core_power": {"aggregateBy": [{"dataTypeName": "com.google.power.sample"}]},
+            "nutrition": {"aggregateBy": [{"dataTypeName": "com.google.nutrition"}, {"dataTypeName": "com.google.hydration"}]},
+            "resting_hr": {"aggregateBy": [{"dataTypeName": "com.google.heart_rate.resting"}]},
         }
-        r_main = self.fetcher.fetch_aggregate(s, e, body_main)
-        r_floor = self.fetcher.fetch_aggregate(s, e, {"aggregateBy": [{"dataTypeName": "com.google.floor_change"}]})
-        r_power = self.fetcher.fetch_aggregate(s, e, {"aggregateBy": [{"dataTypeName": "com.google.power.sample"}]})
+
+    def _get_core_stats(self, r):
+        r_main = r['core_main']
+        r_floor = r['core_floor']
+        r_power = r['core_power']
 
         d_main = r_main.get('bucket', [{}])[0].get('dataset', [])
         d_floor = r_floor.get('bucket', [{}])[0].get('dataset', [])
@@ -146,14 +435,26 @@ class GoogleFitService:
             "watts": self.processor.extract_float(d_power[0]) if d_power else None
         }
 
-    def _get_body_stats_robust(self, s, e):
-        ms_in_30_days = 30 * 24 * 60 * 60 * 1000
-        search_s = s - ms_in_30_days
-        
-        w_raw = self.fetcher.fetch_latest_data_point(search_s, e, "com.google.weight")
-        fat_raw = self.fetcher.fetch_latest_data_point(search_s, e, "com.google.body.fat.percentage")
-        h_raw = self.fetcher.fetch_latest_data_point(search_s, e, "com.google.height")
-        water_mass_raw = self.fetcher.fetch_latest_data_point(s, e, "com.google.body.water_mass")
+    def _body_calls(self, s, e):
+        search_s = s - self.BODY_LOOKBACK_MS
+        return {
+            "body_weight": ("latest", search_s, e, "com.google.weight"),
+            "body_fat": ("latest", search_s, e, "com.google.body.fat.percentage"),
+            "body_height": ("latest", search_s, e, "com.google.height"),
+            "body_water": ("latest", s, e, "com.google.body.water_mass"),
+        }
+
+    def _body_values(self, r, timeline, s, e):
+        """Valori (punto .summary della finestra) di peso, grasso, altezza e acqua: dalla timeline o dalle query del giorno."""
+        if timeline is None:
+            return tuple(r[k] if is_retrieved(r[k]) else None for k in ("body_weight", "body_fat", "body_height", "body_water"))
+        # Stesse finestre di _body_calls: [inizio - lookback, fine) e, per l'acqua, il solo giorno
+        return tuple(timeline.summary(t, ws, e) for t, ws in (
+            ("com.google.weight", s - self.BODY_LOOKBACK_MS), ("com.google.body.fat.percentage", s - self.BODY_LOOKBACK_MS),
+            ("com.google.height", s - self.BODY_LOOKBACK_MS), ("com.google.body.water_mass", s)))
+
+    def _get_body_stats_robust(self, values):
+        w_raw, fat_raw, h_raw, water_mass_raw = values
 
         weight = w_raw[0].get('fpVal') if w_raw else None
         fat_perc = fat_raw[0].get('fpVal') if fat_raw else None
@@ -184,10 +485,10 @@ class GoogleFitService:
             "muscle": muscle_smm, "bmr": bmr, "water_perc": water_perc, "water_kg": water_kg
         }
 
-    def _get_sleep(self, s, e):
-        sessions = self.fetcher.fetch_raw_sessions(s, e)
-        sleeps = [x for x in sessions if x['activity_type'] == 72]
-        
+    def _sleep_segments_body(self):
+        return {"aggregateBy": [{"dataTypeName": "com.google.sleep.segment"}]}
+
+    def _get_sleep(self, sleeps, responses):
         if not sleeps: 
             return {
                 "total_minutes": 0, "efficiency_score": 0, "start": "00:00", "end": "00:00", 
@@ -198,35 +499,24 @@ class GoogleFitService:
         
         total_minutes_accumulated = 0
         total_stages = {"awake": 0, "sleep": 0, "out_of_bed": 0, "light": 0, "deep": 0, "rem": 0}
+
+        r = responses.get('sleep_segments', {})
+        points = []
+        if r.get('bucket') and r['bucket'][0].get('dataset'):
+            points = r['bucket'][0]['dataset'][0].get('point', [])
+        by_session = self.processor.assign_sleep_segments(sleeps, points)
         
-        for sess in sleeps:
-            body = {"aggregateBy": [{"dataTypeName": "com.google.sleep.segment"}], "startTimeMillis": sess['start_ms'], "endTimeMillis": sess['end_ms']}
-            
-            r = self.fetcher.fetch_aggregate(sess['start_ms'], sess['end_ms'], body)
-            
+        for sess, segments in zip(sleeps, by_session):
             sess_minutes = 0
-            has_details = False
-            
-            if r.get('bucket') and r['bucket'][0].get('dataset'):
-                points = r['bucket'][0]['dataset'][0].get('point', [])
-                if points:
-                    has_details = True
-                    for p in points:
-                        dur = (int(p.get('endTimeNanos',0)) - int(p.get('startTimeNanos',0)))/1e9/60
-                        t = p['value'][0]['intVal']
-                        if t==1: total_stages['awake']+=dur
-                        elif t==2: 
-                            total_stages['sleep']+=dur
-                            sess_minutes+=dur
-                        elif t==4: 
-                            total_stages['light']+=dur
-                            sess_minutes+=dur
-                        elif t==5: 
-                            total_stages['deep']+=dur
-                            sess_minutes+=dur
-                        elif t==6: 
-                            total_stages['rem']+=dur
-                            sess_minutes+=dur
+            has_details = bool(segments)
+
+            for p in segments:
+                dur = (int(p.get('endTimeNanos',0)) - int(p.get('startTimeNanos',0)))/1e9/60
+                stage = self.processor.SLEEP_STAGES.get(p['value'][0]['intVal'])
+                if stage is None: continue
+                key, counts_as_sleep = stage
+                total_stages[key] += dur
+                if counts_as_sleep: sess_minutes += dur
 
             if not has_details:
                 sess_minutes = sess['duration']
@@ -244,8 +534,8 @@ class GoogleFitService:
             "end": main_sleep['end_fmt']
         }
 
-    def _get_night_vitals(self, s, e):
-        body = {
+    def _night_vitals_body(self, s, e):
+        return {
             "aggregateBy": [
                 {"dataTypeName": "com.google.body.temperature"}, 
                 {"dataTypeName": "com.google.respiratory_rate"} 
@@ -253,12 +543,12 @@ class GoogleFitService:
             "bucketByTime": {"durationMillis": e - s},
             "startTimeMillis": s, "endTimeMillis": e
         }
-        
+
+    def _get_night_vitals(self, r):
         skin_temp_avg = None
         resp_rate_avg = None
 
         try:
-            r = self.fetcher.fetch_aggregate(s, e, body)
             if r.get('bucket'):
                 ds = r['bucket'][0].get('dataset', [])
                 
@@ -271,14 +561,13 @@ class GoogleFitService:
                 if len(ds) > 1 and ds[1].get('point'):
                     vals = [p['value'][0]['fpVal'] for p in ds[1]['point']]
                     if vals: resp_rate_avg = round(sum(vals)/len(vals), 1)
-        except:
-            # Fallimento silenzioso se i dati mancano
-            pass
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            # Punto malformato: valori a None, ma l'errore resta visibile nelle metriche
+            if self.metrics is not None: self.metrics.error("parse_errors_total", e, section="night_vitals")
 
         return {"skin_temp": skin_temp_avg, "resp_rate": resp_rate_avg}
 
-    def _get_sport(self, s, e):
-        sessions = self.fetcher.fetch_raw_sessions(s, e)
+    def _get_sport(self, sessions):
         res = []
         for sess in sessions:
             if sess['activity_type'] != 72:
@@ -286,36 +575,101 @@ class GoogleFitService:
                 res.append({"name": name, "duration": sess['duration'], "start_fmt": sess['start_fmt']})
         return res
 
-    def _get_medical_stats_robust(self, s, e):
-        bp_raw = self.fetcher.fetch_latest_data_point(s, e, "com.google.blood_pressure")
+    def _medical_calls(self, s, e):
+        return {
+            "medical_bp": ("latest", s, e, "com.google.blood_pressure"),
+            "medical_glucose": ("latest", s, e, "com.google.blood_glucose"),
+        }
+
+    def _get_medical_stats_robust(self, r):
+        bp_raw = r['medical_bp']
         sys = None; dia = None
         if bp_raw and len(bp_raw) >= 2: sys=bp_raw[0].get('fpVal'); dia=bp_raw[1].get('fpVal')
-        gluc_raw = self.fetcher.fetch_latest_data_point(s, e, "com.google.blood_glucose")
+        gluc_raw = r['medical_glucose']
         
         return {"sys": sys, "dia": dia, "glucose": gluc_raw[0].get('fpVal') if gluc_raw else None}
 
-    def _get_vitals(self, s, e):
-        body = {"aggregateBy": [{"dataTypeName": "com.google.heart_rate.bpm"}, {"dataTypeName": "com.google.oxygen_saturation"}], "bucketByTime": {"durationMillis": 300000}}
-        r = self.fetcher.fetch_aggregate(s, e, body)
-        hr_samples = []; spo2_samples = []
-        for b in r.get('bucket', []):
-            st = int(b['startTimeMillis'])
-            t_fmt = datetime.fromtimestamp(st/1000).strftime('%H:%M')
-            d = b['dataset']
-            if d[0].get('point'): hr_samples.append({"time": t_fmt, "bpm": int(d[0]['point'][0]['value'][0]['fpVal'])})
-            if d[1].get('point'): spo2_samples.append({"time": t_fmt, "val": float(d[1]['point'][0]['value'][0]['fpVal'])})
+    def _vitals_body(self):
+        return {"aggregateBy": [{"dataTypeName": "com.google.heart_rate.bpm"}, {"dataTypeName": "com.google.oxygen_saturation"}], "bucketByTime": {"durationMillis": 300000}}
+
+    def _raw_hr_plan(self, s, e):
+        """
+        Campioni HR grezzi della giornata (datasets.get) in un buffer colonnare.
+        La giornata è divisa in HR_RAW_WINDOWS finestre, richieste insieme (una batch, o in concorrenza
+        nel client async) una pagina da DATASET_PAGE_SIZE punti per finestra alla volta: ogni pagina
+        finisce nel buffer prima della successiva, quindi in memoria ci sono al più HR_RAW_WINDOWS pagine.
+        Costo a 1 Hz (86.400 campioni): ~22 giri da 2 richieste, contro ~44 pagine sequenziali;
+        ogni richiesta passa comunque dal rate limiter.
+        Ritorna (serie o None se non disponibili, errore o None).
+        """
+        step = -(-(e - s + 1) // self.HR_RAW_WINDOWS)
+        windows = [(ws, min(ws + step, e + 1) - 1) for ws in range(s, e + 1, step)]
+        parts = [SeriesBuffer() for _ in windows]
+        tokens = {i: None for i in range(len(windows))}  # finestre ancora da completare -> pageToken
+        try:
+            while tokens:
+                pages = yield {f"hr_page:{i}": ("dataset", *windows[i], self.HR_RAW_SOURCE, self.fetcher.DATASET_PAGE_SIZE, token)
+                               for i, token in tokens.items()}
+                for i in list(tokens):
+                    page = pages.pop(f"hr_page:{i}")
+                    parts[i].extend(self._window_samples(page, windows, i))
+                    tokens[i] = page.get('nextPageToken')
+                    if not tokens[i]: del tokens[i]
+                del pages, page
+        except Exception as e:
+            # Errore già contato nelle metriche: si ripiega sulle bucket di 5 minuti
+            print(f"⚠️ HR grezzo non disponibile, uso le medie a 5 minuti: {e}")
+            return None, e
+
+        # Finestre accodate in ordine: i timestamp restano ordinati
+        buffer = parts[0]
+        for part in parts[1:]: buffer.merge(part)
+        if buffer.dropped:
+            print(f"⚠️ HR grezzo: {buffer.dropped} campioni oltre il limite del buffer ignorati")
+        return (buffer.to_series() if len(buffer) else None), None
+
+    @staticmethod
+    def _window_samples(page, windows, i):
+        """Campioni della pagina della finestra i: un punto sul confine tra due finestre conta una volta sola."""
+        lo = windows[i][0] if i > 0 else float('-inf')
+        hi = windows[i][1] if i < len(windows) - 1 else float('inf')
+        return ((ts, v) for ts, v in FitFetcher.dataset_samples(page) if lo <= ts <= hi)
+
+    def _get_vitals(self, r, raw_hr=None):
+        # Bucket di 5 minuti: bpm troncati a intero come nel payload storico (heart_rate_samples)
+        buckets_hr = SampleSeries.from_buckets(r, 0, cast=int)
+        hr = raw_hr if raw_hr is not None else buckets_hr
+        spo2 = SampleSeries.from_buckets(r, 1)
+        hr_st = hr.stats()
+        spo2_st = spo2.stats()
         return {
-            "hr_samples": hr_samples, 
-            "avg_hr": int(sum(x['bpm'] for x in hr_samples)/len(hr_samples)) if hr_samples else None, 
-            "avg_spo2": int(sum(x['val'] for x in spo2_samples)/len(spo2_samples)) if spo2_samples else None, 
-            "min_hr": min([x['bpm'] for x in hr_samples]) if hr_samples else None, 
-            "max_hr": max([x['bpm'] for x in hr_samples]) if hr_samples else None, 
+            "hr": hr,
+            "hr_source": "raw" if raw_hr is not None else "buckets_5min",
+            "hr_buckets": buckets_hr,
+            "spo2": spo2,
+            "hr_samples": buckets_hr.to_dicts("bpm"),
+            "avg_hr": int(hr_st['mean']) if hr_st else None,
+            "avg_spo2": int(spo2_st['mean']) if spo2_st else None,
+            "min_hr": int(hr_st['min']) if hr_st else None,
+            "max_hr": int(hr_st['max']) if hr_st else None,
             "vo2_max": None
         }
 
-    def _get_nutrition(self, s, e):
-        body = {"aggregateBy": [{"dataTypeName": "com.google.nutrition"}, {"dataTypeName": "com.google.hydration"}]}
-        r = self.fetcher.fetch_aggregate(s, e, body)
+    def _get_hr_stats(self, vitals, sleep_intervals):
+        """Statistiche HR/SpO2 vettoriali: giornata, sonno, veglia e minuti per zona."""
+        hr = vitals['hr']
+        sleep_mask = hr.mask_within(sleep_intervals)
+        rnd = lambda st: {k: round(v, 1) for k, v in st.items()} if st else None
+        return {
+            "hr_source": vitals['hr_source'],
+            "hr_day": rnd(hr.stats()),
+            "hr_sleep": rnd(hr.stats(sleep_mask)),
+            "hr_awake": rnd(hr.stats(~sleep_mask)),
+            "hr_zones_min": self.processor.calculate_hr_zones(hr),
+            "spo2_day": rnd(vitals['spo2'].stats())
+        }
+
+    def _get_nutrition(self, r):
         cal = 0
         d_nut = r.get('bucket', [{}])[0].get('dataset', [{}, {}])
         if d_nut[0].get('point'):
@@ -331,11 +685,9 @@ class GoogleFitService:
                      water += p['value'][0]['fpVal'] * 1000
         return {"calories": cal, "water": int(water)}
 
-    def _resolve_rhr(self, s, e, vitals, sleep):
-        body = {"aggregateBy": [{"dataTypeName": "com.google.heart_rate.resting"}]}
-        r = self.fetcher.fetch_aggregate(s, e, body)
+    def _resolve_rhr(self, r, vitals, sleep_intervals):
         d = r.get('bucket', [{}])[0].get('dataset', [])
         if d and d[0].get('point'): return int(d[0]['point'][0]['value'][0]['fpVal'])
-        val = self.processor.calculate_sleep_rhr(vitals['hr_samples'], sleep)
+        val = self.processor.calculate_sleep_rhr(vitals['hr'], sleep_intervals)
         if val: return val
         return vitals['min_hr']
\ No newline at end of file
@@ -0,0 +1,192 @@
+import os
+import glob
+import json
+import numpy as np
+from modules.fit.series import SampleSeries, PAYLOAD_SERIES_KEY
+
+class HistoryStore:
+    """
+    Storico locale colonnare dei risultati di get_full_day_metrics, per le analisi senza rete.
+    Layout (una partizione per mese, file .npz di array NumPy):
+        <root>/daily/2026-01.npz                  date (datetime64[D]), columns (nomi health_*),
+                                                  values (float64, una riga contigua per colonna)
+        <root>/samples/<serie>/2026-01.npz        day (datetime64[D]), ts_ms (int64), values (float64)
+        <root>/payloads/2026-01.npz               date, payload (JSON del giorno senza le serie dei campioni)
+    I valori None diventano NaN; fetch_complete (1/0) riporta raw_data.fetch_status.
+    I campioni si salvano con i timestamp esatti (epoch ms) di payload["_series"] o del formato
+    compatto: la lista storica "HH:MM" non basta (fuso del processo, giorni con cambio d'ora).
+    payloads conserva il resto del payload (raw_data: sessioni sportive, stato del fetch, trend),
+    quanto basta per rigenerare i report senza rete (render_reports.py).
+    Gli append sono incrementali: si riscrive solo la partizione del mese del giorno (upsert per data),
+    con scrittura atomica. Le letture aprono solo le partizioni dei mesi richiesti.
+    Non thread-safe in scrittura: un solo writer (HistorySink) per processo.
+    """
+    # Serie salvate nella tabella samples: nome serie -> chiave raw_data della stessa serie (esclusa dal JSON)
+    SERIES = {"heart_rate": "heart_rate_samples"}
+
+    def __init__(self, root="history"):
+        self.root = root
+
+    # --- Scrittura ---
+
+    def append_day(self, date_str, metrics):
+        """Inserisce o sostituisce il giorno date_str (payload di get_full_day_metrics) in tutte le tabelle."""
+        day = np.datetime64(date_str, 'D')
+        row = {k: self._number(v) for k, v in metrics.items() if k.startswith("health_")}
+        status = metrics.get('raw_data', {}).get('fetch_status')
+        if status is not None: row["fetch_complete"] = float(status['complete'])
+        self._upsert_daily(day, row)
+
+        exact = metrics.get(PAYLOAD_SERIES_KEY) or {}
+        for name, key in self.SERIES.items():
+            series = self._exact_series(exact.get(name), metrics.get('raw_data', {}).get(key))
+            if series is not None: self._replace_samples(name, day, series)
+
+        # Le serie sono già nella tabella samples: nel JSON solo il resto del payload (senza chiavi "_" in memoria)
+        raw = {k: v for k, v in metrics.get('raw_data', {}).items() if k not in self.SERIES.values()}
+        payload = {k: v for k, v in metrics.items() if not k.startswith("_")}
+        self._upsert_payload(day, json.dumps(dict(payload, raw_data=raw), sort_keys=True, default=str))
+
+    def _upsert_payload(self, day, payload):
+        path = self._payloads_path(day)
+        part = self._load(path)
+        dates, payloads = (part["date"], part["payload"]) if part else (np.zeros(0, dtype='datetime64[D]'), np.zeros(0, dtype=str))
+        keep = dates != day
+        dates = np.append(dates[keep], day)
+        payloads = np.append(payloads[keep], payload)
+        order = np.argsort(dates, kind='stable')
+        self._save(path, {"date": dates[order], "payload": payloads[order]})
+
+    def _upsert_daily(self, day, row):
+        path = self._daily_path(day)
+        dates, table = self._load_daily(path)
+        keep = dates != day
+        names = sorted(set(table) | set(row))
+        dates = np.append(dates[keep], day)
+        order = np.argsort(dates, kind='stable')
+        values = np.empty((len(names), len(dates)))
+        for i, c in enumerate(names):
+            old = table[c][keep] if c in table else np.full(int(keep.sum()), np.nan)
+            values[i] = np.append(old, row.get(c, np.nan))[order]
+        self._save(path, {"date": dates[order], "columns": np.array(names, dtype=str), "values": values})
+
+    def _replace_samples(self, name, day, series):
+        path = self._samples_path(name, day)
+        part = self._load(path)
+        day_col = np.full(len(series), day, dtype='datetime64[D]')
+        if part:
+            keep = part["day"] != day
+            ts = np.concatenate((part["ts_ms"][keep], series.ts_ms))
+            values = np.concatenate((part["values"][keep], series.values))
+            days = np.concatenate((part["day"][keep], day_col))
+        else:
+            ts, values, days = series.ts_ms, series.values, day_col
+        order = np.argsort(ts, kind='stable')
+        self._save(path, {"day": days[order], "ts_ms": ts[order], "values": values[order]})
+
+    @staticmethod
+    def _exact_series(series, stored):
+        """
+        SampleSeries con timestamp esatti: quella in memoria del payload o il formato compatto di raw_data.
+        Dalla sola lista storica [{"time": "HH:MM", ...}] non si ricostruiscono: None (campioni non salvati).
+        """
+        if series is not None: return series
+        if SampleSeries.is_encoded(stored): return SampleSeries.decode(stored)
+        return None
+
+    @staticmethod
+    def _number(value):
+        if value is None or isinstance(value, (dict, list, str)): return np.nan
+        return float(value)
+
+    # --- Lettura ---
+
+    def daily(self, start, end, columns=None):
+        """
+        Colonne giornaliere per [start, end] (date, datetime o 'YYYY-MM-DD'), in ordine di data.
+        Ritorna {colonna: array}, sempre con "date"; NaN = dato mancante.
+        """
+        s, e = self._day(start), self._day(end)
+        parts = [self._load_daily(p) for p in self._partitions(os.path.join(self.root, "daily"), s, e)]
+        names = columns if columns is not None else sorted({c for _, table in parts for c in table})
+        if not parts:
+            return dict({"date": np.zeros(0, dtype='datetime64[D]')}, **{c: np.zeros(0) for c in names})
+        dates = np.concatenate([d for d, _ in parts])
+        mask = (dates >= s) & (dates <= e)
+        out = {"date": dates[mask]}
+        for c in names:
+            col = np.concatenate([table[c] if c in table else np.full(len(d), np.nan) for d, table in parts])
+            out[c] = col[mask]
+        return out
+
+    def samples(self, name, start, end):
+        """Campioni della serie `name` dei giorni [start, end] come SampleSeries."""
+        s, e = self._day(start), self._day(end)
+        parts = [self._load(p) for p in self._partitions(os.path.join(self.root, "samples", name), s, e)]
+        parts = [p for p in parts if p]
+        if not parts: return SampleSeries()
+        days = np.concatenate([p["day"] for p in parts])
+        mask = (days >= s) & (days <= e)
+        return SampleSeries(np.concatenate([p["ts_ms"] for p in parts])[mask],
+                            np.concatenate([p["values"] for p in parts])[mask])
+
+    def payloads(self, start, end):
+        """[(date_str, payload)] dei giorni [start, end] in ordine di data (raw_data senza serie dei campioni)."""
+        s, e = self._day(start), self._day(end)
+        out = []
+        for path in self._partitions(os.path.join(self.root, "payloads"), s, e):
+            part = self._load(path)
+            for day, payload in zip(part["date"], part["payload"]):
+                if s <= day <= e: out.append((str(day), json.loads(str(payload))))
+        return out
+
+    def dates(self):
+        """Tutti i giorni presenti nello storico."""
+        return self.daily("0001-01-01", "9999-12-31", columns=[])["date"]
+
+    # --- File ---
+
+    @staticmethod
+    def _day(value):
+        if isinstance(value, np.datetime64): return value.astype('datetime64[D]')
+        return np.datetime64(str(value)[:10], 'D')
+
+    @staticmethod
+    def _month(day):
+        return str(day.astype('datetime64[M]'))
+
+    def _daily_path(self, day):
+        return os.path.join(self.root, "daily", f"{self._month(day)}.npz")
+
+    def _payloads_path(self, day):
+        return os.path.join(self.root, "payloads", f"{self._month(day)}.npz")
+
+    def _samples_path(self, name, day):
+        return os.path.join(self.root, "samples", name, f"{self._month(day)}.npz")
+
+    def _partitions(self, directory, s, e):
+        """Partizioni (file mensili) che intersecano [s, e]: le altre non vengono aperte."""
+        first, last = self._month(s), self._month(e)
+        return [p for p in sorted(glob.glob(os.path.join(directory, "*.npz")))
+                if first <= os.path.basename(p)[:-4] <= last]
+
+    @staticmethod
+    def _load(path):
+        if not os.path.exists(path): return {}
+        with np.load(path, allow_pickle=False) as npz:
+            return {k: npz[k] for k in npz.files}
+
+    def _load_daily(self, path):
+        """(date, {colonna: vista sulla riga della matrice}) di una partizione giornaliera."""
+        part = self._load(path)
+        if not part: return np.zeros(0, dtype='datetime64[D]'), {}
+        return part["date"], dict(zip(part["columns"].tolist(), part["values"]))
+
+    @staticmethod
+    def _save(path, arrays):
+        # Scrittura atomica: un lettore non vede mai una partizione a metà
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
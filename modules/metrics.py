@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+class RunMetrics:
+    """
+    Strumentazione di un run: contatori e timer con label, errori per classe (con esempi
+    di contesto: endpoint, dataTypeName, finestra) e riepilogo finale in JSON e nel
+    formato textfile di Prometheus (node_exporter textfile collector).
+    Thread-safe: condivisa tra fetcher, worker e writer DB.
+    """
+    MAX_SAMPLES = 10000  # campioni tenuti per timer, per i percentili
+    MAX_ERROR_EXAMPLES = 50
+    # Campi del contesto d'errore usati come label (gli altri, es. data o finestra, solo negli esempi)
+    ERROR_LABELS = ("endpoint", "data_type", "sink", "section")
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}  # (nome, labels) -> valore
+        self._gauges = {}    # (nome, labels) -> valore
+        self._timers = {}    # (nome, labels) -> {"count", "sum", "max", "samples"}
+        self._errors = deque(maxlen=self.MAX_ERROR_EXAMPLES)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def incr(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            t = self._timers.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0, "samples": []})
+            t["count"] += 1
+            t["sum"] += seconds
+            t["max"] = max(t["max"], seconds)
+            if len(t["samples"]) < self.MAX_SAMPLES: t["samples"].append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def error(self, name, error, **context):
+        """Conta l'errore per classe (e status HTTP se presente) e ne conserva un esempio con il contesto."""
+        status = getattr(getattr(error, 'resp', None), 'status', None)
+        labels = {k: v for k, v in context.items() if k in self.ERROR_LABELS}
+        self.incr(name, error=type(error).__name__, status=status, **labels)
+        with self._lock:
+            self._errors.append(dict(context, error=type(error).__name__, status=status,
+                                     message=str(error)[:300], at=time.time()))
+
+    # --- Riepilogo ---
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timers = {k: dict(v, samples=list(v["samples"])) for k, v in self._timers.items()}
+            errors = list(self._errors)
+
+        def label_str(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+
+        out = {
+            "started_at": self.started_at,
+            "duration_s": round(time.time() - self.started_at, 3),
+            "counters": {}, "gauges": {}, "timers": {}, "error_examples": errors
+        }
+        for (name, labels), v in sorted(counters.items()):
+            out["counters"].setdefault(name, {})[label_str(labels)] = v
+        for (name, labels), v in sorted(gauges.items()):
+            out["gauges"].setdefault(name, {})[label_str(labels)] = v
+        for (name, labels), t in sorted(timers.items()):
+            samples = sorted(t["samples"])
+            pct = lambda p: round(samples[min(len(samples) - 1, int(len(samples) * p / 100))], 4) if samples else None
+            out["timers"].setdefault(name, {})[label_str(labels)] = {
+                "count": t["count"], "sum_s": round(t["sum"], 4), "max_s": round(t["max"], 4),
+                "p50_s": pct(50), "p95_s": pct(95)
+            }
+        return out
+
+    def write_json(self, path):
+        self._atomic_write(path, json.dumps(self.summary(), indent=2, default=str))
+
+    def write_prometheus(self, path):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timers = {k: (v["count"], v["sum"]) for k, v in self._timers.items()}
+
+        def fmt(name, labels, value):
+            lbl = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}"
+
+        lines = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({n for n, _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(fmt(n, l, v) for (n, l), v in sorted(series.items()) if n == name)
+        for name in sorted({n for n, _ in timers}):
+            lines.append(f"# TYPE {name} summary")
+            for (n, l), (count, total) in sorted(timers.items()):
+                if n != name: continue
+                lines.append(fmt(f"{name}_sum", l, round(total, 6)))
+                lines.append(fmt(f"{name}_count", l, count))
+        lines.append("# TYPE run_duration_seconds gauge")
+        lines.append(f"run_duration_seconds {round(time.time() - self.started_at, 3)}")
+        lines.append("# TYPE run_last_completed_timestamp_seconds gauge")
+        lines.append(f"run_last_completed_timestamp_seconds {int(time.time())}")
+        self._atomic_write(path, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def _atomic_write(path, text):
+        # Scrittura atomica: il collector non deve mai leggere un file a metà
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+class StartupProfiler:
+    """
+    Modalità di misura dell'avvio (PROFILE_STARTUP in main): tempo di import e di
+    inizializzazione di ogni componente, stampato in tabella e registrato in RunMetrics.
+    Disattivato, step() non misura nulla.
+    """
+    def __init__(self, enabled=False, started_at=None):
+        self.enabled = enabled
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - t0))
+
+    def report(self, metrics=None):
+        if not self.enabled: return
+        total = time.perf_counter() - self.started_at
+        print("\n⏱️ Tempi di avvio:")
+        for name, seconds in self.steps:
+            print(f"   {name:<42} {seconds * 1000:>8.1f} ms")
+        print(f"   {'Totale (da inizio processo main)':<42} {total * 1000:>8.1f} ms")
+        if metrics is not None:
+            for name, seconds in self.steps:
+                metrics.gauge("startup_seconds", round(seconds, 4), component=name)
+            metrics.gauge("startup_total_seconds", round(total, 4))
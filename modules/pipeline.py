@@ -0,0 +1,142 @@
+import os
+import time
+import queue
+import threading
+from modules.report_renderer import write_report_if_changed
+
+class Sink:
+    """
+    Stadio consumer della pipeline giornaliera. Riceve (date_str, metrics) in ordine di data,
+    da un thread dedicato. Non deve modificare `metrics` (è condiviso con gli altri stadi).
+    Le chiavi che iniziano con "_" (es. le SampleSeries esatte in "_series") esistono solo in memoria.
+    """
+    name = "sink"
+
+    def handle(self, date_str, metrics):
+        raise NotImplementedError
+
+    def close(self):
+        """Chiamato una volta a fine run, dopo l'ultimo giorno (flush, riepiloghi)."""
+        pass
+
+
+class DbSink(Sink):
+    """Accoda le righe al BufferedDailyLogWriter (che scrive su Supabase a blocchi)."""
+    name = "db"
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def handle(self, date_str, metrics):
+        row = {k: v for k, v in metrics.items() if not k.startswith("_")}  # Chiavi "_": solo in memoria, non colonne
+        if not self.writer.add(row):
+            print(f"   ⏭️ DB {date_str}: nessuna modifica, riga non riscritta")
+
+    def close(self):
+        self.writer.close() # Flush finale
+        print(f"\n💾 DB: {self.writer.written} giorni scritti, {self.writer.skipped} invariati (saltati), {len(self.writer.failures)} falliti")
+        for date_str, err in sorted(self.writer.failures.items()):
+            print(f"   ⚠️ Errore scrittura DB {date_str} (Ma continuo): {err}")
+
+
+class ReportFileSink(Sink):
+    """Scrive il report testuale di ogni giorno in `directory/report_<data>.txt` (solo se il contenuto cambia)."""
+    name = "report"
+
+    def __init__(self, render, directory="reports"):
+        self.render = render
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def handle(self, date_str, metrics):
+        filename = os.path.join(self.directory, f"report_{date_str}.txt")
+        if write_report_if_changed(filename, self.render(metrics, date_str)):
+            print(f"   📄 Report creato: {filename}")
+        else:
+            print(f"   ⏭️ Report invariato: {filename}")
+
+
+class HistorySink(Sink):
+    """Aggiunge ogni giorno allo storico colonnare locale (HistoryStore) per le analisi offline."""
+    name = "history"
+
+    def __init__(self, store):
+        self.store = store
+
+    def handle(self, date_str, metrics):
+        self.store.append_day(date_str, metrics)
+
+
+class DailyPipeline:
+    """
+    Pipeline a stadi: il produttore (generatore di (date_str, metrics, errore)) alimenta
+    ogni sink tramite una coda limitata e un thread per sink. Fetch, scritture DB e scritture
+    su disco si sovrappongono; se un sink è lento la sua coda si riempie e il fetch rallenta
+    (backpressure) invece di accumulare giorni in memoria.
+    Gli errori restano isolati: un giorno che fallisce in un sink non blocca né gli altri
+    giorni né gli altri sink (raccolti in `errors[nome_sink][data]`).
+    I giorni incompleti (risposte Fit non scaricate nemmeno dopo i retry) passano comunque
+    agli stadi, con i campi mancanti a None, e vengono elencati in `partial[data]`.
+    """
+    _STOP = object()
+
+    def __init__(self, sinks, queue_size=8, metrics=None):
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.errors = {s.name: {} for s in self.sinks}
+        self.fetch_errors = {}
+        self.partial = {}
+        self.processed = 0
+        self.dates = []  # giorni passati agli stadi, in ordine
+
+    def run(self, source):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.sinks]
+        threads = [threading.Thread(target=self._consume, args=(sink, q), name=f"sink-{sink.name}", daemon=True)
+                   for sink, q in zip(self.sinks, queues)]
+        for t in threads: t.start()
+
+        try:
+            for date_str, metrics, fetch_error in source:
+                print(f"\n🔄 Elaborazione: {date_str}")
+                if fetch_error is not None:
+                    # Se non ho i dati, passo al prossimo giorno
+                    print(f"   ❌ ERRORE FETCH DATI: {fetch_error}")
+                    self.fetch_errors[date_str] = fetch_error
+                    continue
+                metrics['date'] = date_str # Chiave primaria per DB
+                self.processed += 1
+                self.dates.append(date_str)
+                status = metrics.get('raw_data', {}).get('fetch_status', {})
+                if not status.get('complete', True):
+                    print(f"   ⚠️ Giorno incompleto, da riscaricare (mancano: {', '.join(status['missing'])})")
+                    self.partial[date_str] = status['missing']
+                for q in queues: q.put((date_str, metrics))
+        finally:
+            for q in queues: q.put(self._STOP)
+            for t in threads: t.join()
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except Exception as e:
+                    self._on_error(sink, "close", e)
+        return self
+
+    def _consume(self, sink, q):
+        while True:
+            item = q.get()
+            if item is self._STOP: return
+            date_str, metrics = item
+            t0 = time.perf_counter()
+            try:
+                sink.handle(date_str, metrics)
+            except Exception as e:
+                self._on_error(sink, date_str, e)
+            if self.metrics is not None:
+                self.metrics.observe("sink_duration_seconds", time.perf_counter() - t0, sink=sink.name)
+
+    def _on_error(self, sink, date_str, error):
+        self.errors[sink.name][date_str] = error
+        print(f"   ❌ Errore {sink.name} {date_str}: {error}")
+        if self.metrics is not None:
+            self.metrics.error("sink_errors_total", error, sink=sink.name, date=date_str)
@@ -0,0 +1,87 @@
+import os
+import time
+import hashlib
+
+# Righe che cambiano a ogni generazione senza che cambi il contenuto del report
+VOLATILE_PREFIXES = ("Generato il:",)
+
+def report_fingerprint(text):
+    """Hash del contenuto di un report, escluse le righe volatili (timestamp di generazione)."""
+    stable = "\n".join(l for l in text.splitlines() if not l.startswith(VOLATILE_PREFIXES))
+    return hashlib.sha256(stable.encode('utf-8')).hexdigest()
+
+def write_report_if_changed(path, text):
+    """
+    Scrive il report solo se il contenuto è cambiato rispetto al file esistente: mtime e tool
+    di sincronizzazione (Drive, Syncthing...) non vedono modifiche fittizie. True se scritto.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            if report_fingerprint(f.read()) == report_fingerprint(text): return False
+    except OSError:
+        pass
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+def _render_one(job):
+    """Eseguito nei processi del pool: (render, directory, date_str, payload) -> (date_str, esito, errore)."""
+    render, directory, date_str, payload = job
+    try:
+        text = render(payload, date_str)
+        written = write_report_if_changed(os.path.join(directory, f"report_{date_str}.txt"), text)
+        return date_str, "written" if written else "unchanged", None
+    except Exception as e:
+        return date_str, "error", f"{type(e).__name__}: {e}"
+
+
+class ReportRenderer:
+    """
+    Rigenera i report giornalieri da metriche già salvate (storico locale o Supabase),
+    senza chiamate a Google Fit. Il rendering è distribuito su un pool di processi;
+    ogni file viene riscritto solo se il suo contenuto cambia (write_report_if_changed).
+    render: funzione (payload, date_str) -> testo, importabile dai processi figli
+    (es. main.generate_daily_report). workers=1: tutto nel processo corrente.
+    """
+    def __init__(self, render, directory="reports", workers=None, metrics=None):
+        self.render = render
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.metrics = metrics
+        self.written = []
+        self.unchanged = 0
+        self.errors = {}
+
+    def run(self, days):
+        """days: [(date_str, payload)]. Ritorna self con written / unchanged / errors."""
+        os.makedirs(self.directory, exist_ok=True)
+        jobs = [(self.render, self.directory, date_str, payload) for date_str, payload in days]
+        t0 = time.perf_counter()
+        if self.workers <= 1 or len(jobs) <= 1:
+            self._collect(map(_render_one, jobs))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                # Blocchi di giorni per processo: il costo è nel pickling, non nel rendering
+                chunksize = max(1, len(jobs) // (self.workers * 4))
+                self._collect(pool.map(_render_one, jobs, chunksize=chunksize))
+        elapsed = time.perf_counter() - t0
+
+        if self.metrics is not None:
+            self.metrics.incr("reports_rendered_total", len(self.written), outcome="written")
+            self.metrics.incr("reports_rendered_total", self.unchanged, outcome="unchanged")
+            self.metrics.incr("reports_rendered_total", len(self.errors), outcome="error")
+            self.metrics.gauge("report_render_seconds", round(elapsed, 3))
+        print(f"📄 Report: {len(self.written)} riscritti, {self.unchanged} invariati, {len(self.errors)} errori "
+              f"({len(jobs)} giorni in {elapsed:.2f}s, {self.workers} processi)")
+        for date_str, err in sorted(self.errors.items()):
+            print(f"   ❌ Errore report {date_str}: {err}")
+        return self
+
+    def _collect(self, results):
+        for date_str, outcome, error in results:
+            if outcome == "written": self.written.append(date_str)
+            elif outcome == "unchanged": self.unchanged += 1
+            else: self.errors[date_str] = error
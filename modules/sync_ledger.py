@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import pytz
+
+class SyncLedger:
+    """
+    Registro locale (SQLite) dello stato di sincronizzazione di ogni giorno:
+    quando è stato sincronizzato, se era completo e se è definitivo.
+    Un giorno diventa definitivo solo se completo E sincronizzato dopo la finestra di
+    assestamento (settle_hours dopo la fine del giorno): i dati dell'orologio, soprattutto
+    il sonno della notte prima, arrivano spesso in ritardo.
+    La modalità incrementale di main rielabora solo i giorni non definitivi (mancanti,
+    incompleti, falliti o ancora recenti).
+    """
+    def __init__(self, path=None, settle_hours=48, timezone='Europe/Rome'):
+        if path is None:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            path = os.path.join(base_dir, 'cache', 'sync_ledger.sqlite')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.settle_s = settle_hours * 60 * 60
+        self.tz = pytz.timezone(timezone)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_days ("
+            " date TEXT PRIMARY KEY, synced_at REAL NOT NULL, complete INTEGER NOT NULL,"
+            " finalized INTEGER NOT NULL, missing TEXT, last_error TEXT, attempts INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _day_end(self, date_str):
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+        return self.tz.localize(day + timedelta(days=1)).timestamp()
+
+    def record(self, date_str, complete, missing=(), error=None, synced_at=None):
+        """Esito della sincronizzazione di un giorno (fetch + scrittura negli stadi)."""
+        synced_at = synced_at if synced_at is not None else time.time()
+        finalized = complete and synced_at >= self._day_end(date_str) + self.settle_s
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sync_days (date, synced_at, complete, finalized, missing, last_error, attempts)"
+                " VALUES (?, ?, ?, ?, ?, ?, 1)"
+                " ON CONFLICT(date) DO UPDATE SET synced_at = excluded.synced_at, complete = excluded.complete,"
+                " finalized = excluded.finalized, missing = excluded.missing, last_error = excluded.last_error,"
+                " attempts = sync_days.attempts + 1",
+                (date_str, synced_at, int(bool(complete)), int(finalized), json.dumps(list(missing)),
+                 str(error)[:500] if error is not None else None)
+            )
+            self._conn.commit()
+
+    def get(self, date_str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT synced_at, complete, finalized, missing, last_error, attempts FROM sync_days WHERE date = ?",
+                (date_str,)
+            ).fetchone()
+        if row is None: return None
+        return {"synced_at": row[0], "complete": bool(row[1]), "finalized": bool(row[2]),
+                "missing": json.loads(row[3] or "[]"), "last_error": row[4], "attempts": row[5]}
+
+    def pending(self, start_date, end_date):
+        """Giorni di [start_date, end_date] da (ri)sincronizzare: tutti quelli non definitivi, in ordine."""
+        return self._days_without(start_date, end_date, "finalized")
+
+    def incomplete(self, start_date, end_date):
+        """Giorni di [start_date, end_date] mai sincronizzati per intero (anche se ancora in assestamento)."""
+        return self._days_without(start_date, end_date, "complete")
+
+    def _days_without(self, start_date, end_date, flag):
+        with self._lock:
+            flagged = {r[0] for r in self._conn.execute(
+                f"SELECT date FROM sync_days WHERE {flag} = 1 AND date BETWEEN ? AND ?",
+                (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+            )}
+        days = []
+        current = start_date
+        while current <= end_date:
+            if current.strftime("%Y-%m-%d") not in flagged: days.append(current)
+            current += timedelta(days=1)
+        return days
+
+    @staticmethod
+    def contiguous_ranges(days):
+        """[(inizio, fine)] dei blocchi di giorni consecutivi: ogni blocco è un solo range di fetch."""
+        ranges = []
+        for day in days:
+            if ranges and day - ranges[-1][1] == timedelta(days=1):
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+        return [tuple(r) for r in ranges]
+
+    def stats(self):
+        with self._lock:
+            total, complete, finalized = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(complete), 0), COALESCE(SUM(finalized), 0) FROM sync_days"
+            ).fetchone()
+        return {"days": total, "complete": complete, "finalized": finalized}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,53 @@
+"""
+Rigenera i report giornalieri (reports/report_YYYY-MM-DD.txt) da metriche già salvate,
+senza chiamate a Google Fit: utile dopo una modifica al layout di generate_daily_report.
+
+Esempi:
+    python render_reports.py --start 2025-01-01                  # dallo storico locale, fino a ieri
+    python render_reports.py --start 2025-01-01 --source db      # da Supabase daily_logs
+    python render_reports.py --start 2025-01-01 --workers 1      # senza pool di processi
+
+Il rendering gira su un pool di processi; un file viene riscritto solo se il suo contenuto
+cambia (la riga "Generato il" è esclusa dal confronto), così mtime e sync non si muovono.
+Lo storico locale è quello di main.py (HISTORY_DIR, SAVE_TO_HISTORY).
+"""
+import argparse
+from datetime import datetime, timedelta
+
+import main as app_main
+from modules.report_renderer import ReportRenderer
+
+
+def load_days(source, start, end):
+    """[(date_str, payload)] dei giorni salvati in [start, end]."""
+    if source == "db":
+        from modules.db_manager import SupabaseManager
+        return [(row['date'], row) for row in SupabaseManager().fetch_daily_logs(start, end)]
+    from modules.history_store import HistoryStore
+    return HistoryStore(app_main.history_dir()).payloads(start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rigenera i report dalle metriche salvate, senza Google Fit")
+    parser.add_argument("--start", required=True, help="Primo giorno (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Ultimo giorno (YYYY-MM-DD, default: ieri)")
+    parser.add_argument("--source", choices=("history", "db"), default="history",
+                        help="history: storico locale (default) | db: Supabase daily_logs")
+    parser.add_argument("--workers", type=int, default=None, help="Processi di rendering (default: CPU)")
+    parser.add_argument("--output", default=None, help="Directory dei report (default: quella di main.py, reports_fake col backend finto)")
+    args = parser.parse_args()
+
+    print("--- 🚀 MY LIFE TRACKER: RENDER REPORT ---")
+    end = args.end or (datetime.now().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+    days = load_days(args.source, args.start, end)
+    print(f"🗃️ {len(days)} giorni salvati tra {args.start} e {end} ({args.source})")
+    if not days:
+        print("⚠️ Nessun giorno da rigenerare: eseguire prima main.py con SAVE_TO_HISTORY o SAVE_TO_DB")
+        return
+
+    ReportRenderer(app_main.generate_daily_report, args.output or app_main.reports_dir(), workers=args.workers).run(days)
+    print("\n✅ FINE ELABORAZIONE.")
+
+
+if __name__ == "__main__":
+    main()
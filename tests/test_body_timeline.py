@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from modules.fit.fake_service import FakeFitService
+from modules.fit.step_source import StepSourceCache
+from modules.fit_service import GoogleFitService
+
+BODY_FIELDS = GoogleFitService._BODY_FIELDS
+
+
+def _service(tmp_path, name, fake):
+    return GoogleFitService(fake, batch=True, service_factory=lambda: fake, raw_hr=False,
+                            step_source=StepSourceCache(path=str(tmp_path / f"{name}_step_source.json")))
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_range_timeline_matches_per_day_fetch(tmp_path, seed):
+    """Le misure corporee dalla BodyTimeline del range sono identiche a quelle delle query per giorno."""
+    fake = FakeFitService(seed=seed)
+    start = datetime(2026, 1, 1)
+    end = start + timedelta(days=44)
+
+    ranged = {d: m for d, m, err in _service(tmp_path, "range", fake).get_range_metrics(start, end, workers=1)}
+    per_day = _service(tmp_path, "day", fake)
+    assert len(ranged) == 45
+    for date_str, metrics in ranged.items():
+        expected = per_day.get_full_day_metrics(datetime.strptime(date_str, "%Y-%m-%d"))
+        assert {f: metrics[f] for f in BODY_FIELDS} == {f: expected[f] for f in BODY_FIELDS}, date_str
+    # Finestra con più pesate: la media della finestra, non l'ultima misura
+    assert len({m["health_weight_kg"] for m in ranged.values()}) > 1
+
+
+def test_summary_is_window_average():
+    from modules.fit.timeline import BodyTimeline
+    timeline = BodyTimeline()
+    page = {"point": [{"startTimeNanos": str(ts * 1_000_000), "value": [{"fpVal": v}]}
+                      for ts, v in ((1000, 70.0), (2000, 71.0), (3000, 72.0))]}
+    timeline.add_points("com.google.weight", page)
+    assert timeline.summary("com.google.weight", 0, 3001) == [{"fpVal": 71.0}, {"fpVal": 72.0}, {"fpVal": 70.0}]
+    assert timeline.summary("com.google.weight", 1500, 3000) == [{"fpVal": 71.0}, {"fpVal": 71.0}, {"fpVal": 71.0}]
+    assert timeline.summary("com.google.weight", 3001, 9000) is None
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from modules.fit.series import SampleSeries, PAYLOAD_SERIES_KEY
+from modules.history_store import HistoryStore
+
+
+def _payload(series):
+    return {
+        "health_avg_hr": 70,
+        "raw_data": {"heart_rate_samples": series.to_dicts("bpm"), "fetch_status": {"complete": True, "missing": []}},
+        PAYLOAD_SERIES_KEY: {"heart_rate": series},
+    }
+
+
+def test_samples_keep_exact_timestamps(tmp_path):
+    """Il giorno di Roma inizia alle 23:00 UTC del giorno prima: i timestamp salvati sono quelli esatti, non "HH:MM"."""
+    first = int(datetime(2026, 1, 2, 23, 0, tzinfo=timezone.utc).timestamp() * 1000)
+    series = SampleSeries([first + i * 300_000 for i in range(288)], np.arange(288) % 40 + 50)
+    store = HistoryStore(str(tmp_path))
+    store.append_day("2026-01-03", _payload(series))
+
+    stored = store.samples("heart_rate", "2026-01-03", "2026-01-03")
+    assert stored.ts_ms.tolist() == series.ts_ms.tolist()
+    assert stored.values.tolist() == series.values.tolist()
+
+    # Nel JSON dei payload né la lista "HH:MM" né le serie in memoria
+    (date_str, payload), = store.payloads("2026-01-03", "2026-01-03")
+    assert PAYLOAD_SERIES_KEY not in payload and "heart_rate_samples" not in payload["raw_data"]
+
+
+def test_legacy_hhmm_list_is_not_reparsed(tmp_path):
+    """Senza serie esatte la lista storica "HH:MM" non basta: nessun campione inventato."""
+    series = SampleSeries([1_767_394_800_000], [60.0])
+    payload = _payload(series)
+    del payload[PAYLOAD_SERIES_KEY]
+    store = HistoryStore(str(tmp_path))
+    store.append_day("2026-01-03", payload)
+    assert len(store.samples("heart_rate", "2026-01-03", "2026-01-03")) == 0
+    assert store.daily("2026-01-03", "2026-01-03")["health_avg_hr"].tolist() == [70.0]